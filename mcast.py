@@ -37,6 +37,8 @@ Comenzando, recomendaría no hacer este archivo demasiado elegante.
 Simplemente use definiciones de clases básicas de Python.  Puede 
 agregar mejoras de usabilidad más adelante.
 '''
+from array       import array
+from bisect      import bisect_right
 from dataclasses import dataclass, field
 from multimethod import multimeta
 from typing      import List
@@ -55,7 +57,13 @@ class Visitor(metaclass=multimeta):
 class Node:
     '''
     Representa cualquier nodo del AST
+
+    span es la posicion del nodo en el texto fuente, (inicio, fin)
+    empacados en un solo entero (ver pack_span/node_span).  La linea y
+    la columna se calculan solo cuando se necesitan, con un LineIndex.
     '''
+    span : int = field(default=None, kw_only=True, compare=False, repr=False)
+
     def accept(self, v:Visitor, *args, **kwargs):
         return v.visit(self, *args, **kwargs)
 
@@ -162,9 +170,154 @@ class Unary(Expression):
 @dataclass
 class Variable(Expression):
     name : str
+    sym  : int = field(default=None, compare=False, repr=False)  # id del simbolo resuelto
+
+@dataclass
+class Call(Expression):
+    func : Expression
+    args : List[Expression] = field(default_factory=list)
+
+@dataclass
+class Index(Expression):
+    expr : Expression
+    index: Expression
 
 @dataclass
 class Literal(Expression):
     value : any
 
 
+
+
+
+# ----------------------------------------------------------------------
+# Utilidades
+#
+# El parser todavia entrega algunas partes del programa como tuplas
+# (declaradores, bloques compuestos, parametros).  Estas funciones
+# encapsulan esas formas para que los demas modulos no dependan de
+# ellas directamente.
+# ----------------------------------------------------------------------
+
+def declarator_name(decl):
+    '''
+    Nombre declarado por un declarador:
+
+        Variable('x')                  -> 'x'
+        ('*', declarador)              -> nombre del declarador
+        (Variable('f'), parametros)    -> 'f'
+    '''
+    while not isinstance(decl, Variable):
+        if isinstance(decl, tuple) and decl[0] == '*':
+            decl = decl[1]
+        elif isinstance(decl, tuple):
+            decl = decl[0]
+        else:
+            return None
+    return decl.name
+
+
+def pointer_type(type, decl):
+    '''
+    Separa los '*' de un declarador y los agrega al tipo base:
+
+        ('int', ('*', ('*', Variable('p'))))  -> ('int**', Variable('p'))
+    '''
+    while isinstance(decl, tuple) and decl[0] == '*':
+        type += '*'
+        decl = decl[1]
+    return type, decl
+
+
+def param_list(params):
+    '''
+    Devuelve (parametros, variadic).  Los parametros llegan como una
+    lista de (tipo, declarador), o como (lista, '...') si la funcion
+    termina en ELLIPSIS.
+    '''
+    if isinstance(params, tuple):
+        return params[0], True
+    return params or [], False
+
+
+def block_items(stmt):
+    '''
+    Lista plana de declaraciones/sentencias de un bloque.  Un bloque
+    compuesto llega como (declaraciones, sentencias), solo como la lista
+    de declaraciones (o None) si no tiene sentencias, o como una sentencia
+    suelta.
+    '''
+    if stmt is None:
+        return []
+    if isinstance(stmt, tuple):
+        decls, stmts = stmt
+        return (decls or []) + (stmts or [])
+    if isinstance(stmt, list):
+        return stmt
+    return [ stmt ]
+
+
+# Posiciones en el texto fuente
+
+SPAN_BITS = 32
+
+def pack_span(start, end):
+    '''
+    Empaca (inicio, fin) en un solo entero.  Un entero ocupa menos que
+    una tupla de dos enteros y no hace falta un objeto por nodo.
+    '''
+    return start << SPAN_BITS | end
+
+
+def node_span(node):
+    '''
+    (inicio, fin) de node en el texto, o None si no tiene posicion.
+    '''
+    span = node.span
+    if span is None:
+        return None
+    return span >> SPAN_BITS, span & ((1 << SPAN_BITS) - 1)
+
+
+class LineIndex:
+    '''
+    Inicio de cada linea de un texto, calculado una sola vez por archivo.
+    Convierte una posicion en (linea, columna), ambas desde 1, con una
+    busqueda binaria.
+    '''
+    def __init__(self, text):
+        starts = array('Q', [ 0 ])
+        pos = text.find('\n')
+        while pos >= 0:
+            starts.append(pos + 1)
+            pos = text.find('\n', pos + 1)
+        self.starts = starts
+
+    def position(self, index):
+        line = bisect_right(self.starts, index)
+        return line, index - self.starts[line - 1] + 1
+
+    def lineno(self, index):
+        return bisect_right(self.starts, index)
+
+    def location(self, node):
+        '''
+        (linea, columna) del inicio de node, o None.
+        '''
+        span = node_span(node) if node is not None else None
+        return None if span is None else self.position(span[0])
+
+
+def walk(node):
+    '''
+    Recorre en profundidad todos los nodos alcanzables desde node,
+    incluyendo los que estan dentro de tuplas y listas.
+    '''
+    stack = [ node ]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, Node):
+            yield x
+            stack.extend(reversed(list(vars(x).values())))
+        elif isinstance(x, (list, tuple)):
+            stack.extend(reversed(x))
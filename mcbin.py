@@ -0,0 +1,425 @@
+# mcbin.py
+'''
+Formato binario para arboles de mcast.
+
+    data = dumps(ast)               -> bytes
+    ast  = loads(data)              bytes, bytearray, memoryview o mmap
+    dump(ast, file) / load(file)
+
+Un flujo empieza con un encabezado
+
+    b'MCAST' version
+
+seguido de uno o mas arboles.  Cada valor se escribe como una etiqueta
+de un byte y su contenido:
+
+    NONE FALSE TRUE                 sin contenido
+    INT    varint (zigzag)
+    FLOAT  8 bytes (double, little endian)
+    STR    varint n, n bytes utf-8     cadena nueva; se agrega a la tabla
+    REF    varint i                    cadena i de la tabla
+    LIST   varint n, n valores
+    TUPLE  varint n, n valores
+    NODE+k  nodo de la clase CLASSES[k]: sus campos en orden y el span
+
+El span de un nodo se escribe como un varint 0 si no tiene posicion; si
+no, como el inicio relativo al inicio del ultimo span escrito (zigzag,
+mas 1) y un varint con la longitud fin - inicio.  Los nodos se escriben
+despues de sus hijos y un padre empieza poco antes que su primer hijo,
+asi que casi siempre son dos bytes en lugar de los cinco o seis del
+span empacado.
+
+Los varint son LEB128 sin signo (7 bits por byte).  Los identificadores,
+nombres de tipo y operadores aparecen muchas veces: solo la primera vez
+se escriben completos y despues como un indice en la tabla de cadenas.
+La tabla se arma mientras se escribe y se reconstruye mientras se lee,
+asi que el flujo se puede codificar y decodificar sin conocerla antes.
+
+Los campos con compare=False que no son el span (Variable.sym) son
+anotaciones del Checker y no se guardan.
+
+La version cambia cada vez que cambian CLASSES o los campos de algun
+nodo; loads() rechaza datos de otra version.
+
+    python mcbin.py --bench [N]     compara con pickle (protocolo 5) y JSON
+'''
+import os
+import struct
+from dataclasses import fields
+
+from mcast import *
+
+
+MAGIC   = b'MCAST'
+VERSION = 2
+
+CLASSES = (
+    TranslationUnit,
+    FuncDefinition,
+    VarDefinition,
+    WhileLoop,
+    ForLoop,
+    Continue,
+    Return,
+    Break,
+    IfStmt,
+    ExprStmt,
+    Binary,
+    Unary,
+    Variable,
+    Literal,
+    Call,
+    Index,
+)
+
+NONE, FALSE, TRUE, INT, FLOAT, STR, REF, LIST, TUPLE = range(9)
+NODE = 16
+
+FIELDS = [ tuple(f.name for f in fields(cls) if f.compare) for cls in CLASSES ]
+
+DOUBLE = struct.Struct('<d')
+
+SPAN_MASK = (1 << SPAN_BITS) - 1
+
+
+class FormatError(ValueError):
+    pass
+
+
+# ----------------------------------------------------------------------
+# Codificacion
+# ----------------------------------------------------------------------
+class Encoder:
+    '''
+    Escribe arboles en file.  Los bytes se acumulan en un bytearray que
+    se vacia en el archivo cada vez que supera chunk_size, al terminar
+    cualquier nodo: un arbol grande sale en trozos acotados.
+    '''
+    chunk_size = 1 << 16
+
+    def __init__(self, file):
+        self.file    = file
+        self.buf     = bytearray(MAGIC)
+        self.strings = {}
+        self.start   = 0        # inicio del ultimo span escrito
+        self.tags    = { cls: NODE + k for k, cls in enumerate(CLASSES) }
+        self.varint(VERSION)
+
+    def flush(self):
+        if self.buf:
+            self.file.write(self.buf)
+            self.buf = bytearray()
+
+    def encode(self, node):
+        self.value(node)
+
+    def varint(self, n):
+        buf = self.buf
+        while n >= 0x80:
+            buf.append(n & 0x7f | 0x80)
+            n >>= 7
+        buf.append(n)
+
+    def span(self, span):
+        if span is None:
+            self.buf.append(0)
+            return
+        start = span >> SPAN_BITS
+        d = start - self.start
+        self.start = start
+        self.varint((d << 1 if d >= 0 else (-d << 1) - 1) + 1)
+        self.varint((span & SPAN_MASK) - start)
+
+    def tag(self, cls):
+        # Subclases de los nodos (p.ej. las de mccons) usan la etiqueta
+        # de su clase de mcast
+        for base in cls.__mro__:
+            if base in self.tags:
+                self.tags[cls] = self.tags[base]
+                return self.tags[cls]
+        raise TypeError(f'{cls.__name__} no es un nodo de mcast')
+
+    def value(self, v):
+        buf = self.buf
+        t = type(v)
+        if t is str:
+            i = self.strings.get(v)
+            if i is None:
+                self.strings[v] = len(self.strings)
+                data = v.encode('utf-8')
+                buf.append(STR)
+                self.varint(len(data))
+                buf += data
+            else:
+                buf.append(REF)
+                self.varint(i)
+        elif v is None:
+            buf.append(NONE)
+        elif t is bool:
+            buf.append(TRUE if v else FALSE)
+        elif t is int:
+            buf.append(INT)
+            self.varint(v << 1 if v >= 0 else (-v << 1) - 1)
+        elif t is float:
+            buf.append(FLOAT)
+            buf += DOUBLE.pack(v)
+        elif t is list or t is tuple:
+            buf.append(LIST if t is list else TUPLE)
+            self.varint(len(v))
+            for item in v:
+                self.value(item)
+        else:
+            tag = self.tags.get(t) or self.tag(t)
+            buf.append(tag)
+            for name in FIELDS[tag - NODE]:
+                self.value(getattr(v, name))
+            self.span(v.span)
+            # Los hijos pueden haber vaciado el buffer: se usa self.buf
+            if len(self.buf) >= self.chunk_size:
+                self.flush()
+
+
+def dump(node, file):
+    enc = Encoder(file)
+    enc.encode(node)
+    enc.flush()
+
+
+def dumps(node):
+    import io
+    out = io.BytesIO()
+    dump(node, out)
+    return out.getvalue()
+
+
+# ----------------------------------------------------------------------
+# Decodificacion
+# ----------------------------------------------------------------------
+class Decoder:
+    '''
+    Lee arboles de un buffer (bytes, bytearray, memoryview o mmap) sin
+    copiarlo: se recorre un memoryview y solo se crean los str de la
+    tabla de cadenas.  Iterar sobre el Decoder entrega los arboles del
+    flujo uno por uno.
+    '''
+    def __init__(self, data):
+        self.data    = memoryview(data).cast('B')
+        self.pos     = 0
+        self.strings = []
+        self.start   = 0        # inicio del ultimo span leido
+        try:
+            self.header()
+        except FormatError:
+            self.release()
+            raise
+
+    def header(self):
+        if bytes(self.data[:len(MAGIC)]) != MAGIC:
+            raise FormatError('no es un flujo de mcbin')
+        self.pos = len(MAGIC)
+        try:
+            version = self.varint()
+        except IndexError:
+            raise FormatError('datos truncados') from None
+        if version != VERSION:
+            raise FormatError(f'version {version} no soportada (se esperaba {VERSION})')
+
+    def release(self):
+        '''
+        Suelta el buffer (un mmap no se puede cerrar mientras haya vistas).
+        '''
+        self.data.release()
+
+    def __iter__(self):
+        while self.pos < len(self.data):
+            yield self.decode()
+
+    def varint(self):
+        data = self.data
+        pos  = self.pos
+        b = data[pos]
+        pos += 1
+        n = b & 0x7f
+        shift = 7
+        while b & 0x80:
+            b = data[pos]
+            pos += 1
+            n |= (b & 0x7f) << shift
+            shift += 7
+        self.pos = pos
+        return n
+
+    def decode(self):
+        try:
+            return self.value()
+        except IndexError:
+            raise FormatError('datos truncados') from None
+
+    def value(self):
+        data = self.data
+        tag  = data[self.pos]
+        self.pos += 1
+        if tag >= NODE:
+            k = tag - NODE
+            if k >= len(CLASSES):
+                raise FormatError(f'etiqueta {tag} desconocida')
+            value = self.value
+            args = [ value() for _ in FIELDS[k] ]
+            d = data[self.pos]
+            if d < 0x80:
+                self.pos += 1
+            else:
+                d = self.varint()
+            if not d:
+                return CLASSES[k](*args, span=None)
+            d -= 1
+            start = self.start + (d >> 1 if not d & 1 else -((d + 1) >> 1))
+            self.start = start
+            return CLASSES[k](*args, span=start << SPAN_BITS | start + self.varint())
+        if tag == REF:
+            i = data[self.pos]
+            if i < 0x80:
+                self.pos += 1
+                return self.strings[i]
+            return self.strings[self.varint()]
+        if tag == STR:
+            n = self.varint()
+            pos = self.pos
+            if pos + n > len(data):
+                raise FormatError('datos truncados')
+            s = str(data[pos:pos + n], 'utf-8')
+            self.pos = pos + n
+            self.strings.append(s)
+            return s
+        if tag == LIST:
+            value = self.value
+            return [ value() for _ in range(self.varint()) ]
+        if tag == TUPLE:
+            value = self.value
+            return tuple([ value() for _ in range(self.varint()) ])
+        if tag == INT:
+            n = self.varint()
+            return n >> 1 if not n & 1 else -((n + 1) >> 1)
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == FLOAT:
+            pos = self.pos
+            if pos + 8 > len(data):
+                raise FormatError('datos truncados')
+            self.pos = pos + 8
+            return DOUBLE.unpack_from(data, pos)[0]
+        raise FormatError(f'etiqueta {tag} desconocida')
+
+
+def loads(data):
+    return Decoder(data).decode()
+
+
+def load(file):
+    '''
+    Lee el primer arbol de file.  Los archivos en disco se leen con mmap.
+    '''
+    import mmap
+    try:
+        fd = file.fileno()
+    except (AttributeError, OSError):
+        return loads(file.read())
+    if os.fstat(fd).st_size == 0:
+        # mmap no acepta archivos vacios
+        return loads(b'')
+    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as m:
+        dec = Decoder(m)
+        try:
+            return dec.decode()
+        finally:
+            dec.release()
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+def to_json(v):
+    if isinstance(v, Node):
+        d = { name: to_json(getattr(v, name)) for name in FIELDS[CLASSES.index(type(v))] }
+        d['_'] = type(v).__name__
+        d['span'] = v.span
+        return d
+    if isinstance(v, tuple):
+        return { '_': 'tuple', 'items': [ to_json(x) for x in v ] }
+    if isinstance(v, list):
+        return [ to_json(x) for x in v ]
+    return v
+
+
+def from_json(v):
+    if isinstance(v, dict):
+        cls = v.pop('_')
+        if cls == 'tuple':
+            return tuple(from_json(x) for x in v['items'])
+        span = v.pop('span')
+        return globals()[cls](**{ k: from_json(x) for k, x in v.items() }, span=span)
+    if isinstance(v, list):
+        return [ from_json(x) for x in v ]
+    return v
+
+
+def bench(nlines=20000):
+    import json
+    import pickle
+    import sys
+    import time
+    from mclex import Lexer
+    from mcparse import Parser
+    from mccheck import generate
+
+    sys.setrecursionlimit(10000)
+    ast = Parser().parse(Lexer().tokenize(generate(nlines)))
+
+    def timed(f, *args, repeat=3):
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = f(*args)
+            t = time.perf_counter() - t0
+            best = t if best is None else min(best, t)
+        return result, best
+
+    formats = (
+        ('mcbin',    dumps, loads),
+        ('pickle 5', lambda a: pickle.dumps(a, protocol=5), pickle.loads),
+        ('json',     lambda a: json.dumps(to_json(a), separators=(',', ':')).encode(),
+                     lambda d: from_json(json.loads(d))),
+    )
+    print(f'{nlines} lineas')
+    print(f'  {"formato":10s} {"tamano":>10s} {"codificar":>10s} {"decodificar":>12s}  iguales')
+    for name, enc, dec in formats:
+        data, tenc = timed(enc, ast)
+        back, tdec = timed(dec, data)
+        print(f'  {name:10s} {len(data)/2**10:7.0f} KiB {1e3*tenc:7.0f} ms {1e3*tdec:9.0f} ms  {back == ast}')
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) in (2, 3) and sys.argv[1] == '--bench':
+        bench(*map(int, sys.argv[2:]))
+        exit(0)
+
+    if len(sys.argv) != 3 or sys.argv[1] not in ('dump', 'load'):
+        print(f"usage: python {sys.argv[0]} dump fname.c > out.mcb | load out.mcb | --bench [N]")
+        exit(1)
+
+    if sys.argv[1] == 'dump':
+        from mclex import Lexer
+        from mcparse import Parser
+
+        txt = open(sys.argv[2], encoding='utf-8').read()
+        ast = Parser().parse(Lexer().tokenize(txt))
+        dump(ast, sys.stdout.buffer)
+    else:
+        with open(sys.argv[2], 'rb') as f:
+            print(load(f))
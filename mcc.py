@@ -0,0 +1,375 @@
+# mcc.py
+'''
+Driver del compilador MiniC.
+
+    python mcc.py archivos/directorios...           compila una vez
+    python mcc.py --watch archivos/directorios...   recompila al guardar
+
+Cada archivo pasa por el lexer, el parser y el Checker.  Despues, el
+driver enlaza los archivos entre si: cada declaracion
+
+    extern type_specifier declarator ;
+
+(o prototipo de funcion sin definicion en el mismo archivo) se resuelve
+contra la definicion no static de otro archivo, y se informa si sus
+firmas no coinciden.
+
+Modo watch:
+
+    El driver mantiene el grafo de dependencias entre archivos: quien
+    define cada nombre (providers) y quien lo importa (importers).  Al
+    cambiar un archivo se reconstruye solo ese archivo y, si cambio la
+    firma de algo que exporta (o lo agrego o quito), los archivos cuyos
+    extern resuelven a esos nombres.
+
+    Los cambios se detectan con inotify (Linux, via ctypes) o, si no
+    esta disponible, revisando mtime/tamano cada cierto intervalo.  Los
+    eventos que llegan juntos (p.ej. un editor que escribe varios
+    archivos) se agrupan en un solo lote antes de reconstruir.
+'''
+import os
+import time
+
+from mcast import *
+
+
+# ----------------------------------------------------------------------
+# Unidades de compilacion
+# ----------------------------------------------------------------------
+class Unit:
+    '''
+    Resultado de compilar un archivo.
+
+        exports : {nombre: firma} de las definiciones no static
+        imports : {nombre: firma} de los extern y prototipos sin definicion
+        errors  : mensajes del parser y del Checker
+    '''
+    def __init__(self, path):
+        self.path    = path
+        self.exports = {}
+        self.imports = {}
+        self.errors  = []
+
+
+def signature(sym):
+    return (sym.kind, sym.type, sym.params, sym.variadic)
+
+
+def compile_file(path):
+    from mclex import Lexer
+    from mcparse import Parser
+    from mccheck import Checker
+
+    unit = Unit(path)
+    try:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError) as e:
+        # Borrado o a medio escribir entre el aviso y la lectura: se
+        # reporta y la unidad queda sin exports ni imports, fuera del grafo
+        # hasta el siguiente cambio.
+        unit.errors.append(f'no se pudo leer: {e.strerror if isinstance(e, OSError) else e}')
+        return unit
+    parser = Parser(recover=True)
+    ast = parser.parse(Lexer().tokenize(text))
+    if parser.errors:
+        # Todos los errores de sintaxis del archivo; el Checker no corre
+        # sobre un arbol incompleto.
+        unit.errors.extend(f'{e.lineno or "EOF"}: {e.msg}' for e in parser.errors)
+        return unit
+
+    checker = Checker.check(ast)
+    lines = LineIndex(text)
+    for msg, node in checker.errors:
+        where = lines.location(node)
+        unit.errors.append(f'{where[0]}:{where[1]}: {msg}' if where else msg)
+
+    globals_ = checker.scope.entries
+    for decl in ast.decl:
+        if isinstance(decl, FuncDefinition):
+            if not decl.static:
+                unit.exports[decl.name.name] = signature(globals_[decl.name.name])
+            continue
+        type, d = pointer_type(decl.type, decl.expr)
+        name = declarator_name(d)
+        sym  = globals_[name]
+        if isinstance(d, tuple) or decl.extern:
+            unit.imports[name] = signature(sym)
+        else:
+            unit.exports[name] = signature(sym)
+
+    # Un prototipo seguido de su definicion en el mismo archivo no es import
+    for name in list(unit.imports):
+        if name in unit.exports:
+            del unit.imports[name]
+    return unit
+
+
+def format_signature(name, sig):
+    kind, type, params, variadic = sig
+    if kind != 'func':
+        return f'{type} {name}'
+    params = ', '.join(params) + (', ...' if variadic else '')
+    return f'{type} {name}({params})'
+
+
+class Driver:
+
+    def __init__(self, paths):
+        self.roots     = paths
+        self.units     = {}     # path -> Unit
+        self.providers = {}     # nombre -> paths que lo definen
+        self.importers = {}     # nombre -> paths que lo importan
+
+    def sources(self):
+        '''
+        Archivos a compilar: los dados y los *.c de los directorios dados.
+        '''
+        files = []
+        for root in self.roots:
+            if os.path.isdir(root):
+                files += sorted(os.path.join(root, f) for f in os.listdir(root) if f.endswith('.c'))
+            elif os.path.exists(root):
+                files.append(root)
+        return [ os.path.abspath(f) for f in files ]
+
+    def directories(self):
+        return sorted({ root if os.path.isdir(root) else os.path.dirname(os.path.abspath(root)) or '.'
+                        for root in self.roots })
+
+    # ------------------------------------------------------------------
+    # Grafo de dependencias
+    # ------------------------------------------------------------------
+    def add(self, unit):
+        self.units[unit.path] = unit
+        for name in unit.exports:
+            self.providers.setdefault(name, set()).add(unit.path)
+        for name in unit.imports:
+            self.importers.setdefault(name, set()).add(unit.path)
+
+    def remove(self, path):
+        unit = self.units.pop(path, None)
+        if unit is None:
+            return
+        for name in unit.exports:
+            self.providers[name].discard(path)
+        for name in unit.imports:
+            self.importers[name].discard(path)
+
+    def link_errors(self, unit):
+        errors = []
+        for name, sig in unit.imports.items():
+            providers = self.providers.get(name)
+            if not providers:
+                continue                # externo (p.ej. printf de la libc)
+            for other in sorted(providers):
+                theirs = self.units[other].exports[name]
+                if theirs != sig:
+                    errors.append(f"'{format_signature(name, sig)}' no coincide con "
+                                  f"'{format_signature(name, theirs)}' definido en {other}")
+        for name in unit.exports:
+            if len(self.providers.get(name, ())) > 1:
+                others = sorted(self.providers[name] - { unit.path })
+                errors.append(f"'{name}' tambien esta definido en {', '.join(others)}")
+        return errors
+
+    # ------------------------------------------------------------------
+    # Compilacion
+    # ------------------------------------------------------------------
+    def build(self, paths):
+        '''
+        Compila paths (que pueden haber cambiado o desaparecido) y los
+        archivos afectados por cambios de firma.  Devuelve los paths
+        compilados.
+        '''
+        old = { p: self.units[p].exports for p in paths if p in self.units }
+        for path in paths:
+            self.remove(path)
+            if os.path.exists(path):
+                self.add(compile_file(path))
+
+        changed = set()
+        for path in paths:
+            before = old.get(path, {})
+            after  = self.units[path].exports if path in self.units else {}
+            for name in before.keys() | after.keys():
+                if before.get(name) != after.get(name):
+                    changed.add(name)
+
+        affected = set()
+        for name in changed:
+            affected |= self.importers.get(name, set())
+            # Una definicion duplicada que aparece o desaparece tambien
+            # cambia el resultado del enlace de los demas proveedores.
+            affected |= self.providers.get(name, set())
+        affected -= set(paths)
+        for path in affected:
+            self.remove(path)
+            self.add(compile_file(path))
+        return [ p for p in paths if p in self.units ] + sorted(affected)
+
+    def report(self, paths):
+        nerrors = 0
+        for path in paths:
+            unit = self.units[path]
+            for msg in unit.errors + self.link_errors(unit):
+                print(f'{os.path.relpath(path)}: {msg}')
+                nerrors += 1
+        return nerrors
+
+    def watch(self, poll=False, interval=0.2, settle=0.05):
+        files = self.sources()
+        t0 = time.perf_counter()
+        self.report(self.build(files))
+        print(f'[{len(files)} archivos compilados en {1e3*(time.perf_counter()-t0):.1f} ms; esperando cambios]')
+
+        watcher = None
+        if not poll:
+            try:
+                watcher = Inotify(self.directories(), settle)
+            except OSError:
+                pass
+        if watcher is None:
+            watcher = Poller(self, interval, settle)
+
+        while True:
+            changed, first = watcher.wait()
+            changed = sorted(p for p in changed if p.endswith('.c') and
+                             (p in self.units or p in self.sources()))
+            if not changed:
+                continue
+            t0 = time.perf_counter()
+            built = self.build(changed)
+            t1 = time.perf_counter()
+            self.report(built)
+            names = ', '.join(os.path.relpath(p) for p in built)
+            print(f'[{len(built)} reconstruidos en {1e3*(t1-t0):.1f} ms '
+                  f'({1e3*(t1-first):.1f} ms desde el cambio): {names}]')
+
+
+# ----------------------------------------------------------------------
+# Deteccion de cambios
+# ----------------------------------------------------------------------
+class Inotify:
+    '''
+    Vigila directorios con inotify.  wait() bloquea hasta el primer
+    evento y luego sigue leyendo mientras lleguen eventos con menos de
+    settle segundos de separacion.
+    '''
+    IN_MODIFY      = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM  = 0x040
+    IN_MOVED_TO    = 0x080
+    IN_CREATE      = 0x100
+    IN_DELETE      = 0x200
+
+    def __init__(self, dirs, settle):
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify no disponible')
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        self.dirs = {}
+        for d in dirs:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(d), mask)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch {d}')
+            self.dirs[wd] = os.path.abspath(d)
+        self.settle = settle
+
+    def read(self, timeout):
+        import select
+        import struct
+
+        ready, _, _ = select.select([ self.fd ], [], [], timeout)
+        if not ready:
+            return None
+        data  = os.read(self.fd, 1 << 16)
+        paths = set()
+        pos   = 0
+        while pos < len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, pos)
+            pos += 16
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            if wd in self.dirs and name:
+                paths.add(os.path.join(self.dirs[wd], os.fsdecode(name)))
+        return paths
+
+    def wait(self):
+        changed = self.read(None)
+        first   = time.perf_counter()
+        while True:
+            more = self.read(self.settle)
+            if more is None:
+                return changed, first
+            changed |= more
+
+
+class Poller:
+    '''
+    Alternativa sin inotify: compara (mtime, tamano) de los archivos cada
+    interval segundos.
+    '''
+    def __init__(self, driver, interval, settle):
+        self.driver   = driver
+        self.interval = interval
+        self.settle   = settle
+        self.stats    = self.scan()
+
+    def scan(self):
+        stats = {}
+        for path in self.driver.sources():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stats[path] = (st.st_mtime_ns, st.st_size)
+        return stats
+
+    def diff(self):
+        stats = self.scan()
+        changed = { p for p in stats.keys() | self.stats.keys() if stats.get(p) != self.stats.get(p) }
+        self.stats = stats
+        return changed
+
+    def wait(self):
+        while True:
+            changed = self.diff()
+            if changed:
+                break
+            time.sleep(self.interval)
+        first = time.perf_counter()
+        while True:
+            time.sleep(self.settle)
+            more = self.diff()
+            if not more:
+                return changed, first
+            changed |= more
+
+
+if __name__ == '__main__':
+    import argparse
+
+    ap = argparse.ArgumentParser(description='Compilador MiniC')
+    ap.add_argument('paths', nargs='+', help='archivos .c o directorios')
+    ap.add_argument('--watch', action='store_true', help='recompilar cuando cambien los archivos')
+    ap.add_argument('--poll', action='store_true', help='no usar inotify; revisar los archivos periodicamente')
+    ap.add_argument('--interval', type=float, default=0.2, help='segundos entre revisiones con --poll')
+    args = ap.parse_args()
+
+    driver = Driver(args.paths)
+    if args.watch:
+        try:
+            driver.watch(poll=args.poll, interval=args.interval)
+        except KeyboardInterrupt:
+            pass
+    else:
+        files = driver.sources()
+        exit(1 if driver.report(driver.build(files)) else 0)
@@ -0,0 +1,512 @@
+# mccheck.py
+'''
+Analisis semantico de MiniC.
+
+El Checker recorre el AST, resuelve cada Variable contra su declaracion
+y verifica los tipos de las expresiones y sentencias.
+
+Tabla de simbolos:
+
+    La tabla es una cadena de diccionarios (Symtab), uno por ambito:
+    global, funcion (parametros + cuerpo) y cada bloque compuesto.  Los
+    nombres se internan con sys.intern, de modo que cada busqueda es un
+    acceso a diccionario por nivel de ambito.
+
+    Cada declaracion crea un Symbol con un id unico.  Al resolver una
+    Variable se guarda ese id en Variable.sym; las fases posteriores
+    usan checker.symbols[node.sym] sin volver a buscar el nombre.
+
+Tipos:
+
+    Los tipos se representan como cadenas: 'int', 'float', 'char',
+    'void' y los apuntadores agregan '*' ('int*', 'char**').  Las
+    funciones guardan su tipo de retorno en Symbol.type y los tipos de
+    sus parametros en Symbol.params.
+
+Los errores se acumulan en checker.errors como pares (mensaje, nodo); el
+analisis continua despues de cada error.
+'''
+import sys
+
+from mcast import *
+
+
+NUMERIC = { 'int', 'float', 'char' }
+
+
+class Symbol:
+    __slots__ = ('id', 'name', 'kind', 'type', 'node', 'params', 'variadic', 'defined')
+
+    def __init__(self, id, name, kind, type, node=None, params=None, variadic=False):
+        self.id       = id
+        self.name     = name
+        self.kind     = kind        # 'var', 'param' o 'func'
+        self.type     = type
+        self.node     = node        # Variable de la declaracion (o definicion)
+        self.params   = params
+        self.variadic = variadic
+        self.defined  = False
+
+    def __repr__(self):
+        return f'Symbol({self.id}, {self.name!r}, {self.kind}, {self.type!r})'
+
+
+class Symtab:
+    '''
+    Un ambito: diccionario de nombres con enlace al ambito padre.
+    '''
+    __slots__ = ('entries', 'parent')
+
+    def __init__(self, parent=None):
+        self.entries = {}
+        self.parent  = parent
+
+    def add(self, name, sym):
+        self.entries[name] = sym
+
+    def get(self, name):
+        scope = self
+        while scope is not None:
+            sym = scope.entries.get(name)
+            if sym is not None:
+                return sym
+            scope = scope.parent
+        return None
+
+
+def is_pointer(type):
+    return type is not None and type.endswith('*')
+
+
+def is_scalar(type):
+    return type in NUMERIC or is_pointer(type)
+
+
+def assignable(dst, src, expr=None):
+    '''
+    ¿Se puede asignar un valor de tipo src a una ubicacion de tipo dst?
+    '''
+    if dst is None or src is None:
+        return True                 # error ya reportado
+    if dst == src:
+        return True
+    if dst in NUMERIC and src in NUMERIC:
+        return True
+    if is_pointer(dst):
+        if isinstance(expr, Literal) and expr.value == 0:
+            return True
+        if is_pointer(src) and 'void*' in (dst, src):
+            return True
+    return False
+
+
+class Checker(Visitor):
+
+    def __init__(self):
+        self.symbols = []
+        self.errors  = []
+        self.scope   = Symtab()
+        self.func    = None         # simbolo de la funcion actual
+        self.loops   = 0
+
+    @classmethod
+    def check(cls, n:Node):
+        checker = cls()
+        n.accept(checker)
+        return checker
+
+    def error(self, msg, node=None):
+        self.errors.append((msg, node))
+
+    # ------------------------------------------------------------------
+    # Tabla de simbolos
+    # ------------------------------------------------------------------
+    def declare(self, node, kind, type, params=None, variadic=False):
+        '''
+        Declara el nombre de la Variable node en el ambito actual.
+        '''
+        name = sys.intern(node.name)
+        prev = self.scope.entries.get(name)
+        if prev is not None:
+            if prev.kind == 'func' and kind == 'func' \
+               and (prev.type, prev.params, prev.variadic) == (type, params, variadic):
+                return prev
+            self.error(f"'{name}' ya fue declarado en este ambito", node)
+            return prev
+        sym = Symbol(len(self.symbols), name, kind, type, node, params, variadic)
+        self.symbols.append(sym)
+        self.scope.add(name, sym)
+        return sym
+
+    def declare_decl(self, type, decl, kind):
+        '''
+        Declara un declarador (variable, apuntador o prototipo) y devuelve
+        su simbolo.
+        '''
+        type, decl = pointer_type(type, decl)
+        if isinstance(decl, tuple):
+            params, variadic = self.param_types(decl[1])
+            sym = self.declare(decl[0], 'func', type, params, variadic)
+            decl = decl[0]
+        else:
+            if type == 'void':
+                self.error(f"'{decl.name}' no puede ser de tipo void", decl)
+            sym = self.declare(decl, kind, type)
+        decl.sym = sym.id
+        return sym
+
+    def param_types(self, params):
+        params, variadic = param_list(params)
+        return tuple(pointer_type(type, decl)[0] for type, decl in params), variadic
+
+    def push(self):
+        self.scope = Symtab(self.scope)
+
+    def pop(self):
+        self.scope = self.scope.parent
+
+    def block(self, stmts):
+        self.push()
+        for stmt in block_items(stmts):
+            self.stmt(stmt)
+        self.pop()
+
+    def stmt(self, stmt):
+        if stmt is None or isinstance(stmt, (tuple, list)):
+            self.block(stmt)
+        else:
+            stmt.accept(self)
+
+    def cond(self, expr):
+        type = expr.accept(self)
+        if type is not None and not is_scalar(type):
+            self.error(f"la condicion debe ser escalar, no '{type}'", expr)
+
+    # ------------------------------------------------------------------
+    # Declaraciones
+    # ------------------------------------------------------------------
+    def visit(self, node:TranslationUnit):
+        for decl in node.decl:
+            decl.accept(self)
+
+    def visit(self, node:VarDefinition):
+        self.declare_decl(node.type, node.expr, 'var')
+
+    def visit(self, node:FuncDefinition):
+        params, variadic = self.param_types(node.params)
+        sym = self.declare(node.name, 'func', node.type, params, variadic)
+        node.name.sym = sym.id
+        if sym.defined:
+            self.error(f"la funcion '{sym.name}' ya fue definida", node)
+        sym.defined = True
+        sym.node = node.name
+
+        self.func = sym
+        self.push()
+        for type, decl in param_list(node.params)[0]:
+            self.declare_decl(type, decl, 'param')
+        for stmt in block_items(node.stmts):
+            self.stmt(stmt)
+        self.pop()
+        self.func = None
+
+    # ------------------------------------------------------------------
+    # Sentencias
+    # ------------------------------------------------------------------
+    def visit(self, node:ExprStmt):
+        node.expr.accept(self)
+
+    def visit(self, node:WhileLoop):
+        self.cond(node.expr)
+        self.loops += 1
+        self.stmt(node.stmt)
+        self.loops -= 1
+
+    def visit(self, node:ForLoop):
+        node.begin.accept(self)
+        self.cond(node.expr.expr)
+        node.end.accept(self)
+        self.loops += 1
+        self.stmt(node.stmt)
+        self.loops -= 1
+
+    def visit(self, node:IfStmt):
+        self.cond(node.cond)
+        self.stmt(node.cons)
+        if node.altr is not None:
+            self.stmt(node.altr)
+
+    def visit(self, node:Return):
+        rettype = self.func.type
+        if node.expr is None:
+            if rettype != 'void':
+                self.error(f"'{self.func.name}' debe devolver un valor de tipo '{rettype}'", node)
+            return
+        type = node.expr.accept(self)
+        if rettype == 'void':
+            self.error(f"'{self.func.name}' es void y no puede devolver un valor", node)
+        elif not assignable(rettype, type, node.expr):
+            self.error(f"'{self.func.name}' devuelve '{rettype}', no '{type}'", node)
+
+    def visit(self, node:Break):
+        if not self.loops:
+            self.error("'break' fuera de un ciclo", node)
+
+    def visit(self, node:Continue):
+        if not self.loops:
+            self.error("'continue' fuera de un ciclo", node)
+
+    # ------------------------------------------------------------------
+    # Expresiones (devuelven el tipo, o None si hubo error)
+    # ------------------------------------------------------------------
+    def visit(self, node:Literal):
+        value = node.value
+        if isinstance(value, int):
+            return 'int'
+        if isinstance(value, float):
+            return 'float'
+        if value.startswith("'"):
+            return 'char'
+        return 'char*'
+
+    def visit(self, node:Variable):
+        sym = self.scope.get(node.name)
+        if sym is None:
+            self.error(f"'{node.name}' no esta declarado", node)
+            return None
+        node.sym = sym.id
+        if sym.kind == 'func':
+            # Solo Call acepta el nombre de una funcion (sin visitarlo)
+            self.error(f"'{node.name}' es una funcion", node)
+            return None
+        return sym.type
+
+    def visit(self, node:Call):
+        if not isinstance(node.func, Variable):
+            self.error('solo se pueden llamar funciones por nombre', node)
+            return None
+        sym = self.scope.get(node.func.name)
+        if sym is None:
+            self.error(f"la funcion '{node.func.name}' no esta declarada", node)
+            for arg in node.args:
+                arg.accept(self)
+            return None
+        node.func.sym = sym.id
+        if sym.kind != 'func':
+            self.error(f"'{sym.name}' no es una funcion", node)
+            return None
+
+        nparams = len(sym.params)
+        if len(node.args) < nparams or (len(node.args) > nparams and not sym.variadic):
+            self.error(f"'{sym.name}' espera {nparams} argumentos, recibio {len(node.args)}", node)
+        for i, arg in enumerate(node.args):
+            type = arg.accept(self)
+            if i < nparams and not assignable(sym.params[i], type, arg):
+                self.error(f"argumento {i+1} de '{sym.name}': se esperaba '{sym.params[i]}', no '{type}'", node)
+        return sym.type
+
+    def visit(self, node:Index):
+        base  = node.expr.accept(self)
+        index = node.index.accept(self)
+        if index is not None and index not in ('int', 'char'):
+            self.error(f"el indice debe ser entero, no '{index}'", node)
+        if base is None:
+            return None
+        if not is_pointer(base):
+            self.error(f"no se puede indexar un valor de tipo '{base}'", node)
+            return None
+        return base[:-1]
+
+    def visit(self, node:Unary):
+        type = node.expr.accept(self)
+        op   = node.op
+        if op == '&':
+            if not isinstance(node.expr, (Variable, Index)) \
+               and not (isinstance(node.expr, Unary) and node.expr.op == '*'):
+                self.error("'&' requiere una ubicacion", node)
+                return None
+            return None if type is None else type + '*'
+        if type is None:
+            return None
+        if op == '*':
+            if not is_pointer(type):
+                self.error(f"no se puede desreferenciar un valor de tipo '{type}'", node)
+                return None
+            return type[:-1]
+        if op == '!':
+            if not is_scalar(type):
+                self.error(f"operador '!' no valido para '{type}'", node)
+                return None
+            return 'int'
+        if type not in NUMERIC:
+            self.error(f"operador '{op}' no valido para '{type}'", node)
+            return None
+        return 'int' if type == 'char' else type
+
+    def visit(self, node:Binary):
+        op = node.op
+        if op in ('=', '+=', '-='):
+            return self.assign(node)
+
+        left  = node.left.accept(self)
+        right = node.right.accept(self)
+        if left is None or right is None:
+            return None
+
+        if op in ('+', '-') and is_pointer(left) and right in ('int', 'char'):
+            return left
+        if op == '+' and left in ('int', 'char') and is_pointer(right):
+            return right
+        if op == '-' and is_pointer(left) and left == right:
+            return 'int'
+
+        if op in ('<', '<=', '>', '>=', '==', '!='):
+            if (left in NUMERIC and right in NUMERIC) or (is_pointer(left) and left == right) \
+               or (is_pointer(left) and isinstance(node.right, Literal) and node.right.value == 0):
+                return 'int'
+        elif left in NUMERIC and right in NUMERIC:
+            if op == '%' and 'float' in (left, right):
+                self.error("operador '%' requiere enteros", node)
+                return None
+            return 'float' if 'float' in (left, right) else 'int'
+
+        self.error(f"operador '{op}' no valido entre '{left}' y '{right}'", node)
+        return None
+
+    def assign(self, node:Binary):
+        target = node.left
+        if not isinstance(target, (Variable, Index)) \
+           and not (isinstance(target, Unary) and target.op == '*'):
+            self.error(f"el lado izquierdo de '{node.op}' no es una ubicacion", node)
+            node.right.accept(self)
+            return None
+
+        if isinstance(target, Variable):
+            sym = self.scope.get(target.name)
+            if sym is not None and sym.kind == 'func':
+                target.sym = sym.id
+                self.error(f"no se puede asignar a la funcion '{target.name}'", node)
+                node.right.accept(self)
+                return None
+
+        left  = target.accept(self)
+        right = node.right.accept(self)
+        if node.op != '=' and is_pointer(left):
+            if right not in ('int', 'char', None):
+                self.error(f"operador '{node.op}' no valido entre '{left}' y '{right}'", node)
+            return left
+        if node.op != '=' and left not in NUMERIC | { None }:
+            self.error(f"operador '{node.op}' no valido para '{left}'", node)
+            return None
+        if not assignable(left, right, node.right):
+            self.error(f"no se puede asignar '{right}' a '{left}'", node)
+        return left
+
+
+# ----------------------------------------------------------------------
+# Verificacion
+# ----------------------------------------------------------------------
+CHECKS = {
+'funcion como valor': ('''
+int f() { return 1; }
+int main() {
+    int x;
+    x = f;
+    x = f + 1;
+    f = 2;
+    return f();
+}
+''', [ "'f' es una funcion", "'f' es una funcion", "no se puede asignar a la funcion 'f'" ]),
+}
+
+
+def check(programs=CHECKS):
+    '''
+    Verifica cada programa y compara sus errores con los esperados.
+    Devuelve el numero de diferencias.
+    '''
+    from mclex import Lexer
+    from mcparse import Parser
+
+    failures = 0
+    for name, (src, expected) in programs.items():
+        got = [ msg for msg, _ in Checker.check(Parser().parse(Lexer().tokenize(src))).errors ]
+        if got == expected:
+            print(f'  {name:20s} ok')
+        else:
+            failures += 1
+            print(f'  {name:20s} DIFERENTE')
+            print(f'    esperado: {expected}')
+            print(f'    obtenido: {got}')
+    return failures
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+def generate(nlines):
+    '''
+    Genera un programa MiniC de aproximadamente nlines lineas formado por
+    muchas funciones pequenas que se llaman entre si.
+    '''
+    lines = [ 'extern int printf(char *fmt, ...);', 'int total;' ]
+    n = 0
+    while len(lines) < nlines:
+        lines += [
+            f'int f{n}(int a, float *v, int n) {{',
+            '  int i;',
+            '  float s;',
+            '  s = 0.0;',
+            '  for (i = 0; i < n; i += 1) {',
+            '    s = s + v[i] * a;',
+            '    if (s > 100.0) { break; }',
+            '  }',
+            '  total = total + i;',
+            f'  printf("f{n} %d", i);',
+            '  return i;' if n == 0 else f'  return f{n-1}(a - 1, v, n) + i;',
+            '}',
+        ]
+        n += 1
+    return '\n'.join(lines)
+
+
+def bench(nlines=100000):
+    import time
+    from mclex import Lexer
+    from mcparse import Parser
+
+    txt = generate(nlines)
+    ast = Parser().parse(Lexer().tokenize(txt))
+
+    t0 = time.perf_counter()
+    checker = Checker.check(ast)
+    t1 = time.perf_counter()
+    nlines = txt.count('\n') + 1
+    print(f'{nlines} lineas, {len(checker.symbols)} simbolos, {len(checker.errors)} errores: '
+          f'{t1-t0:.3f} s ({nlines/(t1-t0):,.0f} lineas/s)')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] == '--bench':
+        bench()
+        exit(0)
+
+    if len(sys.argv) == 2 and sys.argv[1] == '--check':
+        exit(1 if check() else 0)
+
+    if len(sys.argv) != 2:
+        print(f"usage: python {sys.argv[0]} fname | --check | --bench")
+        exit(1)
+
+    from mclex import Lexer
+    from mcparse import Parser
+
+    txt = open(sys.argv[1], encoding='utf-8').read()
+    ast = Parser().parse(Lexer().tokenize(txt))
+    checker = Checker.check(ast)
+    lines = LineIndex(txt)
+    for msg, node in checker.errors:
+        where = lines.location(node)
+        print(f'{where[0]}:{where[1]}: error: {msg}' if where else f'error: {msg}')
+    if checker.errors:
+        exit(1)
@@ -0,0 +1,217 @@
+# mccons.py
+'''
+Hash-consing de expresiones MiniC.
+
+ExprFactory construye nodos de expresion (Binary, Unary, Variable,
+Literal, Call, Index) de forma que dos expresiones estructuralmente
+iguales sean el mismo objeto:
+
+    >>> f = ExprFactory()
+    >>> f.Binary('+', f.Variable('i'), f.Literal(1)) is \\
+    ...     f.Binary('+', f.Variable('i'), f.Literal(1))
+    True
+
+Los nodos compartidos son instancias de subclases de las clases de
+mcast (isinstance(n, Binary) sigue siendo cierto, y los Visitor
+funcionan igual), pero ademas:
+
+  * guardan un hash estructural calculado una sola vez al construirlos
+    a partir de los hash de sus hijos, por lo que hash(n) es O(1) y se
+    pueden usar como llaves de diccionario (CSE, memoizacion);
+
+  * n1 == n2 es O(1): o son el mismo objeto, o sus hash difieren.  Solo
+    ante una colision de hash (o al comparar contra un nodo normal) se
+    comparan los campos.
+
+Los nodos compartidos se deben tratar como inmutables.  En particular,
+Checker anota Variable.sym en cada ocurrencia; si un mismo Variable('i')
+aparece en dos funciones, la anotacion de una pisa la de la otra, asi
+que el analisis semantico debe hacerse sobre un arbol normal.
+
+Para usarlo desde el parser:
+
+    ast = Parser(ExprFactory()).parse(Lexer().tokenize(txt))
+'''
+from dataclasses import fields
+
+from mcast import *
+
+
+class Consed:
+    '''
+    Mezcla para los nodos compartidos.  _hash es el hash estructural.
+    '''
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, Consed) and self._hash != other._hash:
+            return False
+        if not isinstance(other, self._base):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self._fields)
+
+
+def consed_class(cls):
+    '''
+    Crea la subclase compartida de una clase de expresion de mcast.
+    '''
+    names = tuple(f.name for f in fields(cls) if f.compare)
+    return type(cls.__name__, (Consed, cls), {
+        '_base'   : cls,
+        '_fields' : names,
+        '__hash__': Consed.__hash__,
+        '__eq__'  : Consed.__eq__,
+        '__repr__': cls.__repr__,
+    })
+
+
+CONSED = { cls: consed_class(cls) for cls in (Binary, Unary, Variable, Literal, Call, Index) }
+
+
+class ExprFactory:
+    '''
+    Fabrica de expresiones compartidas.  Tiene los mismos nombres que las
+    clases de mcast para que el parser pueda usarla en su lugar.
+    '''
+    def __init__(self):
+        self.table  = {}
+        self.hits   = 0
+
+    def __len__(self):
+        return len(self.table)
+
+    def clear(self):
+        self.table.clear()
+        self.hits = 0
+
+    def make(self, cls, key, args):
+        node = self.table.get(key)
+        if node is not None:
+            self.hits += 1
+            return node
+        node = CONSED[cls](*args)
+        node._hash = hash(key)
+        self.table[key] = node
+        return node
+
+    # Los hijos ya son nodos compartidos, asi que la llave solo guarda
+    # referencias a ellos y su hash ya esta calculado.
+    def Binary(self, op, left, right):
+        return self.make(Binary, (Binary, op, left, right), (op, left, right))
+
+    def Unary(self, op, expr):
+        return self.make(Unary, (Unary, op, expr), (op, expr))
+
+    def Variable(self, name):
+        return self.make(Variable, (Variable, name), (name,))
+
+    def Literal(self, value):
+        # type(value) separa 1 de 1.0 (que en Python son iguales)
+        return self.make(Literal, (Literal, type(value), value), (value,))
+
+    def Call(self, func, args):
+        return self.make(Call, (Call, func, tuple(args)), (func, args))
+
+    def Index(self, expr, index):
+        return self.make(Index, (Index, expr, index), (expr, index))
+
+    def intern(self, e):
+        '''
+        Version compartida de una expresion construida con nodos normales.
+        '''
+        if isinstance(e, Consed):
+            return e
+        if isinstance(e, Binary):
+            return self.Binary(e.op, self.intern(e.left), self.intern(e.right))
+        if isinstance(e, Unary):
+            return self.Unary(e.op, self.intern(e.expr))
+        if isinstance(e, Variable):
+            return self.Variable(e.name)
+        if isinstance(e, Literal):
+            return self.Literal(e.value)
+        if isinstance(e, Call):
+            return self.Call(self.intern(e.func), [ self.intern(arg) for arg in e.args ])
+        if isinstance(e, Index):
+            return self.Index(self.intern(e.expr), self.intern(e.index))
+        raise TypeError(f'no es una expresion: {e!r}')
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+def generate(nstmts):
+    lines = [ 'void kernel(float *a, float *b, float *c, int n) {', '  int i;', '  int j;' ]
+    for k in range(nstmts // 4):
+        lines += [
+            '  for (i = 0; i < n; i += 1) {',
+            f'    a[i] = a[i] + b[i] * c[i + 1] - {k % 7};',
+            '    if (a[i] > 0) { c[i] = c[i] - b[i] * 2; }',
+            '  }',
+        ]
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def deep_size(obj):
+    '''
+    Bytes ocupados por obj y todo lo que alcanza, contando una sola vez
+    los objetos compartidos.
+    '''
+    import sys
+    seen  = set()
+    total = 0
+    stack = [ obj ]
+    while stack:
+        x = stack.pop()
+        if id(x) in seen:
+            continue
+        seen.add(id(x))
+        total += sys.getsizeof(x)
+        if isinstance(x, Node):
+            total += sys.getsizeof(x.__dict__)
+            stack.extend(vars(x).values())
+        elif isinstance(x, (list, tuple)):
+            stack.extend(x)
+    return total
+
+
+def bench(nstmts=8000):
+    import time
+    from mclex import Lexer
+    from mcparse import Parser
+
+    txt = generate(nstmts)
+    results = {}
+    for label, exprs in (('dataclasses', None), ('hash-consing', ExprFactory())):
+        t0 = time.perf_counter()
+        ast = Parser(exprs).parse(Lexer().tokenize(txt))
+        t1 = time.perf_counter()
+        mem = deep_size(ast)
+
+        # Cuerpos de los ciclos: expresiones grandes que se repiten
+        loops = [ s for s in block_items(ast.decl[0].stmts) if isinstance(s, ForLoop) ]
+        exprs_ = [ block_items(l.stmt)[0].expr for l in loops ]
+        # Las dataclasses normales no son hashables: para agrupar
+        # expresiones iguales hay que usar una llave estructural (repr).
+        t2 = time.perf_counter()
+        distinct = len({ (e if exprs is not None else repr(e)) for e in exprs_ })
+        t3 = time.perf_counter()
+        same = sum(exprs_[0] == e for e in exprs_)
+        t4 = time.perf_counter()
+        results[label] = ast
+        extra = f'  ({len(exprs)} nodos unicos, {exprs.hits} reusados)' if exprs is not None else ''
+        print(f'{label:>13}: parse {t1-t0:6.2f} s  memoria {mem/2**20:7.1f} MiB  '
+              f'agrupar {1e3*(t3-t2):7.2f} ms ({distinct} distintas)  '
+              f'igualdad {1e3*(t4-t3):7.2f} ms ({same} iguales){extra}')
+
+    t0 = time.perf_counter()
+    equal = results['dataclasses'] == results['hash-consing']
+    t1 = time.perf_counter()
+    print(f'arboles iguales: {equal} ({1e3*(t1-t0):.1f} ms)')
+
+
+if __name__ == '__main__':
+    bench()
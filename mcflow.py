@@ -0,0 +1,499 @@
+# mcflow.py
+'''
+Analisis de flujo de datos sobre el grafo de flujo de control (CFG)
+de una funcion MiniC.
+
+El CFG se construye a partir de FuncDefinition.stmts.  Cada bloque
+basico guarda una lista de "items": sentencias simples (ExprStmt,
+VarDefinition, Return) o expresiones de condicion de WhileLoop, ForLoop
+e IfStmt.  Break y Continue agregan aristas hacia la salida o la
+cabecera del ciclo mas interno.
+
+Los conjuntos de flujo son bitsets densos representados con enteros de
+Python: el bit i corresponde a la variable (o definicion) numero i.
+Union, interseccion y diferencia son entonces operaciones |, & y & ~
+sobre enteros, que Python ejecuta en C.
+
+El solucionador es generico (FlowProblem) y procesa los bloques en
+orden postorden-inverso, lo que hace que la mayoria de problemas
+converjan en dos o tres pasadas.  Se incluyen dos clientes:
+
+    live_variables(cfg)        variables vivas (hacia atras)
+    reaching_definitions(cfg)  definiciones que alcanzan (hacia adelante)
+
+y dead_stores(cfg), que usa la vivacidad para reportar asignaciones
+cuyo valor nunca se lee.
+'''
+import heapq
+
+from mcast import *
+
+
+ASSIGN_OPS = { '=', '+=', '-=' }
+
+
+# ----------------------------------------------------------------------
+# Grafo de flujo de control
+# ----------------------------------------------------------------------
+class BasicBlock:
+    def __init__(self, index):
+        self.index = index
+        self.items = []
+        self.succ  = []
+        self.pred  = []
+
+    def __repr__(self):
+        return f'BasicBlock({self.index}, items={len(self.items)}, succ={[b.index for b in self.succ]})'
+
+
+class CFG:
+    '''
+    Grafo de flujo de control de una funcion.  Los bloques entry y exit
+    no contienen items.
+    '''
+    def __init__(self, func:FuncDefinition):
+        self.func   = func
+        self.blocks = []
+        self.entry  = self.new_block()
+        self.exit   = self.new_block()
+        self.loops  = []            # pila de (cabecera, salida)
+
+        last = self.build(block_items(func.stmts), self.entry)
+        if last is not None:
+            self.link(last, self.exit)
+
+    def new_block(self):
+        b = BasicBlock(len(self.blocks))
+        self.blocks.append(b)
+        return b
+
+    def link(self, a, b):
+        a.succ.append(b)
+        b.pred.append(a)
+
+    def build(self, stmts, cur):
+        '''
+        Agrega las sentencias a partir del bloque cur y devuelve el
+        bloque donde continua el flujo (None si el flujo no continua,
+        por ejemplo despues de return/break/continue).
+        '''
+        for stmt in stmts:
+            if cur is None:
+                # Codigo inalcanzable: se analiza en un bloque sin predecesores
+                cur = self.new_block()
+            cur = self.build_stmt(stmt, cur)
+        return cur
+
+    def build_stmt(self, stmt, cur):
+        if isinstance(stmt, WhileLoop):
+            head = self.new_block()
+            body = self.new_block()
+            done = self.new_block()
+            self.link(cur, head)
+            head.items.append(stmt.expr)
+            self.link(head, body)
+            self.link(head, done)
+            self.loops.append((head, done))
+            last = self.build(block_items(stmt.stmt), body)
+            self.loops.pop()
+            if last is not None:
+                self.link(last, head)
+            return done
+
+        if isinstance(stmt, ForLoop):
+            cur.items.append(stmt.begin)
+            head = self.new_block()
+            body = self.new_block()
+            step = self.new_block()
+            done = self.new_block()
+            self.link(cur, head)
+            head.items.append(stmt.expr)
+            self.link(head, body)
+            self.link(head, done)
+            self.loops.append((step, done))
+            last = self.build(block_items(stmt.stmt), body)
+            self.loops.pop()
+            if last is not None:
+                self.link(last, step)
+            step.items.append(stmt.end)
+            self.link(step, head)
+            return done
+
+        if isinstance(stmt, IfStmt):
+            cur.items.append(stmt.cond)
+            done = self.new_block()
+            for branch in (stmt.cons, stmt.altr):
+                if branch is None:
+                    self.link(cur, done)
+                    continue
+                start = self.new_block()
+                self.link(cur, start)
+                last = self.build(block_items(branch), start)
+                if last is not None:
+                    self.link(last, done)
+            return done
+
+        if isinstance(stmt, Break):
+            self.link(cur, self.loops[-1][1] if self.loops else self.exit)
+            return None
+
+        if isinstance(stmt, Continue):
+            self.link(cur, self.loops[-1][0] if self.loops else self.exit)
+            return None
+
+        if isinstance(stmt, Return):
+            cur.items.append(stmt)
+            self.link(cur, self.exit)
+            return None
+
+        if isinstance(stmt, (tuple, list)) or stmt is None:
+            # Bloque compuesto anidado
+            return self.build(block_items(stmt), cur)
+
+        cur.items.append(stmt)
+        return cur
+
+    def reverse_postorder(self, reverse=False):
+        '''
+        Bloques en postorden-inverso desde entry (o desde exit sobre el
+        grafo invertido si reverse=True).  Los bloques inalcanzables se
+        agregan al final.
+        '''
+        start = self.exit if reverse else self.entry
+        edges = 'pred' if reverse else 'succ'
+        seen  = { start.index }
+        order = []
+        stack = [ (start, iter(getattr(start, edges))) ]
+        while stack:
+            block, it = stack[-1]
+            for nxt in it:
+                if nxt.index not in seen:
+                    seen.add(nxt.index)
+                    stack.append((nxt, iter(getattr(nxt, edges))))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        order.extend(b for b in self.blocks if b.index not in seen)
+        return order
+
+
+# ----------------------------------------------------------------------
+# Definiciones y usos
+# ----------------------------------------------------------------------
+def defs_uses(item):
+    '''
+    Devuelve (defs, uses) de un item en el orden en que se evaluan.  defs
+    son los nombres asignados, uses los nombres leidos antes de asignar.
+    '''
+    defs = []
+    uses = []
+
+    def walk(e):
+        if isinstance(e, Variable):
+            uses.append(e.name)
+        elif isinstance(e, Binary):
+            if e.op in ASSIGN_OPS and isinstance(e.left, Variable):
+                walk(e.right)
+                if e.op != '=':
+                    uses.append(e.left.name)
+                defs.append(e.left.name)
+            else:
+                walk(e.left)
+                walk(e.right)
+        elif isinstance(e, Unary):
+            # &x no lee x
+            if not (e.op == '&' and isinstance(e.expr, Variable)):
+                walk(e.expr)
+        elif isinstance(e, Call):
+            if not isinstance(e.func, Variable):
+                walk(e.func)
+            for x in e.args:
+                walk(x)
+        elif isinstance(e, Index):
+            walk(e.expr)
+            walk(e.index)
+        elif isinstance(e, (ExprStmt, Return)):
+            walk(e.expr)
+
+    if isinstance(item, VarDefinition):
+        return defs, uses
+    walk(item)
+    return defs, uses
+
+
+def item_defs(item):
+    return defs_uses(item)[0]
+
+
+# ----------------------------------------------------------------------
+# Solucionador generico
+# ----------------------------------------------------------------------
+class FlowProblem:
+    '''
+    Problema de flujo de datos con conjuntos gen/kill por bloque.
+
+        forward : True si la informacion fluye de entry hacia exit
+        gen/kill: listas de bitsets indexadas por BasicBlock.index
+        boundary: valor inicial del bloque frontera (entry o exit)
+
+    El operador de encuentro es la union.
+    '''
+    forward = True
+
+    def __init__(self, cfg:CFG):
+        self.cfg  = cfg
+        n = len(cfg.blocks)
+        self.gen  = [0] * n
+        self.kill = [0] * n
+        self.boundary = 0
+
+    def solve(self):
+        cfg    = self.cfg
+        n      = len(cfg.blocks)
+        order  = cfg.reverse_postorder(reverse=not self.forward)
+        rank   = [0] * n
+        for i, b in enumerate(order):
+            rank[b.index] = i
+
+        if self.forward:
+            into, outof, start = 'pred', 'succ', cfg.entry
+        else:
+            into, outof, start = 'succ', 'pred', cfg.exit
+
+        gen, kill = self.gen, self.kill
+        inp = [0] * n
+        out = [0] * n
+        inp[start.index] = self.boundary
+        out[start.index] = gen[start.index] | (self.boundary & ~kill[start.index])
+
+        work   = [ rank[b.index] for b in order ]
+        queued = set(work)
+        heapq.heapify(work)
+        while work:
+            block = order[heapq.heappop(work)]
+            i = block.index
+            queued.discard(rank[i])
+
+            if block is not start:
+                x = 0
+                for p in getattr(block, into):
+                    x |= out[p.index]
+                inp[i] = x
+            new = gen[i] | (inp[i] & ~kill[i])
+            if new != out[i] or block is start:
+                out[i] = new
+                for s in getattr(block, outof):
+                    r = rank[s.index]
+                    if r not in queued:
+                        queued.add(r)
+                        heapq.heappush(work, r)
+
+        # Se presentan siempre como (entrada, salida) en el sentido del
+        # programa, sin importar la direccion del analisis.
+        if self.forward:
+            self.block_in, self.block_out = inp, out
+        else:
+            self.block_in, self.block_out = out, inp
+        return self
+
+
+class Liveness(FlowProblem):
+    forward = False
+
+    def __init__(self, cfg:CFG):
+        super().__init__(cfg)
+        self.vars  = {}             # nombre -> numero de bit
+        self.names = []
+
+        func = cfg.func
+        self.locals = { declarator_name(decl) for _, decl in param_list(func.params)[0] }
+        self.locals |= { declarator_name(n.expr) for n in walk(func) if isinstance(n, VarDefinition) }
+        self.addressed = { n.expr.name for n in walk(func)
+                           if isinstance(n, Unary) and n.op == '&' and isinstance(n.expr, Variable) }
+
+        for b in cfg.blocks:
+            use = kill = 0
+            for item in reversed(b.items):
+                defs, uses = defs_uses(item)
+                d = self.bits(defs)
+                u = self.bits(uses)
+                use  = u | (use & ~d)
+                kill = (kill | d) & ~u
+            self.gen[b.index]  = use
+            self.kill[b.index] = kill
+
+        # Las globales se pueden leer despues de salir, y las variables
+        # cuya direccion se toma a traves de un apuntador: vivas en exit
+        self.boundary = self.bits([ name for name in self.names if name not in self.locals ]) \
+                        | self.bits(self.addressed)
+
+    def bits(self, names):
+        x = 0
+        for name in names:
+            bit = self.vars.get(name)
+            if bit is None:
+                bit = self.vars[name] = len(self.names)
+                self.names.append(name)
+            x |= 1 << bit
+        return x
+
+    def to_names(self, x):
+        return { self.names[i] for i in range(len(self.names)) if x >> i & 1 }
+
+
+class ReachingDefinitions(FlowProblem):
+    forward = True
+
+    def __init__(self, cfg:CFG):
+        super().__init__(cfg)
+        self.defs  = []             # numero de bit -> (bloque, item, nombre)
+        by_var     = {}             # nombre -> bitset de sus definiciones
+        block_defs = []
+
+        # Los parametros se definen en entry
+        for type, decl in param_list(cfg.func.params)[0]:
+            name = declarator_name(decl)
+            if name is not None:
+                block_defs.append((cfg.entry, None, name))
+        for b in cfg.blocks:
+            for item in b.items:
+                for name in item_defs(item):
+                    block_defs.append((b, item, name))
+
+        for n, (b, item, name) in enumerate(block_defs):
+            self.defs.append((b, item, name))
+            by_var[name] = by_var.get(name, 0) | (1 << n)
+
+        # La ultima definicion de cada variable en el bloque es la que sale
+        last = [ {} for _ in cfg.blocks ]
+        for n, (b, item, name) in enumerate(block_defs):
+            last[b.index][name] = n
+        for i, names in enumerate(last):
+            gen = kill = 0
+            for name, n in names.items():
+                gen  |= 1 << n
+                kill |= by_var[name]
+            self.gen[i]  = gen
+            self.kill[i] = kill & ~gen
+        self.by_var = by_var
+
+    def to_defs(self, x):
+        return [ self.defs[i] for i in range(len(self.defs)) if x >> i & 1 ]
+
+
+def live_variables(cfg:CFG):
+    return Liveness(cfg).solve()
+
+
+def reaching_definitions(cfg:CFG):
+    return ReachingDefinitions(cfg).solve()
+
+
+def dead_stores(cfg:CFG, live:Liveness=None):
+    '''
+    Asignaciones cuyo valor no esta vivo despues del item que las hace.
+    Devuelve una lista de (bloque, item, nombre).  No se reportan las
+    globales ni las variables cuya direccion se toma: una llamada o un
+    acceso por apuntador las puede leer sin nombrarlas.
+    '''
+    live = live or live_variables(cfg)
+    result = []
+    for b in cfg.blocks:
+        alive = live.block_out[b.index]
+        for item in reversed(b.items):
+            defs, uses = defs_uses(item)
+            for name in defs:
+                if name in live.addressed or name not in live.locals:
+                    continue
+                bit = live.vars[name]
+                if not alive >> bit & 1:
+                    result.append((b, item, name))
+            alive = live.bits(uses) | (alive & ~live.bits(defs))
+    result.reverse()
+    return result
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+def generate(nstmts, nvars=50):
+    '''
+    Genera el texto de una funcion MiniC con aproximadamente nstmts
+    sentencias, mezclando asignaciones, ciclos y condicionales.
+    '''
+    import random
+    rnd = random.Random(nstmts)
+    names = [ f'v{i}' for i in range(nvars) ]
+    lines = [ 'int bench(int a, int b) {' ]
+    lines += [ f'  int {n};' for n in names ]
+    count = 0
+    while count < nstmts:
+        x, y, z = rnd.sample(names, 3)
+        k = rnd.random()
+        if k < 0.6:
+            lines.append(f'  {x} = {y} + {z} * a;')
+            count += 1
+        elif k < 0.8:
+            lines.append(f'  while ({x} < b) {{ {y} = {y} + 1; {x} += {y}; if ({z} == 0) {{ break; }} }}')
+            count += 4
+        else:
+            lines.append(f'  if ({x} > {y}) {{ {z} = {x} - {y}; }} else {{ {z} = a; }}')
+            count += 3
+    lines.append(f'  return {names[0]};')
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def bench(sizes=(1000, 5000, 10000)):
+    import time
+    from mclex import Lexer
+    from mcparse import Parser
+
+    for size in sizes:
+        ast = Parser().parse(Lexer().tokenize(generate(size)))
+        func = ast.decl[0]
+
+        t0 = time.perf_counter()
+        cfg = CFG(func)
+        t1 = time.perf_counter()
+        live = live_variables(cfg)
+        t2 = time.perf_counter()
+        reaching_definitions(cfg)
+        t3 = time.perf_counter()
+        dead = dead_stores(cfg, live)
+        t4 = time.perf_counter()
+
+        print(f'{size:6d} stmts {len(cfg.blocks):6d} blocks  '
+              f'cfg {1e3*(t1-t0):8.2f} ms  live {1e3*(t2-t1):8.2f} ms  '
+              f'reach {1e3*(t3-t2):8.2f} ms  dead {1e3*(t4-t3):8.2f} ms  '
+              f'({len(dead)} dead stores)')
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) == 2 and sys.argv[1] == '--bench':
+        bench()
+        exit(0)
+
+    if len(sys.argv) != 2:
+        print(f"usage: python {sys.argv[0]} fname | --bench")
+        exit(1)
+
+    from mclex import Lexer
+    from mcparse import Parser
+
+    txt = open(sys.argv[1], encoding='utf-8').read()
+    ast = Parser().parse(Lexer().tokenize(txt))
+
+    for func in ast.decl:
+        if not isinstance(func, FuncDefinition):
+            continue
+        cfg  = CFG(func)
+        live = live_variables(cfg)
+        print(f'{declarator_name(func.name)}: {len(cfg.blocks)} bloques, '
+              f'vivas al entrar: {sorted(live.to_names(live.block_in[cfg.entry.index]))}')
+        for b, item, name in dead_stores(cfg, live):
+            print(f'  asignacion a {name!r} nunca se usa: {item}')
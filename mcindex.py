@@ -0,0 +1,298 @@
+# mcindex.py
+'''
+Indice de referencias cruzadas para muchos archivos MiniC.
+
+El indice se guarda en una base SQLite y responde preguntas como
+"¿donde esta definida la funcion X?" o "¿desde donde se llama a X?" sin
+volver a analizar los archivos.
+
+Tablas:
+
+    files   (id, path, hash, error)
+    symbols (file, name, kind, type, extern, static, defn, line)
+            kind es 'func' o 'var'; defn=1 para definiciones y 0 para
+            declaraciones (extern o prototipos)
+    calls   (file, caller, callee, line)
+
+Actualizacion incremental: cada archivo se identifica por el hash
+(sha1) de su contenido.  Solo se vuelven a analizar los archivos cuyo
+hash cambio; sus filas se reemplazan dentro de la misma transaccion.
+Las cargas grandes se escriben en lotes de batch_size archivos por
+transaccion, y el analisis puede repartirse entre varios procesos.
+
+    python mcindex.py DB index  archivos...   indexa (o actualiza)
+    python mcindex.py DB def    NOMBRE        definiciones y declaraciones
+    python mcindex.py DB calls  NOMBRE        sitios donde se llama a NOMBRE
+    python mcindex.py --bench [N]             benchmark con N archivos
+'''
+import hashlib
+import os
+import sqlite3
+
+from mcast import *
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id      INTEGER PRIMARY KEY,
+    path    TEXT NOT NULL UNIQUE,
+    hash    TEXT NOT NULL,
+    error   TEXT
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    file    INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    name    TEXT NOT NULL,
+    kind    TEXT NOT NULL,
+    type    TEXT NOT NULL,
+    extern  INTEGER NOT NULL,
+    static  INTEGER NOT NULL,
+    defn    INTEGER NOT NULL,
+    line    INTEGER
+);
+CREATE TABLE IF NOT EXISTS calls (
+    file    INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    caller  TEXT NOT NULL,
+    callee  TEXT NOT NULL,
+    line    INTEGER
+);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols(name);
+CREATE INDEX IF NOT EXISTS symbols_file ON symbols(file);
+CREATE INDEX IF NOT EXISTS calls_callee ON calls(callee);
+CREATE INDEX IF NOT EXISTS calls_caller ON calls(caller);
+CREATE INDEX IF NOT EXISTS calls_file   ON calls(file);
+'''
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def extract(path):
+    '''
+    Analiza un archivo y devuelve (path, hash, symbols, calls, error).
+    Corre en los procesos del grupo, asi que solo devuelve tuplas.
+    '''
+    from mclex import Lexer
+    from mcparse import Parser
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+
+    try:
+        text = data.decode('utf-8')
+        ast  = Parser().parse(Lexer().tokenize(text))
+    except (SyntaxError, UnicodeDecodeError) as e:
+        return path, digest, [], [], str(e) or type(e).__name__
+
+    lines = LineIndex(text)
+
+    def line(node):
+        span = node_span(node)
+        return None if span is None else lines.lineno(span[0])
+
+    symbols = []
+    calls   = []
+    for decl in (ast.decl if ast is not None else []):
+        if isinstance(decl, FuncDefinition):
+            caller = decl.name.name
+            symbols.append((caller, 'func', decl.type, 0, int(decl.static), 1, line(decl.name)))
+            for node in walk(decl):
+                if isinstance(node, Call) and isinstance(node.func, Variable):
+                    calls.append((caller, node.func.name, line(node)))
+        else:
+            type, d = pointer_type(decl.type, decl.expr)
+            extern = int(bool(decl.extern))
+            if isinstance(d, tuple):
+                symbols.append((d[0].name, 'func', type, extern, 0, 0, line(d[0])))
+            else:
+                symbols.append((d.name, 'var', type, extern, 0, 1 - extern, line(d)))
+    return path, digest, symbols, calls, None
+
+
+class Index:
+
+    batch_size = 500
+
+    def __init__(self, dbname):
+        self.db = sqlite3.connect(dbname)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, paths, jobs=1, prune=False):
+        '''
+        Indexa los archivos cuyo contenido cambio.  Con prune=True se
+        eliminan del indice los archivos que ya no estan en paths.
+        Devuelve (analizados, sin cambios).
+        '''
+        paths = [ os.path.abspath(p) for p in paths ]
+        known = dict(self.db.execute('SELECT path, hash FROM files'))
+        changed = [ p for p in paths if known.get(p) != file_hash(p) ]
+
+        if jobs > 1 and len(changed) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(jobs) as executor:
+                self.store(executor.map(extract, changed, chunksize=32))
+        else:
+            self.store(map(extract, changed))
+
+        if prune:
+            gone = set(known) - set(paths)
+            with self.db:
+                self.db.executemany('DELETE FROM files WHERE path = ?', ((p,) for p in gone))
+        return len(changed), len(paths) - len(changed)
+
+    def store(self, results):
+        batch = []
+        for result in results:
+            batch.append(result)
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+
+    def write(self, batch):
+        db = self.db
+        with db:
+            for path, digest, symbols, calls, error in batch:
+                # Reemplazar la fila borra en cascada sus simbolos y llamadas
+                db.execute('DELETE FROM files WHERE path = ?', (path,))
+                cur = db.execute('INSERT INTO files(path, hash, error) VALUES (?, ?, ?)',
+                                 (path, digest, error))
+                file = cur.lastrowid
+                db.executemany('INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                               ((file, *s) for s in symbols))
+                db.executemany('INSERT INTO calls VALUES (?, ?, ?, ?)',
+                               ((file, *c) for c in calls))
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+    def definitions(self, name):
+        '''
+        [(path, line, kind, type, extern, defn)] de name, primero las
+        definiciones.
+        '''
+        return self.db.execute('''
+            SELECT f.path, s.line, s.kind, s.type, s.extern, s.defn
+              FROM symbols s JOIN files f ON f.id = s.file
+             WHERE s.name = ?
+             ORDER BY s.defn DESC, f.path, s.line''', (name,)).fetchall()
+
+    def callers(self, name):
+        '''
+        [(path, line, caller)] de cada llamada a name.
+        '''
+        return self.db.execute('''
+            SELECT f.path, c.line, c.caller
+              FROM calls c JOIN files f ON f.id = c.file
+             WHERE c.callee = ?
+             ORDER BY f.path, c.line''', (name,)).fetchall()
+
+    def callees(self, name):
+        '''
+        Funciones llamadas desde name: [(callee, numero de llamadas)].
+        '''
+        return self.db.execute('''
+            SELECT callee, count(*) FROM calls WHERE caller = ?
+             GROUP BY callee ORDER BY callee''', (name,)).fetchall()
+
+    def errors(self):
+        return self.db.execute('SELECT path, error FROM files WHERE error IS NOT NULL').fetchall()
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+def generate(dirname, nfiles):
+    '''
+    Escribe nfiles archivos; cada uno define una funcion y llama a la
+    definida en el archivo anterior, declarada con extern.
+    '''
+    os.makedirs(dirname, exist_ok=True)
+    paths = []
+    for i in range(nfiles):
+        path = os.path.join(dirname, f'm{i:05d}.c')
+        prev = f'f{i-1}' if i else 'base'
+        with open(path, 'w') as f:
+            f.write(f'extern int {prev}(int a);\n'
+                    f'extern int printf(char *fmt, ...);\n'
+                    f'int g{i};\n'
+                    f'int f{i}(int a) {{\n'
+                    f'    g{i} = {prev}(a - 1) + a;\n'
+                    f'    printf("%d", g{i});\n'
+                    f'    return g{i};\n'
+                    f'}}\n')
+        paths.append(path)
+    return paths
+
+
+def bench(nfiles=10000):
+    import random
+    import tempfile
+    import time
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = generate(os.path.join(tmp, 'src'), nfiles)
+        index = Index(os.path.join(tmp, 'xref.db'))
+        jobs  = os.cpu_count() or 1
+
+        t0 = time.perf_counter()
+        index.update(paths, jobs=jobs)
+        t1 = time.perf_counter()
+        index.update(paths, jobs=jobs)
+        t2 = time.perf_counter()
+        for path in random.Random(0).sample(paths, 10):
+            with open(path, 'a') as f:
+                f.write('int extra;\n')
+        nchanged, _ = index.update(paths, jobs=jobs)
+        t3 = time.perf_counter()
+
+        print(f'{nfiles} archivos ({jobs} procesos)')
+        print(f'  carga inicial        {t1-t0:8.2f} s')
+        print(f'  sin cambios          {1e3*(t2-t1):8.1f} ms')
+        print(f'  {nchanged} cambiados         {1e3*(t3-t2):8.1f} ms')
+
+        names = [ f'f{i}' for i in random.Random(1).sample(range(nfiles), 200) ]
+        for label, query in (('definiciones', index.definitions), ('llamadas', index.callers),
+                             ('printf', lambda n: index.callers('printf'))):
+            t0 = time.perf_counter()
+            for name in names:
+                rows = query(name)
+            t1 = time.perf_counter()
+            print(f'  consulta {label:12s} {1e3*(t1-t0)/len(names):8.3f} ms  ({len(rows)} filas)')
+        index.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) in (2, 3) and sys.argv[1] == '--bench':
+        bench(*map(int, sys.argv[2:]))
+        exit(0)
+
+    if len(sys.argv) < 4 or sys.argv[2] not in ('index', 'def', 'calls'):
+        print(f"usage: python {sys.argv[0]} DB index fname1 [fname2 ...] | DB def NAME | DB calls NAME | --bench [N]")
+        exit(1)
+
+    index = Index(sys.argv[1])
+    if sys.argv[2] == 'index':
+        nchanged, nsame = index.update(sys.argv[3:], jobs=os.cpu_count() or 1)
+        print(f'{nchanged} archivos indexados, {nsame} sin cambios')
+        for path, error in index.errors():
+            print(f'{path}: {error}')
+    elif sys.argv[2] == 'def':
+        for path, line, kind, type, extern, defn in index.definitions(sys.argv[3]):
+            what = 'definicion' if defn else ('extern' if extern else 'declaracion')
+            print(f'{path}:{line}: {what} {kind} {type} {sys.argv[3]}')
+    else:
+        for path, line, caller in index.callers(sys.argv[3]):
+            print(f'{path}:{line}: llamada desde {caller}')
+    index.close()
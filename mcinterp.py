@@ -0,0 +1,635 @@
+# mcinterp.py
+'''
+Interprete de MiniC sobre el modelo de memoria de mcmem.
+
+El programa se traduce una sola vez a funciones de Python (closures):
+cada sentencia es una funcion fp -> senal y cada expresion una funcion
+fp -> valor, donde fp es la direccion del marco de la funcion actual.
+Despues la ejecucion ya no recorre el AST ni despacha visit().
+
+Variables:
+
+    Las globales (y los literales de cadena) se asignan en Memory al
+    compilar.  Cada local o parametro ocupa 8 bytes en el marco de su
+    funcion; el marco se pide a Memory al llamar y se libera al volver.
+    Las direcciones de todas ellas se resuelven con Variable.sym del
+    Checker.
+
+Valores:
+
+    int se comporta como un entero de 32 bits (las operaciones dan la
+    vuelta como en C), char como un entero de 8 bits con signo, float
+    como double y los apuntadores son direcciones de Memory.  La
+    division y el modulo de enteros truncan hacia cero.
+
+Funciones externas:
+
+    printf, putchar, puts, malloc, calloc y free estan implementadas en
+    BUILTINS.  Deben declararse en el programa como en C, p.ej.
+
+        extern int printf(char *fmt, ...);
+        extern void *malloc(int n);
+
+    python mcinterp.py [--bounds] fname     ejecuta main()
+'''
+import math
+import re
+import sys
+
+from mcast import *
+from mcmem import Memory, MemoryFault, sizeof
+
+
+BREAK    = 'break'
+CONTINUE = 'continue'
+RETURN   = 'return'
+
+
+class CompileError(Exception):
+    '''
+    El programa tiene errores de sintaxis o semanticos (en errors).
+    '''
+    def __init__(self, errors):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+class Function:
+    '''
+    Una funcion definida en el programa.  Se crea al encontrar la
+    primera llamada o la definicion, lo que ocurra primero, para que las
+    llamadas puedan compilarse antes que la funcion llamada.
+    '''
+    __slots__ = ('name', 'size', 'params', 'body')
+
+    def __init__(self, name):
+        self.name   = name
+        self.size   = 8
+        self.params = []            # [(desplazamiento, store)]
+        self.body   = None
+
+
+def wrap32(v):
+    return ((v + 0x80000000) & 0xffffffff) - 0x80000000
+
+
+def wrap8(v):
+    return ((v + 0x80) & 0xff) - 0x80
+
+
+def ftoi(v):
+    '''
+    float -> int como cvttsd2si: trunca hacia cero; nan, inf y los
+    valores fuera de rango dan INT_MIN.
+    '''
+    if -2147483649.0 < v < 2147483648.0:
+        return int(v)
+    return -0x80000000
+
+
+def cdiv(a, b):
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def cmod(a, b):
+    return a - b * cdiv(a, b)
+
+
+def fdiv(a, b):
+    '''
+    Division de double como en IEEE 754: entre cero da inf, -inf o nan,
+    igual que el codigo nativo (en x86, 0/0 da una nan con signo).
+    '''
+    if b == 0:
+        if a != a:
+            return a
+        if a == 0:
+            return -math.nan
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+    return a / b
+
+
+# ----------------------------------------------------------------------
+# Funciones externas
+# ----------------------------------------------------------------------
+FORMAT = re.compile(r'%([-+ #0]*)(\d+|\*)?(?:\.(\d+))?(?:hh|h|ll|l|z)?([diouxXeEfgGcsp%])')
+
+
+def c_printf(interp, fmt, *args):
+    args = list(args)
+    mem  = interp.mem
+
+    def convert(m):
+        flags, width, prec, conv = m.groups()
+        if conv == '%':
+            return '%'
+        if width == '*':
+            width = str(args.pop(0))
+        spec = '%' + flags + (width or '') + ('.' + prec if prec is not None else '')
+        value = args.pop(0)
+        if conv == 's':
+            return (spec + 's') % mem.cstring(value)
+        if conv == 'c':
+            return (spec + 'c') % chr(value & 0xff)
+        if conv == 'p':
+            return (spec + 's') % hex(value)
+        if conv in 'ouxX':
+            return (spec + conv) % (int(value) & 0xffffffff)
+        if conv in 'di':
+            return (spec + 'd') % int(value)
+        if value != value and math.copysign(1.0, value) < 0:
+            # glibc escribe el signo de una nan; Python no
+            text = '-nan' if conv.islower() else '-NAN'
+            return ('%' + flags + (width or '') + 's') % text
+        return (spec + conv) % value
+
+    text = FORMAT.sub(convert, mem.cstring(fmt))
+    interp.out.write(text)
+    return len(text)
+
+
+def c_putchar(interp, c):
+    interp.out.write(chr(c & 0xff))
+    return c
+
+
+def c_puts(interp, s):
+    interp.out.write(interp.mem.cstring(s) + '\n')
+    return 0
+
+
+def c_malloc(interp, n):
+    return interp.mem.alloc(n)
+
+
+def c_calloc(interp, n, size):
+    return interp.mem.alloc(n * size)
+
+
+def c_free(interp, p):
+    interp.mem.free(p)
+
+
+BUILTINS = {
+    'printf' : c_printf,
+    'putchar': c_putchar,
+    'puts'   : c_puts,
+    'malloc' : c_malloc,
+    'calloc' : c_calloc,
+    'free'   : c_free,
+}
+
+
+# ----------------------------------------------------------------------
+# Compilacion a closures
+# ----------------------------------------------------------------------
+class Interpreter(Visitor):
+
+    def __init__(self, checker, out=None, check=False):
+        self.symbols = checker.symbols
+        self.mem     = Memory(check=check)
+        self.out     = sys.stdout if out is None else out
+        self.globals = {}           # sym -> direccion
+        self.locals  = None         # sym -> desplazamiento en el marco
+        self.funcs   = {}           # sym -> Function
+        self.strings = {}           # literal -> direccion
+        self.rettype = None
+        self.retval  = None
+
+    @classmethod
+    def compile(cls, text, out=None, check=False):
+        from mclex import Lexer
+        from mcparse import Parser
+        from mccheck import Checker
+
+        parser = Parser(recover=True)
+        ast = parser.parse(Lexer().tokenize(text))
+        if parser.errors:
+            raise CompileError([ f'{e.lineno or "EOF"}: {e.msg}' for e in parser.errors ])
+        checker = Checker.check(ast)
+        if checker.errors:
+            lines = LineIndex(text)
+            raise CompileError([ f'{lines.location(node)[0]}: {msg}' if lines.location(node) else msg
+                                 for msg, node in checker.errors ])
+        interp = cls(checker, out, check)
+        ast.accept(interp)
+        return interp
+
+    def run(self, entry='main'):
+        '''
+        Ejecuta entry() y devuelve su valor.
+        '''
+        sym = next((s for s in self.symbols if s.name == entry and s.kind == 'func'), None)
+        if sym is None or sym.id not in self.funcs or self.funcs[sym.id].body is None:
+            raise RuntimeError(f"no hay una funcion '{entry}'")
+        func  = self.funcs[sym.id]
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, 100000))
+        try:
+            frame = self.mem.alloc(func.size)
+            signal = func.body(frame)
+            self.mem.free(frame)
+            return self.retval if signal is RETURN else 0
+        finally:
+            sys.setrecursionlimit(limit)
+
+    # ------------------------------------------------------------------
+    # Declaraciones
+    # ------------------------------------------------------------------
+    def visit(self, node:TranslationUnit):
+        for decl in node.decl:
+            decl.accept(self)
+
+    def visit(self, node:VarDefinition):
+        type, decl = pointer_type(node.type, node.expr)
+        if isinstance(decl, tuple):
+            return None                 # prototipo
+        if self.locals is None:
+            if decl.sym not in self.globals:
+                self.globals[decl.sym] = self.mem.alloc(sizeof(type))
+            return None
+        self.locals[decl.sym] = 8 * len(self.locals)
+        return None
+
+    def visit(self, node:FuncDefinition):
+        func = self.function(node.name.sym)
+        sym  = self.symbols[node.name.sym]
+        self.locals  = {}
+        self.rettype = sym.type
+        for (type, decl), ptype in zip(param_list(node.params)[0], sym.params):
+            decl = pointer_type(type, decl)[1]
+            offset = self.locals[decl.sym] = 8 * len(self.locals)
+            func.params.append((offset, self.mem.storer(ptype, checked=False)))
+        func.body = self.block(node.stmts)
+        func.size = max(8 * len(self.locals), 8)
+        self.locals = None
+
+    def function(self, sym):
+        func = self.funcs.get(sym)
+        if func is None:
+            func = self.funcs[sym] = Function(self.symbols[sym].name)
+        return func
+
+    # ------------------------------------------------------------------
+    # Sentencias (devuelven fp -> None, BREAK, CONTINUE o RETURN)
+    # ------------------------------------------------------------------
+    def stmt(self, stmt):
+        if stmt is None or isinstance(stmt, (tuple, list)):
+            return self.block(stmt)
+        return stmt.accept(self)
+
+    def block(self, stmts):
+        body = [ self.stmt(s) for s in block_items(stmts) ]
+        body = [ s for s in body if s is not None ]
+        if len(body) == 1:
+            return body[0]
+
+        def run(fp):
+            for s in body:
+                signal = s(fp)
+                if signal is not None:
+                    return signal
+        return run
+
+    def visit(self, node:ExprStmt):
+        _, expr = node.expr.accept(self)
+
+        def run(fp):
+            expr(fp)
+        return run
+
+    def visit(self, node:WhileLoop):
+        cond = node.expr.accept(self)[1]
+        body = self.stmt(node.stmt)
+
+        def run(fp):
+            while cond(fp):
+                signal = body(fp)
+                if signal is not None:
+                    if signal is BREAK:
+                        break
+                    if signal is RETURN:
+                        return signal
+        return run
+
+    def visit(self, node:ForLoop):
+        begin = node.begin.expr.accept(self)[1]
+        cond  = node.expr.expr.accept(self)[1]
+        end   = node.end.accept(self)[1]
+        body  = self.stmt(node.stmt)
+
+        def run(fp):
+            begin(fp)
+            while cond(fp):
+                signal = body(fp)
+                if signal is not None:
+                    if signal is BREAK:
+                        break
+                    if signal is RETURN:
+                        return signal
+                end(fp)
+        return run
+
+    def visit(self, node:IfStmt):
+        cond = node.cond.accept(self)[1]
+        cons = self.stmt(node.cons)
+        if node.altr is None:
+            def run(fp):
+                if cond(fp):
+                    return cons(fp)
+            return run
+        altr = self.stmt(node.altr)
+
+        def run(fp):
+            if cond(fp):
+                return cons(fp)
+            return altr(fp)
+        return run
+
+    def visit(self, node:Return):
+        if node.expr is None:
+            return lambda fp: RETURN
+        type, expr = node.expr.accept(self)
+        conv = self.convert(type, self.rettype)
+
+        def run(fp):
+            self.retval = conv(expr(fp))
+            return RETURN
+        return run
+
+    def visit(self, node:Break):
+        return lambda fp: BREAK
+
+    def visit(self, node:Continue):
+        return lambda fp: CONTINUE
+
+    # ------------------------------------------------------------------
+    # Expresiones (devuelven (tipo, fp -> valor))
+    # ------------------------------------------------------------------
+    def convert(self, src, dst):
+        '''
+        Funcion que lleva un valor de tipo src al tipo dst.
+        '''
+        if dst == 'float':
+            return (lambda v: v) if src == 'float' else float
+        if dst == 'int':
+            return ftoi if src == 'float' else (lambda v: v)
+        if dst == 'char':
+            return (lambda v: wrap8(ftoi(v))) if src == 'float' else wrap8
+        return lambda v: v
+
+    def address(self, node):
+        '''
+        (tipo, fp -> direccion, verificar) de una ubicacion.  Las variables
+        siempre tienen una direccion valida; lo que se alcanza por un
+        apuntador se verifica si Memory tiene check=True.
+        '''
+        if isinstance(node, Variable):
+            type = self.symbols[node.sym].type
+            if self.locals is not None and node.sym in self.locals:
+                offset = self.locals[node.sym]
+                return type, (lambda fp: fp + offset), False
+            addr = self.globals[node.sym]
+            return type, (lambda fp: addr), False
+        if isinstance(node, Index):
+            ptype, base = node.expr.accept(self)
+            _, index = node.index.accept(self)
+            size = sizeof(ptype[:-1])
+            return ptype[:-1], (lambda fp: base(fp) + index(fp) * size), True
+        ptype, ptr = node.expr.accept(self)         # Unary '*'
+        return ptype[:-1], ptr, True
+
+    def load(self, node):
+        type, addr, checked = self.address(node)
+        load = self.mem.loader(type, None if checked else False)
+        if isinstance(node, Variable) and not checked:
+            if self.locals is not None and node.sym in self.locals:
+                # Caso mas comun: una local se lee con un solo acceso
+                mem, offset = self.mem, self.locals[node.sym]
+                if type == 'int':
+                    return type, lambda fp: mem.i32[(fp + offset) >> 2]
+                if type == 'float':
+                    return type, lambda fp: mem.f64[(fp + offset) >> 3]
+                if type.endswith('*'):
+                    return type, lambda fp: mem.i64[(fp + offset) >> 3]
+        if not (checked and self.mem.check):
+            # Sin verificar, un elemento de arreglo alineado se lee
+            # directamente (las locales siempre lo estan)
+            mem = self.mem
+            if type == 'int':
+                return type, lambda fp: mem.i32[a >> 2] if not (a := addr(fp)) & 3 else load(a)
+            if type == 'float':
+                return type, lambda fp: mem.f64[a >> 3] if not (a := addr(fp)) & 7 else load(a)
+        return type, lambda fp: load(addr(fp))
+
+    def visit(self, node:Literal):
+        value = node.value
+        if isinstance(value, int):
+            return 'int', lambda fp: value
+        if isinstance(value, float):
+            return 'float', lambda fp: value
+        if value.startswith("'"):
+            value = ord(value[1])
+            return 'char', lambda fp: value
+        addr = self.strings.get(value)
+        if addr is None:
+            data = value[1:-1].encode('latin-1').decode('unicode_escape').encode('latin-1') + b'\0'
+            addr = self.strings[value] = self.mem.alloc(len(data))
+            self.mem.store_bytes(addr, data)
+        return 'char*', lambda fp: addr
+
+    def visit(self, node:Variable):
+        return self.load(node)
+
+    def visit(self, node:Index):
+        return self.load(node)
+
+    def visit(self, node:Unary):
+        op = node.op
+        if op == '*':
+            return self.load(node)
+        if op == '&':
+            type, addr, _ = self.address(node.expr)
+            return type + '*', addr
+        type, expr = node.expr.accept(self)
+        if op == '!':
+            return 'int', lambda fp: 0 if expr(fp) else 1
+        if type == 'char':
+            type = 'int'
+        if op == '+':
+            return type, expr
+        if type == 'float':
+            return type, lambda fp: -expr(fp)
+        return type, lambda fp: wrap32(-expr(fp))
+
+    def visit(self, node:Binary):
+        op = node.op
+        if op in ('=', '+=', '-='):
+            return self.assign(node)
+        ltype, left  = node.left.accept(self)
+        rtype, right = node.right.accept(self)
+
+        if op == '<':
+            return 'int', lambda fp: 1 if left(fp) < right(fp) else 0
+        if op == '<=':
+            return 'int', lambda fp: 1 if left(fp) <= right(fp) else 0
+        if op == '>':
+            return 'int', lambda fp: 1 if left(fp) > right(fp) else 0
+        if op == '>=':
+            return 'int', lambda fp: 1 if left(fp) >= right(fp) else 0
+        if op == '==':
+            return 'int', lambda fp: 1 if left(fp) == right(fp) else 0
+        if op == '!=':
+            return 'int', lambda fp: 1 if left(fp) != right(fp) else 0
+
+        # Aritmetica de apuntadores
+        if ltype.endswith('*') and rtype.endswith('*'):
+            size = sizeof(ltype[:-1])
+            return 'int', lambda fp: (left(fp) - right(fp)) // size
+        if ltype.endswith('*'):
+            size = sizeof(ltype[:-1])
+            if op == '+':
+                return ltype, lambda fp: left(fp) + right(fp) * size
+            return ltype, lambda fp: left(fp) - right(fp) * size
+        if rtype.endswith('*'):
+            size = sizeof(rtype[:-1])
+            return rtype, lambda fp: left(fp) * size + right(fp)
+
+        if 'float' in (ltype, rtype):
+            if op == '+':
+                return 'float', lambda fp: left(fp) + right(fp)
+            if op == '-':
+                return 'float', lambda fp: left(fp) - right(fp)
+            if op == '*':
+                return 'float', lambda fp: left(fp) * right(fp)
+            return 'float', lambda fp: fdiv(left(fp), right(fp))
+
+        if op == '+':
+            return 'int', lambda fp: ((left(fp) + right(fp) + 0x80000000) & 0xffffffff) - 0x80000000
+        if op == '-':
+            return 'int', lambda fp: ((left(fp) - right(fp) + 0x80000000) & 0xffffffff) - 0x80000000
+        if op == '*':
+            return 'int', lambda fp: ((left(fp) * right(fp) + 0x80000000) & 0xffffffff) - 0x80000000
+        if op == '/':
+            return 'int', lambda fp: wrap32(cdiv(left(fp), right(fp)))
+        return 'int', lambda fp: cmod(left(fp), right(fp))
+
+    def assign(self, node:Binary):
+        type, addr, checked = self.address(node.left)
+        rtype, right = node.right.accept(self)
+        store = self.mem.storer(type, None if checked else False)
+        load  = self.mem.loader(type, None if checked else False)
+
+        mem = self.mem
+        direct = type == 'int' and rtype in ('int', 'char') and not (checked and mem.check)
+
+        if node.op != '=':
+            sign = 1 if node.op == '+=' else -1
+            if direct:
+                # i += 1 y similares, el caso mas comun de los ciclos
+                def run(fp):
+                    a = addr(fp)
+                    if a & 3:
+                        v = wrap32(load(a) + sign * right(fp))
+                        store(a, v)
+                        return v
+                    a >>= 2
+                    v = ((mem.i32[a] + sign * right(fp) + 0x80000000) & 0xffffffff) - 0x80000000
+                    mem.i32[a] = v
+                    return v
+                return type, run
+            if type.endswith('*'):
+                step = sign * sizeof(type[:-1])
+                value = lambda a, fp: load(a) + right(fp) * step
+            elif 'float' in (type, rtype):
+                conv = self.convert('float', type)
+                value = lambda a, fp: conv(load(a) + sign * right(fp))
+            else:
+                conv = self.convert('int', type)
+                value = lambda a, fp: conv(wrap32(load(a) + sign * right(fp)))
+
+            def run(fp):
+                a = addr(fp)
+                v = value(a, fp)
+                store(a, v)
+                return v
+            return type, run
+
+        conv = self.convert(rtype, type)
+        if direct:
+            def run(fp):
+                v = right(fp)
+                a = addr(fp)
+                if a & 3:
+                    store(a, v)
+                else:
+                    mem.i32[a >> 2] = v
+                return v
+        elif rtype == type or (type == 'int' and rtype == 'char') or type.endswith('*'):
+            def run(fp):
+                v = right(fp)
+                store(addr(fp), v)
+                return v
+        else:
+            def run(fp):
+                v = conv(right(fp))
+                store(addr(fp), v)
+                return v
+        return type, run
+
+    def visit(self, node:Call):
+        sym  = self.symbols[node.func.sym]
+        args = []
+        for i, arg in enumerate(node.args):
+            type, expr = arg.accept(self)
+            if i < len(sym.params) and type != sym.params[i]:
+                conv = self.convert(type, sym.params[i])
+                expr = (lambda e, c: lambda fp: c(e(fp)))(expr, conv)
+            args.append(expr)
+
+        if not sym.defined:
+            builtin = BUILTINS.get(sym.name)
+            if builtin is None:
+                raise CompileError([ f"la funcion externa '{sym.name}' no esta disponible" ])
+            return sym.type, lambda fp: builtin(self, *[ a(fp) for a in args ])
+
+        func = self.function(sym.id)
+        mem  = self.mem
+
+        def call(fp):
+            values = [ a(fp) for a in args ]
+            frame = mem.alloc(func.size)
+            for (offset, store), v in zip(func.params, values):
+                store(frame + offset, v)
+            signal = func.body(frame)
+            mem.free(frame)
+            return self.retval if signal is RETURN else 0
+        return sym.type, call
+
+
+if __name__ == '__main__':
+    args = [ a for a in sys.argv[1:] if a != '--bounds' ]
+    if len(args) != 1:
+        print(f"usage: python {sys.argv[0]} [--bounds] fname")
+        exit(1)
+
+    try:
+        interp = Interpreter.compile(open(args[0], encoding='utf-8').read(),
+                                     check='--bounds' in sys.argv)
+    except CompileError as e:
+        for msg in e.errors:
+            print(f'{args[0]}:{msg}', file=sys.stderr)
+        exit(1)
+    try:
+        status = interp.run()
+    except (MemoryFault, ZeroDivisionError) as e:
+        sys.stdout.flush()
+        print(f'error de ejecucion: {e}', file=sys.stderr)
+        exit(1)
+    except RecursionError:
+        sys.stdout.flush()
+        print('error de ejecucion: demasiadas llamadas anidadas', file=sys.stderr)
+        exit(1)
+    sys.stdout.flush()
+    exit(status & 0xff)
@@ -145,19 +145,20 @@ class Lexer(sly.Lexer):
     # literals
     CHARACTER = r"'\w'"
 
-    @_(r'[0-9]+')
-    def INUMBER(self, t):
-        t.value = int(t.value)
-        return t
-
+    # FNUMBER va antes que INUMBER para que '2.5' no se lea como 2 y .5
     @_(r'[0-9]*\.[0-9]+|[0-9]+\.[0-9]*')
     def FNUMBER(self, t):
         t.value = float(t.value)
         return t
 
-    STRING = r'".*"'
+    @_(r'[0-9]+')
+    def INUMBER(self, t):
+        t.value = int(t.value)
+        return t
+
+    STRING = r'"(\\.|[^"\\\n])*"'
 
-    @_(r'/\*(.|\n)*\*/')
+    @_(r'/\*(.|\n)*?\*/')
     def ignore_comment(self, t):
         self.lineno += t.value.count('\n')
 
@@ -199,4 +200,4 @@ if __name__ == '__main__':
         print(f"usage: python {sys.argv[0]} fname")
         exit(1)
 
-    pprint(open(sys.argv[1], encoding='utf-8').read())    
\ No newline at end of file
+    pprint(open(sys.argv[1], encoding='utf-8').read())    
\ No newline at end of file
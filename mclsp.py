@@ -0,0 +1,476 @@
+# mclsp.py
+'''
+Servidor de lenguaje (LSP) para MiniC sobre stdio (JSON-RPC).
+
+Soporta:
+
+    textDocument/publishDiagnostics   errores de sintaxis y semanticos
+    textDocument/documentSymbol       esquema de funciones y variables globales
+    textDocument/definition           ir a la declaracion de un identificador
+
+El servidor corre en un ciclo de asyncio y nunca analiza en el propio
+ciclo: el lexer, el parser y el Checker corren en un grupo de procesos
+(analyze()).  Para mantenerse fluido mientras se escribe:
+
+  * Cada cambio reprograma el analisis del documento despues de una
+    pausa (debounce).  Un cambio nuevo cancela el analisis pendiente de
+    la version anterior.  Un analisis que ya corre en un proceso no se
+    puede interrumpir: termina, pero su resultado no se publica.  Por
+    eso un analisis solo se envia al grupo cuando hay un proceso libre
+    y su version sigue siendo la actual; nunca queda en cola detras de
+    versiones viejas.
+
+  * Los resultados se guardan por (uri, version).  Una peticion sobre
+    una version ya analizada se responde sin volver a analizar; si aun
+    no esta lista, el analisis se adelanta (sin esperar el debounce).
+
+  * Si el documento cambia mientras una peticion espera su analisis, la
+    peticion termina con el error ContentModified de LSP.
+
+Los documentos se sincronizan completos (TextDocumentSyncKind.Full).
+Las columnas se cuentan en caracteres.
+
+    python mclsp.py            servidor sobre stdin/stdout
+    python mclsp.py --bench    reproduce una sesion de edicion y mide latencias
+'''
+import asyncio
+import json
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from mcast import *
+
+
+CONTENT_MODIFIED = -32801
+METHOD_NOT_FOUND = -32601
+
+SYMBOL_FUNCTION  = 12
+SYMBOL_VARIABLE  = 13
+
+
+# ----------------------------------------------------------------------
+# Analisis (corre en los procesos del grupo)
+# ----------------------------------------------------------------------
+def init_worker():
+    # El lexer y el parser informan errores con print(); en el servidor
+    # stdout es el canal de JSON-RPC, asi que se envia a stderr.
+    sys.stdout = sys.stderr
+    import mcparse
+
+
+def analyze(text):
+    '''
+    Analiza un documento y devuelve un resultado que se puede enviar
+    entre procesos:
+
+        diagnostics : lista de Diagnostic de LSP
+        symbols     : lista de DocumentSymbol de LSP
+        refs        : {linea: [(col_ini, col_fin, Range de la declaracion)]}
+    '''
+    from mclex import Lexer
+    from mcparse import Parser
+    from mccheck import Checker
+
+    lines = LineIndex(text)
+
+    def position(index):
+        line, col = lines.position(index)
+        return { 'line': line - 1, 'character': col - 1 }
+
+    def span(node):
+        start = node_span(node) if node is not None else None
+        if start is None:
+            return None
+        start, end = start
+        return { 'start': position(start), 'end': position(end) }
+
+    def diagnostic(range, msg):
+        if range is None:
+            range = { 'start': position(0), 'end': position(0) }
+        return { 'range': range, 'severity': 1, 'source': 'minic', 'message': msg }
+
+    result = { 'diagnostics': [], 'symbols': [], 'refs': {} }
+    parser = Parser(recover=True)
+    ast = parser.parse(Lexer().tokenize(text))
+    for e in parser.errors:
+        index = e.index if e.index is not None else len(text)
+        where = position(index)
+        result['diagnostics'].append(diagnostic({ 'start': where, 'end': where }, e.msg))
+    if ast is None:
+        return result
+
+    # Con errores de sintaxis se indexan las declaraciones recuperadas,
+    # pero los errores del Checker sobre un arbol incompleto solo serian
+    # ruido: se reportan cuando el documento esta completo
+    checker = Checker.check(ast)
+    if not parser.errors:
+        for msg, node in checker.errors:
+            result['diagnostics'].append(diagnostic(span(node), msg))
+
+    for decl in ast.decl:
+        if isinstance(decl, FuncDefinition):
+            name, kind, detail = decl.name, SYMBOL_FUNCTION, decl.type
+        else:
+            type, d = pointer_type(decl.type, decl.expr)
+            kind = SYMBOL_FUNCTION if isinstance(d, tuple) else SYMBOL_VARIABLE
+            name = d[0] if isinstance(d, tuple) else d
+            detail = type
+        range = span(decl)
+        if range is None:
+            continue
+        result['symbols'].append({
+            'name'          : name.name,
+            'detail'        : detail,
+            'kind'          : kind,
+            'range'         : range,
+            'selectionRange': span(name) or range,
+        })
+
+    refs = result['refs']
+    for node in walk(ast):
+        if isinstance(node, Variable) and node.sym is not None:
+            use = span(node)
+            target = span(checker.symbols[node.sym].node)
+            if use is not None and target is not None:
+                refs.setdefault(use['start']['line'], []).append(
+                    (use['start']['character'], use['end']['character'], target))
+    return result
+
+
+# ----------------------------------------------------------------------
+# Servidor
+# ----------------------------------------------------------------------
+class Server:
+
+    debounce   = 0.15           # segundos sin cambios antes de analizar
+    cache_size = 64             # resultados guardados (uri, version)
+
+    def __init__(self, reader, out, executor, workers=1):
+        self.reader   = reader
+        self.out      = out
+        self.executor = executor
+        self.slots    = asyncio.Semaphore(workers)  # procesos libres
+        self.docs     = {}      # uri -> (version, texto)
+        self.tasks    = {}      # uri -> (version, asyncio.Task)
+        self.started  = set()   # tareas que ya pasaron el debounce
+        self.requests = set()
+        self.cache    = OrderedDict()
+        self.running  = True
+
+    # ------------------------------------------------------------------
+    # JSON-RPC
+    # ------------------------------------------------------------------
+    async def read(self):
+        length = None
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.decode('ascii').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+        body = await self.reader.readexactly(length)
+        return json.loads(body)
+
+    def send(self, msg):
+        body = json.dumps(msg, separators=(',', ':')).encode('utf-8')
+        self.out.write(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+        self.out.flush()
+
+    def notify(self, method, params):
+        self.send({ 'jsonrpc': '2.0', 'method': method, 'params': params })
+
+    async def serve(self):
+        while self.running:
+            msg = await self.read()
+            if msg is None:
+                break
+            if 'id' in msg and 'method' in msg:
+                task = asyncio.ensure_future(self.request(msg))
+                self.requests.add(task)
+                task.add_done_callback(self.requests.discard)
+            elif 'method' in msg:
+                self.notification(msg['method'], msg.get('params', {}))
+        for version, task in self.tasks.values():
+            task.cancel()
+
+    async def request(self, msg):
+        reply = { 'jsonrpc': '2.0', 'id': msg['id'] }
+        handler = getattr(self, 'on_' + msg['method'].replace('/', '_'), None)
+        if handler is None:
+            reply['error'] = { 'code': METHOD_NOT_FOUND, 'message': msg['method'] }
+        else:
+            try:
+                reply['result'] = await handler(msg.get('params', {}))
+            except asyncio.CancelledError:
+                reply['error'] = { 'code': CONTENT_MODIFIED, 'message': 'el documento cambio' }
+            except Exception as e:
+                reply['error'] = { 'code': -32603, 'message': repr(e) }
+        self.send(reply)
+
+    def notification(self, method, params):
+        if method == 'textDocument/didOpen':
+            doc = params['textDocument']
+            self.update(doc['uri'], doc['version'], doc['text'])
+        elif method == 'textDocument/didChange':
+            doc = params['textDocument']
+            self.update(doc['uri'], doc['version'], params['contentChanges'][-1]['text'])
+        elif method == 'textDocument/didClose':
+            uri = params['textDocument']['uri']
+            self.docs.pop(uri, None)
+            self.cancel(uri)
+            self.notify('textDocument/publishDiagnostics', { 'uri': uri, 'diagnostics': [] })
+        elif method == 'exit':
+            self.running = False
+
+    # ------------------------------------------------------------------
+    # Analisis con debounce y cancelacion
+    # ------------------------------------------------------------------
+    def update(self, uri, version, text):
+        self.docs[uri] = (version, text)
+        self.schedule(uri, self.debounce)
+
+    def cancel(self, uri):
+        pending = self.tasks.pop(uri, None)
+        if pending is not None:
+            pending[1].cancel()
+
+    def schedule(self, uri, delay):
+        self.cancel(uri)
+        version, text = self.docs[uri]
+        task = asyncio.ensure_future(self.run(uri, version, text, delay))
+        self.tasks[uri] = (version, task)
+        return task
+
+    async def run(self, uri, version, text, delay):
+        if delay:
+            await asyncio.sleep(delay)
+        task = asyncio.current_task()
+        self.started.add(task)
+        loop = asyncio.get_running_loop()
+        try:
+            await self.slots.acquire()
+            if self.docs.get(uri, (None,))[0] != version:
+                self.slots.release()
+                raise asyncio.CancelledError
+            future = loop.run_in_executor(self.executor, analyze, text)
+            # El proceso sigue ocupado hasta que analyze() termina, aunque
+            # esta tarea se cancele antes
+            future.add_done_callback(self.finished)
+            result = await asyncio.shield(future)
+        finally:
+            self.started.discard(task)
+
+        self.cache[uri, version] = result
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        if self.tasks.get(uri, (None,))[0] == version:
+            del self.tasks[uri]
+        if self.docs.get(uri, (None,))[0] == version:
+            self.notify('textDocument/publishDiagnostics',
+                        { 'uri': uri, 'version': version, 'diagnostics': result['diagnostics'] })
+        return result
+
+    def finished(self, future):
+        self.slots.release()
+        if not future.cancelled():
+            future.exception()      # nadie mas la lee si la tarea se cancelo
+
+    async def analysis(self, uri):
+        '''
+        Resultado del analisis de la version actual de uri.
+        '''
+        version, text = self.docs[uri]
+        result = self.cache.get((uri, version))
+        if result is not None:
+            self.cache.move_to_end((uri, version))
+            return result
+        pending = self.tasks.get(uri)
+        if pending is not None and pending[0] == version and pending[1] in self.started:
+            task = pending[1]
+        else:
+            # Si todavia esta en la pausa del debounce, se adelanta
+            task = self.schedule(uri, 0)
+        # shield: que esta peticion no cancele el analisis compartido; si
+        # un cambio nuevo lo cancela, la peticion recibe CancelledError.
+        return await asyncio.shield(task)
+
+    # ------------------------------------------------------------------
+    # Peticiones
+    # ------------------------------------------------------------------
+    async def on_initialize(self, params):
+        return {
+            'capabilities': {
+                'textDocumentSync'      : 1,
+                'documentSymbolProvider': True,
+                'definitionProvider'    : True,
+            },
+            'serverInfo': { 'name': 'minic' },
+        }
+
+    async def on_shutdown(self, params):
+        for uri in list(self.tasks):
+            self.cancel(uri)
+        return None
+
+    async def on_textDocument_documentSymbol(self, params):
+        result = await self.analysis(params['textDocument']['uri'])
+        return result['symbols']
+
+    async def on_textDocument_definition(self, params):
+        uri    = params['textDocument']['uri']
+        line   = params['position']['line']
+        col    = params['position']['character']
+        result = await self.analysis(uri)
+        for start, end, target in result['refs'].get(line, ()):
+            if start <= col <= end:
+                return { 'uri': uri, 'range': target }
+        return None
+
+
+def main(workers=None):
+    out = sys.stdout.buffer
+    sys.stdout = sys.stderr
+
+    async def start():
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=1 << 24)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        nworkers = workers or max(1, (os.cpu_count() or 2) - 1)
+        with ProcessPoolExecutor(nworkers, initializer=init_worker) as executor:
+            await Server(reader, out, executor, nworkers).serve()
+
+    asyncio.run(start())
+
+
+# ----------------------------------------------------------------------
+# Benchmark: cliente que reproduce una sesion de edicion
+# ----------------------------------------------------------------------
+class Client:
+    def __init__(self, proc):
+        self.proc    = proc
+        self.seq     = 0
+        self.waiting = {}
+        self.diagnostics = []
+
+    def send(self, msg):
+        body = json.dumps(msg).encode('utf-8')
+        self.proc.stdin.write(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+
+    def notify(self, method, params):
+        self.send({ 'jsonrpc': '2.0', 'method': method, 'params': params })
+
+    async def request(self, method, params):
+        self.seq += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.seq] = future
+        self.send({ 'jsonrpc': '2.0', 'id': self.seq, 'method': method, 'params': params })
+        await self.proc.stdin.drain()
+        return await future
+
+    async def listen(self):
+        reader = self.proc.stdout
+        while True:
+            header = await reader.readuntil(b'\r\n\r\n')
+            length = int(header.split(b':')[1])
+            msg = json.loads(await reader.readexactly(length))
+            if 'id' in msg:
+                self.waiting.pop(msg['id']).set_result(msg)
+            elif msg.get('method') == 'textDocument/publishDiagnostics':
+                self.diagnostics.append(msg['params'])
+
+
+def edit_session(nfuncs=40):
+    '''
+    Documento inicial y secuencia de textos que simula escribir una
+    funcion nueva caracter por caracter al final del archivo.
+    '''
+    from mccheck import generate
+    base  = generate(nfuncs * 12)
+    typed = '\nint nueva(int a) {\n  int k;\n  k = f0(a, 0, 1) + total;\n  return k;\n}\n'
+    return base, [ base + typed[:i] for i in range(1, len(typed) + 1) ]
+
+
+def bench(interval=0.02):
+    import statistics
+    import time
+
+    async def session():
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL, limit=1 << 24)
+        client = Client(proc)
+        listener = asyncio.ensure_future(client.listen())
+        await client.request('initialize', { 'capabilities': {} })
+
+        uri = 'file:///bench.c'
+        base, edits = edit_session()
+        client.notify('textDocument/didOpen',
+                      { 'textDocument': { 'uri': uri, 'languageId': 'minic', 'version': 0, 'text': base } })
+        await client.request('textDocument/documentSymbol', { 'textDocument': { 'uri': uri } })
+
+        # Las respuestas con resultado y las canceladas (ContentModified)
+        # se miden por separado: una cancelacion llega en cuanto cambia el
+        # documento y no dice cuanto tarda el analisis
+        keys      = ('documentSymbol', 'definition', 'cached')
+        latencies = { key: [] for key in keys }
+        cancelled = { key: [] for key in keys }
+
+        async def timed(method, params, key=None):
+            t0 = time.perf_counter()
+            reply = await client.request('textDocument/' + method, params)
+            dt = time.perf_counter() - t0
+            (cancelled if 'error' in reply else latencies)[key or method].append(dt)
+
+        pending = []
+        for version, text in enumerate(edits, 1):
+            client.notify('textDocument/didChange', {
+                'textDocument'  : { 'uri': uri, 'version': version },
+                'contentChanges': [ { 'text': text } ],
+            })
+            if version % 5 == 0:
+                pending.append(asyncio.ensure_future(timed('documentSymbol', { 'textDocument': { 'uri': uri } })))
+            if version % 7 == 0:
+                pending.append(asyncio.ensure_future(timed('definition', {
+                    'textDocument': { 'uri': uri }, 'position': { 'line': 7, 'character': 8 } })))
+            await asyncio.sleep(interval)
+        await asyncio.gather(*pending)
+
+        # Despues de la ultima pausa las peticiones usan el cache
+        for _ in range(20):
+            await timed('documentSymbol', { 'textDocument': { 'uri': uri } }, 'cached')
+
+        await client.request('shutdown', None)
+        client.notify('exit', None)
+        await proc.stdin.drain()
+        proc.stdin.close()
+        await proc.wait()
+        listener.cancel()
+        return len(edits), latencies, cancelled, len(client.diagnostics)
+
+    def summary(times):
+        if not times:
+            return f'n={0:4d}' + ' ' * 32
+        times = sorted(times)
+        p99 = times[min(len(times) - 1, int(0.99 * len(times)))]
+        return f'n={len(times):4d}  p50 {1e3*statistics.median(times):7.1f} ms  p99 {1e3*p99:7.1f} ms'
+
+    nedits, latencies, cancelled, ndiags = asyncio.run(session())
+    print(f'{nedits} cambios cada {1e3*interval:.0f} ms, {ndiags} publicaciones de diagnosticos, '
+          f'{sum(map(len, cancelled.values()))} peticiones canceladas por cambios (ContentModified)')
+    print(f'  {"":15s} {"con resultado":38s}  canceladas')
+    for key in latencies:
+        print(f'  {key:15s} {summary(latencies[key])}  {summary(cancelled[key])}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] == '--bench':
+        bench()
+    else:
+        main()
@@ -0,0 +1,373 @@
+# mcmem.py
+'''
+Modelo de memoria para ejecutar programas MiniC.
+
+Toda la memoria del programa (globales, marcos de funcion, memoria de
+malloc y literales de cadena) vive en un solo bytearray que crece al
+doble cuando se llena.  Las direcciones son enteros: posiciones dentro
+del bytearray.  La direccion 0 (NULL) y los primeros bytes nunca se
+asignan.
+
+Los valores se leen y escriben con memoryview tipados sobre el mismo
+bytearray:
+
+    tipo        bytes   vista
+    char          1     'b'   (con signo)
+    int           4     'i'
+    float         8     'd'   (double)
+    apuntador     8     'q'
+
+Los bloques estan alineados a 8 bytes, asi que un int en addr se lee
+como i32[addr >> 2] sin desempacar con struct.  Una direccion
+desalineada (p.ej. un char* que se usa como int*) se lee y escribe con
+struct en su posicion exacta.
+
+Asignacion de bloques:
+
+    alloc(size) redondea size a multiplo de 8 y toma un bloque de la
+    lista libre de ese tamano; si esta vacia, avanza el tope (bump).
+    free(addr) devuelve el bloque a su lista.  Los marcos de funcion son
+    casi siempre del mismo tamano, asi que cada llamada es un pop y un
+    append.
+
+Verificacion de limites (check=True):
+
+    Una sombra de un byte por byte de memoria marca que bytes pertenecen
+    a un bloque vivo, y despues de cada bloque quedan 8 bytes que nunca
+    se marcan (zona roja).  Un acceso de hasta 8 bytes que empieza y
+    termina en bytes marcados esta dentro de un bloque; uno que se sale
+    del bloque, usa memoria liberada o NULL lanza MemoryFault.
+'''
+import struct
+from bisect import bisect_right
+
+
+ALIGN   = 8
+REDZONE = 8
+
+# Formatos para los accesos desalineados
+FORMATS = { 'int': struct.Struct('<i'), 'float': struct.Struct('<d'), 'ptr': struct.Struct('<q') }
+
+SIZES = { 'char': 1, 'int': 4, 'float': 8, 'void': 1 }   # void* avanza de a 1 byte (GNU)
+
+
+def sizeof(type):
+    if type.endswith('*'):
+        return 8
+    return SIZES[type]
+
+
+class MemoryFault(RuntimeError):
+    pass
+
+
+class Memory:
+
+    def __init__(self, size=1 << 16, check=False):
+        self.data   = bytearray(max(size, 64))
+        self.check  = check
+        self.shadow = bytearray(len(self.data)) if check else None
+        self.top    = 2 * ALIGN     # NULL y los primeros bytes no se usan
+        self.free_lists = {}        # tamano -> [direcciones]
+        self.sizes  = {}            # direccion -> tamano de los bloques vivos
+        self.peak   = self.top
+        self.views()
+
+    def views(self):
+        self.mv  = memoryview(self.data)
+        self.i8  = self.mv.cast('b')
+        self.i32 = self.mv.cast('i')
+        self.i64 = self.mv.cast('q')
+        self.f64 = self.mv.cast('d')
+
+    def release(self):
+        for view in (self.i8, self.i32, self.i64, self.f64, self.mv):
+            view.release()
+
+    def grow(self, need):
+        size = len(self.data)
+        while size < need:
+            size *= 2
+        # Un bytearray con vistas exportadas no puede cambiar de tamano
+        self.release()
+        self.data.extend(bytes(size - len(self.data)))
+        if self.shadow is not None:
+            self.shadow.extend(bytes(size - len(self.shadow)))
+        self.views()
+
+    # ------------------------------------------------------------------
+    # Asignacion
+    # ------------------------------------------------------------------
+    def alloc(self, size):
+        '''
+        Asigna un bloque de al menos size bytes, en ceros, y devuelve su
+        direccion.
+        '''
+        size = (max(size, 1) + ALIGN - 1) & -ALIGN
+        free = self.free_lists.get(size)
+        if free:
+            addr = free.pop()
+            self.data[addr:addr + size] = bytes(size)
+        else:
+            addr = self.top
+            end  = addr + size + (REDZONE if self.check else 0)
+            if end > len(self.data):
+                self.grow(end)
+            self.top = end
+            if end > self.peak:
+                self.peak = end
+        self.sizes[addr] = size
+        if self.check:
+            self.shadow[addr:addr + size] = b'\1' * size
+        return addr
+
+    def free(self, addr):
+        if addr == 0:
+            return
+        size = self.sizes.pop(addr, None)
+        if size is None:
+            raise MemoryFault(f'free de una direccion no asignada: {addr:#x}')
+        if self.check:
+            self.shadow[addr:addr + size] = bytes(size)
+        self.free_lists.setdefault(size, []).append(addr)
+
+    def used(self):
+        return sum(self.sizes.values())
+
+    # ------------------------------------------------------------------
+    # Acceso
+    # ------------------------------------------------------------------
+    def verify(self, addr, size):
+        shadow = self.shadow
+        if addr <= 0 or addr + size > len(shadow) or not shadow[addr] or not shadow[addr + size - 1]:
+            raise MemoryFault(self.describe(addr, size))
+
+    def describe(self, addr, size):
+        if addr == 0:
+            return 'acceso a NULL'
+        starts = sorted(self.sizes)
+        i = bisect_right(starts, addr) - 1
+        if i >= 0:
+            start = starts[i]
+            return (f'acceso de {size} bytes en {addr:#x}, fuera del bloque '
+                    f'{start:#x} de {self.sizes[start]} bytes (desplazamiento {addr - start})')
+        return f'acceso de {size} bytes en {addr:#x}, fuera de todo bloque'
+
+    def loader(self, type, checked=None):
+        '''
+        Funcion addr -> valor para leer un valor de tipo type.  Las
+        vistas se buscan en cada acceso porque grow() las reemplaza.
+        '''
+        checked = self.check if checked is None else checked
+        size = sizeof(type)
+        if type == 'int':
+            unpack = FORMATS['int'].unpack_from
+            load = lambda addr: self.i32[addr >> 2] if not addr & 3 else unpack(self.data, addr)[0]
+        elif type == 'char':
+            load = lambda addr: self.i8[addr]
+        elif type == 'float':
+            unpack = FORMATS['float'].unpack_from
+            load = lambda addr: self.f64[addr >> 3] if not addr & 7 else unpack(self.data, addr)[0]
+        else:
+            unpack = FORMATS['ptr'].unpack_from
+            load = lambda addr: self.i64[addr >> 3] if not addr & 7 else unpack(self.data, addr)[0]
+        if not checked:
+            return load
+        verify = self.verify
+
+        def checked_load(addr):
+            verify(addr, size)
+            return load(addr)
+        return checked_load
+
+    def storer(self, type, checked=None):
+        '''
+        Funcion (addr, valor) para escribir un valor de tipo type.  El
+        valor ya debe estar en el rango del tipo.
+        '''
+        checked = self.check if checked is None else checked
+        size = sizeof(type)
+        if type == 'int':
+            pack = FORMATS['int'].pack_into
+            def store(addr, value):
+                if addr & 3:
+                    pack(self.data, addr, value)
+                else:
+                    self.i32[addr >> 2] = value
+        elif type == 'char':
+            def store(addr, value):
+                self.i8[addr] = value
+        elif type == 'float':
+            pack = FORMATS['float'].pack_into
+            def store(addr, value):
+                if addr & 7:
+                    pack(self.data, addr, value)
+                else:
+                    self.f64[addr >> 3] = value
+        else:
+            pack = FORMATS['ptr'].pack_into
+            def store(addr, value):
+                if addr & 7:
+                    pack(self.data, addr, value)
+                else:
+                    self.i64[addr >> 3] = value
+        if not checked:
+            return store
+        verify = self.verify
+
+        def checked_store(addr, value):
+            verify(addr, size)
+            store(addr, value)
+        return checked_store
+
+    def cstring(self, addr):
+        '''
+        Cadena terminada en 0 que empieza en addr.
+        '''
+        if self.check:
+            self.verify(addr, 1)
+        end = self.data.index(0, addr)
+        if self.check and not all(self.shadow[addr:end + 1]):
+            raise MemoryFault(self.describe(end, 1))
+        return self.data[addr:end].decode('latin-1')
+
+    def store_bytes(self, addr, data):
+        self.data[addr:addr + len(data)] = data
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+KERNELS = {
+'suma': '''
+extern void *malloc(int n);
+extern int printf(char *fmt, ...);
+int main() {
+    int *a;
+    int i;
+    int j;
+    int s;
+    a = malloc(N * 4);
+    for (i = 0; i < N; i += 1) { a[i] = i % 7; }
+    s = 0;
+    for (j = 0; j < 10; j += 1) {
+        for (i = 0; i < N; i += 1) { s = s + a[i]; }
+    }
+    printf("%d\\n", s);
+    return 0;
+}
+''',
+'criba': '''
+extern void *malloc(int n);
+extern int printf(char *fmt, ...);
+int main() {
+    char *p;
+    int i;
+    int j;
+    int n;
+    p = malloc(N);
+    for (i = 2; i < N; i += 1) { p[i] = 1; }
+    n = 0;
+    for (i = 2; i < N; i += 1) {
+        if (p[i]) { {
+            n += 1;
+            for (j = i + i; j < N; j += i) { p[j] = 0; }
+        } }
+    }
+    printf("%d\\n", n);
+    return 0;
+}
+''',
+'burbuja': '''
+extern void *malloc(int n);
+extern int printf(char *fmt, ...);
+void sort(int *a, int n) {
+    int i;
+    int j;
+    int t;
+    for (i = 0; i < n; i += 1) {
+        for (j = 0; j < n - 1 - i; j += 1) {
+            if (a[j] > a[j + 1]) { { t = a[j]; a[j] = a[j + 1]; a[j + 1] = t; } }
+        }
+    }
+}
+int main() {
+    int *a;
+    int i;
+    int n;
+    n = N / 100;
+    a = malloc(n * 4);
+    for (i = 0; i < n; i += 1) { a[i] = (i * 7919) % n; }
+    sort(a, n);
+    printf("%d %d\\n", a[0], a[n - 1]);
+    return 0;
+}
+''',
+'matmul': '''
+extern void *malloc(int n);
+extern int printf(char *fmt, ...);
+int main() {
+    float *a;
+    float *b;
+    float *c;
+    float s;
+    int n;
+    int i;
+    int j;
+    int k;
+    n = 40;
+    a = malloc(n * n * 8);
+    b = malloc(n * n * 8);
+    c = malloc(n * n * 8);
+    for (i = 0; i < n * n; i += 1) { a[i] = i % 5; b[i] = i % 3; }
+    for (i = 0; i < n; i += 1) {
+        for (j = 0; j < n; j += 1) {
+            s = 0.0;
+            for (k = 0; k < n; k += 1) { s = s + a[i * n + k] * b[k * n + j]; }
+            *(c + i * n + j) = s;
+        }
+    }
+    printf("%f\\n", c[n * n - 1]);
+    return 0;
+}
+''',
+}
+
+
+def bench(n=100000):
+    import io
+    import sys
+    import time
+    from mcinterp import Interpreter
+
+    print(f'N = {n}')
+    print(f'  {"kernel":10s} {"sin verificar":>14s} {"verificando":>12s}  {"memoria":>10s}  salida')
+    for name, src in KERNELS.items():
+        src = src.replace('N', str(n))
+        times = []
+        for check in (False, True):
+            out = io.StringIO()
+            interp = Interpreter.compile(src, out=out, check=check)
+            t0 = time.perf_counter()
+            interp.run()
+            times.append(time.perf_counter() - t0)
+        print(f'  {name:10s} {times[0]:12.3f} s {times[1]:10.3f} s  '
+              f'{interp.mem.peak/2**10:7.0f} KiB  {out.getvalue().strip()}')
+
+    # El mismo arreglo de n enteros como lista de Python y en Memory
+    values = [ i % 7 for i in range(n) ]
+    as_list = sys.getsizeof(values) + sum(sys.getsizeof(v) for v in set(values))
+    as_dict = sys.getsizeof(dict(enumerate(values))) + sum(sys.getsizeof(i) for i in range(n))
+    print(f'  {n} int: Memory {4*n/2**10:.0f} KiB, list {as_list/2**10:.0f} KiB, '
+          f'dict {as_dict/2**10:.0f} KiB')
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) in (2, 3) and sys.argv[1] == '--bench':
+        bench(*map(int, sys.argv[2:]))
+        exit(0)
+
+    print(f"usage: python {sys.argv[0]} --bench [N]")
+    exit(1)
@@ -2,6 +2,8 @@ import argparse
 import sly
 
 
+import mcast
+
 from mclex import Lexer
 from mcast import (TranslationUnit,
     FuncDefinition,
@@ -16,13 +18,70 @@ from mcast import (TranslationUnit,
     Return,
     IfStmt,
     Break,
-    VarDefinition
+    VarDefinition,
+    Call,
+    Index,
+    pointer_type,
+    pack_span,
+    node_span,
+    LineIndex,
+    walk,
     ) 
 
 class Parser(sly.Parser):
     debugfile = "minic.txt"
 
     tokens = Lexer.tokens
+
+    def __init__(self, exprs=None, recover=False):
+        # Fabrica de nodos de expresion.  Por defecto son las clases de
+        # mcast; mccons.ExprFactory() construye expresiones compartidas.
+        self.exprs = mcast if exprs is None else exprs
+
+        # Con recover=True los errores de sintaxis no detienen el analisis:
+        # se guardan en errors (SyntaxError con lineno e index) y el parser
+        # se resincroniza en el siguiente ';' o '}'.  parse() devuelve el
+        # TranslationUnit con lo que se pudo analizar.
+        self.recover = recover
+        self.errors  = []
+
+    def parse(self, tokens):
+        self.errors = []
+        # SLY registra (inicio, fin) de cada valor producido por una regla
+        # en un diccionario indexado por id().  Se pasa a node.span y el
+        # diccionario se libera, tambien si el analisis lanza: un id()
+        # reciclado en el siguiente analisis tomaria una posicion vieja.
+        # Un nodo compartido (mccons) queda con la posicion de su ultima
+        # aparicion.
+        try:
+            ast = super().parse(tokens)
+            fallback = ast is None and self.recover
+            if fallback:
+                # Error al final del archivo: SLY abandona el analisis, pero
+                # las declaraciones completas siguen en la pila.
+                decls = [ sym.value for sym in self.symstack if sym.type == 'translation_unit' ]
+                ast = TranslationUnit(decls[0] if decls else [])
+
+            positions = self._index_positions
+            if ast is not None:
+                for node in walk(ast):
+                    start, end = positions.get(id(node), (None, None))
+                    if start is not None:
+                        node.span = pack_span(start, end)
+            if fallback:
+                # Este TranslationUnit no salio de una regla: su id() puede
+                # coincidir con el de un valor viejo de la tabla
+                first, last = ast.decl[:1], ast.decl[-1:]
+                if first and first[0].span is not None and last[0].span is not None:
+                    ast.span = pack_span(node_span(first[0])[0], node_span(last[0])[1])
+                else:
+                    ast.span = None
+        finally:
+            # SLY crea los diccionarios dentro de parse()
+            if hasattr(self, '_index_positions'):
+                self._index_positions.clear()
+                self._line_positions.clear()
+        return ast
     
     @_("translation_unit")
     def program(self, p):
@@ -30,10 +89,14 @@ class Parser(sly.Parser):
 
     @_("external_declaration")
     def translation_unit(self, p):
+        if p.external_declaration is None:
+            return []
         return [ p.external_declaration ]
 
     @_("translation_unit external_declaration")
     def translation_unit(self, p):
+        if p.external_declaration is None:
+            return p.translation_unit
         return p.translation_unit + [ p.external_declaration ]
 
     @_("function_definition", 
@@ -41,13 +104,23 @@ class Parser(sly.Parser):
     def external_declaration(self, p):
         return p[0]
 
+    # Recuperacion de errores (solo con recover=True; en el modo normal
+    # error() lanza SyntaxError antes de llegar aqui)
+    @_("error ';'",
+       "error '}'")
+    def external_declaration(self, p):
+        self.errok()
+        return None
+
     @_("type_specifier declarator compound_statement")
     def function_definition(self, p):
-        return FuncDefinition( p.type_specifier, p.declarator[0], p.declarator[1], p.compound_statement )
+        type, decl = pointer_type(p.type_specifier, p.declarator)
+        return FuncDefinition( type, decl[0], decl[1], p.compound_statement )
 
     @_("STATIC type_specifier declarator compound_statement")
     def function_definition(self, p):
-        return FuncDefinition(p.type_specifier, p.declarator[0], p.declarator[1], p.compound_statement, True)
+        type, decl = pointer_type(p.type_specifier, p.declarator)
+        return FuncDefinition(type, decl[0], decl[1], p.compound_statement, True)
 
     @_("type_specifier declarator ';'")
     def declaration(self, p):
@@ -55,7 +128,7 @@ class Parser(sly.Parser):
 
     @_("EXTERN type_specifier declarator ';'")
     def declaration(self, p):
-        return VarDefinition(p.type_specifier,  p.declarator, None)
+        return VarDefinition(p.type_specifier,  p.declarator, True)
 
     @_("empty")
     def declaration_list_opt(self, p):
@@ -95,7 +168,7 @@ class Parser(sly.Parser):
 
     @_("direct_declarator '(' ')'")
     def direct_declarator(self, p):
-        return p.direct_declarator
+        return ( p.direct_declarator, [] )
 
     @_("parameter_list")
     def parameter_type_list(self, p):
@@ -125,6 +198,16 @@ class Parser(sly.Parser):
     def compound_statement(self, p):
         return p.declaration_list_opt
 
+    @_("'{' declaration_list_opt statement_list error '}'")
+    def compound_statement(self, p):
+        self.errok()
+        return (p.declaration_list_opt, p.statement_list)
+
+    @_("'{' declaration_list_opt error '}'")
+    def compound_statement(self, p):
+        self.errok()
+        return p.declaration_list_opt
+
     @_("expression ';'")
     def expression_statement(self, p):
         return ExprStmt(p.expression)
@@ -137,7 +220,7 @@ class Parser(sly.Parser):
        "equality_expression ADDEQ expression",
        "equality_expression SUBEQ expression")
     def expression(self, p):
-        return Binary(p[1], p.equality_expression, p.expression)
+        return self.exprs.Binary(p[1], p.equality_expression, p.expression)
         
     @_("relational_expression")
     def equality_expression(self, p):
@@ -146,7 +229,7 @@ class Parser(sly.Parser):
     @_("equality_expression EQ relational_expression",
        "equality_expression NE relational_expression")
     def equality_expression(self, p):
-        return Binary(p[1], p.equality_expression, p.relational_expression)
+        return self.exprs.Binary(p[1], p.equality_expression, p.relational_expression)
 
     @_("additive_expression")
     def relational_expression(self, p):
@@ -157,7 +240,7 @@ class Parser(sly.Parser):
        "relational_expression '>' additive_expression",
        "relational_expression GE  additive_expression")
     def relational_expression(self, p):
-        return Binary(p[1], p.relational_expression, p.additive_expression)
+        return self.exprs.Binary(p[1], p.relational_expression, p.additive_expression)
 
     @_("primary_expression")
     def postfix_expression(self, p):
@@ -165,23 +248,23 @@ class Parser(sly.Parser):
 
     @_("postfix_expression '(' argument_expression_list ')'")
     def postfix_expression(self, p):
-        return (p.postfix_expression, p.argument_expression_list)
+        return self.exprs.Call(p.postfix_expression, p.argument_expression_list)
 
     @_("postfix_expression '(' ')'")
     def postfix_expression(self, p):
-        return p.postfix_expression
+        return self.exprs.Call(p.postfix_expression, [])
 
     @_("postfix_expression '[' expression ']'")
     def postfix_expression(self, p):
-        return (p.postfix_expression, p.expression)
+        return self.exprs.Index(p.postfix_expression, p.expression)
 
     @_("expression")
     def argument_expression_list(self, p):
-        return p.expression
+        return [ p.expression ]
 
     @_("argument_expression_list ',' expression")
     def argument_expression_list(self, p):
-        return (p.argument_expression_list, p.expression)
+        return p.argument_expression_list + [ p.expression ]
 
     @_("postfix_expression")
     def unary_expression(self, p):
@@ -189,23 +272,23 @@ class Parser(sly.Parser):
 
     @_("'-' unary_expression")
     def unary_expression(self, p):
-        return Unary(p[0], p.unary_expression)
+        return self.exprs.Unary(p[0], p.unary_expression)
 
     @_("'+' unary_expression")
     def unary_expression(self, p):
-        return Unary(p[0], p.unary_expression )
+        return self.exprs.Unary(p[0], p.unary_expression )
 
     @_("'!' unary_expression")
     def unary_expression(self, p):
-        return Unary(p[0], p.unary_expression)
+        return self.exprs.Unary(p[0], p.unary_expression)
 
     @_("'*' unary_expression")
     def unary_expression(self, p):
-        return Unary(p[0], p.unary_expression)
+        return self.exprs.Unary(p[0], p.unary_expression)
 
     @_("'&' unary_expression")
     def unary_expression(self, p):
-        return Unary(p[0], p.unary_expression)
+        return self.exprs.Unary(p[0], p.unary_expression)
 
     @_("unary_expression")
     def mult_expression(self, p):
@@ -215,7 +298,7 @@ class Parser(sly.Parser):
        "mult_expression '/' unary_expression",
        "mult_expression '%' unary_expression")
     def mult_expression(self, p):
-        return Binary(p[1], p.mult_expression, p.unary_expression )
+        return self.exprs.Binary(p[1], p.mult_expression, p.unary_expression )
 
     @_("mult_expression")
     def additive_expression(self, p):
@@ -224,23 +307,23 @@ class Parser(sly.Parser):
     @_("additive_expression '+' mult_expression",
        "additive_expression '-' mult_expression")
     def additive_expression(self, p):
-        return (p[1], p.additive_expression, p.mult_expression )
+        return self.exprs.Binary(p[1], p.additive_expression, p.mult_expression )
 
     @_("ID")
     def primary_expression(self, p):
-        return Literal(p.ID)
+        return self.exprs.Variable(p.ID)
 
     @_("INUMBER")
     def primary_expression(self, p):
-        return Literal(p.INUMBER)
+        return self.exprs.Literal(p.INUMBER)
 
     @_("FNUMBER")
     def primary_expression(self, p):
-        return Literal(p.FNUMBER)
+        return self.exprs.Literal(p.FNUMBER)
 
     @_("CHARACTER")
     def primary_expression(self, p):
-        return Literal(p.CHARACTER)
+        return self.exprs.Literal(p.CHARACTER)
 
     @_("string_literal")
     def primary_expression(self, p):
@@ -252,11 +335,12 @@ class Parser(sly.Parser):
 
     @_("STRING")
     def string_literal(self, p):
-        return Literal(p.STRING)
+        return self.exprs.Literal(p.STRING)
 
     @_("string_literal STRING")
     def string_literal(self, p):
-        return (p.string_literal + p.STRING)
+        # Cadenas adyacentes se unen en un solo literal: "ab" "cd" -> "abcd"
+        return self.exprs.Literal(p.string_literal.value[:-1] + p.STRING[1:])
 
     @_("compound_statement",
        "expression_statement",
@@ -268,7 +352,7 @@ class Parser(sly.Parser):
 
     @_("RETURN ';'")
     def jumstatement(self, p):
-        return p.RETURN
+        return Return(None)
 
     @_("RETURN expression ';'")
     def jumstatement(self, p):
@@ -299,12 +383,21 @@ class Parser(sly.Parser):
         return IfStmt(p.expression, p.statement0, p.statement1)
 
 
+    @_("error ';'")
+    def statement(self, p):
+        self.errok()
+        return None
+
     @_("statement")
     def statement_list(self, p):
+        if p.statement is None:
+            return []
         return [ p.statement ]
 
     @_("statement_list statement")
     def statement_list(self, p):
+        if p.statement is None:
+            return p.statement_list
         return p.statement_list + [ p.statement ]
 
     @_("")
@@ -314,12 +407,105 @@ class Parser(sly.Parser):
     def error(self, p):
         lineno = p.lineno if p else 'EOF'
         value  = p.value  if p else 'EOF'
+
+        # lineno e index (posicion en el texto) del token que fallo
+        err = SyntaxError(f"Error de Sintaxis en {value}")
+        err.lineno = p.lineno if p else None
+        err.index  = p.index  if p else None
+        if self.recover:
+            self.errors.append(err)
+            return
         print(f"{lineno}: Error de Sintaxis en {value}")
+        raise err
+
+def bench(nlines=20000):
+    '''
+    Costo de guardar la posicion de cada nodo: un entero empacado por
+    nodo contra el diccionario id(valor) -> (inicio, fin) que deja SLY.
+    '''
+    import sys
+    import time
+    from mccheck import generate
+
+    txt = generate(nlines)
+    p = Parser()
+    t0 = time.perf_counter()
+    ast = super(Parser, p).parse(Lexer().tokenize(txt))
+    t1 = time.perf_counter()
+    positions = len(p._index_positions)
+    sly_bytes = sys.getsizeof(p._index_positions) + sum(
+        sys.getsizeof(k) + sys.getsizeof(v) + sum(sys.getsizeof(x) for x in v)
+        for k, v in p._index_positions.items())
+    p._index_positions.clear()
+    p._line_positions.clear()
+
+    t2 = time.perf_counter()
+    ast = p.parse(Lexer().tokenize(txt))
+    t3 = time.perf_counter()
+    nodes = [ n for n in walk(ast) if n.span is not None ]
+    span_bytes = sum(sys.getsizeof(n.span) for n in nodes)
+    lines = LineIndex(txt)
+    index_bytes = sys.getsizeof(lines.starts)
+
+    t4 = time.perf_counter()
+    for n in nodes:
+        lines.location(n)
+    t5 = time.perf_counter()
+
+    print(f'{nlines} lineas, {len(nodes)} nodos')
+    print(f'  parse sin spans   {t1-t0:7.3f} s  ({positions} posiciones en el diccionario de SLY, '
+          f'{sly_bytes/2**20:.1f} MiB)')
+    print(f'  parse con spans   {t3-t2:7.3f} s  ({span_bytes/len(nodes):.1f} B por nodo, '
+          f'{span_bytes/2**20:.1f} MiB)')
+    print(f'  LineIndex         {index_bytes/2**10:7.1f} KiB')
+    print(f'  linea:columna     {1e9*(t5-t4)/len(nodes):7.0f} ns por nodo')
+
+
+def bench_recover(nlines=20000, every=100):
+    '''
+    Costo del modo recover=True sobre texto sin errores, y errores
+    encontrados en el mismo texto con un ';' borrado cada `every` lineas.
+    '''
+    import time
+    from mccheck import generate
+
+    txt = generate(nlines)
+
+    def best(parser, text, repeat=3):
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            ast = parser.parse(Lexer().tokenize(text))
+            times.append(time.perf_counter() - t0)
+        return ast, min(times)
+
+    strict, t_strict = best(Parser(), txt)
+    recovered, t_recover = best(Parser(recover=True), txt)
+
+    lines = txt.splitlines()
+    broken = 0
+    for i in range(0, len(lines), every):
+        if lines[i].endswith(';'):
+            lines[i] = lines[i][:-1]
+            broken += 1
+    p = Parser(recover=True)
+    partial, t_errors = best(p, '\n'.join(lines), repeat=1)
+
+    print(f'{nlines} lineas')
+    print(f'  sin errores, normal   {t_strict:7.3f} s')
+    print(f'  sin errores, recover  {t_recover:7.3f} s  ({100*(t_recover/t_strict-1):+.1f}%, '
+          f'mismo arbol: {recovered == strict})')
+    print(f'  {broken} lineas rotas      {t_errors:7.3f} s  ({len(p.errors)} errores, '
+          f'{len(partial.decl)} de {len(strict.decl)} declaraciones)')
 
-        raise SyntaxError()
 
 if __name__ == '__main__':
     import sys
+
+    if len(sys.argv) == 2 and sys.argv[1] == '--bench':
+        bench()
+        bench_recover()
+        exit(0)
     
     if len(sys.argv) != 2:
         print(f"usage: python {sys.argv[0]} [ fname1 [ fname2 ... ] ]   --ast")
@@ -331,4 +517,4 @@ if __name__ == '__main__':
 
     ast = p.parse(l.tokenize(txt))
     
-    print(ast)
\ No newline at end of file
+    print(ast)
\ No newline at end of file
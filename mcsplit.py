@@ -0,0 +1,304 @@
+# mcsplit.py
+'''
+Analisis en paralelo de un solo archivo MiniC muy grande.
+
+Un programa MiniC es una lista de external_declaration, y cada una
+termina en un ';' o en el '}' de una funcion con la profundidad de
+llaves en 0.  Un recorrido rapido del texto (una expresion regular que
+solo reconoce llaves, ';', cadenas, caracteres y comentarios) encuentra
+esos limites sin pasar por el lexer.  El texto se corta en trozos de
+tamano parecido, siempre en un limite, y cada trozo se analiza en un
+proceso del grupo:
+
+    - el lexer del trozo empieza en su numero de linea real, asi que
+      lineno de tokens y errores es el del archivo completo
+    - los span de los nodos se desplazan a su posicion en el archivo
+    - el arbol vuelve al proceso principal codificado con mcbin
+
+Los trozos se reciben en orden y sus declaraciones se unen en un solo
+TranslationUnit, igual al que devuelve Parser sobre el archivo completo.
+
+    python mcsplit.py fname [jobs]      analiza y muestra el tiempo
+    python mcsplit.py --check           compara los trozos con Parser
+    python mcsplit.py --bench [N]       aceleracion contra numero de procesos
+'''
+import os
+import re
+
+from mcast import *
+
+
+BOUNDARY = re.compile(r'''
+      "(?:\\.|[^"\\\n])*"          # cadenas
+    | '(?:\\.|[^'\\\n])*'          # caracteres
+    | /\*.*?\*/                    # comentarios
+    | //[^\n]*
+    | [{};]
+    ''', re.S | re.X)
+
+
+def boundaries(text):
+    '''
+    Genera la posicion siguiente al final de cada declaracion externa.
+    '''
+    depth = 0
+    for m in BOUNDARY.finditer(text):
+        c = m.group()
+        if c == ';':
+            if depth == 0:
+                yield m.end()
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            if depth > 0:
+                depth -= 1
+            if depth == 0:
+                yield m.end()
+
+
+def split(text, nchunks):
+    '''
+    Corta text en a lo sumo nchunks trozos de tamano parecido, en limites
+    de declaraciones.  Devuelve [(offset, lineno, trozo)].
+    '''
+    target = max(len(text) // max(nchunks, 1), 1)
+    chunks = []
+    start  = 0
+    lineno = 1
+    for end in boundaries(text):
+        if end - start >= target:
+            chunks.append((start, lineno, text[start:end]))
+            lineno += text.count('\n', start, end)
+            start = end
+    if start < len(text):
+        # Lo que sigue al ultimo corte (la ultima declaracion, espacios o
+        # comentarios) va con el trozo anterior
+        if chunks:
+            offset, lineno, _ = chunks.pop()
+            chunks.append((offset, lineno, text[offset:]))
+        else:
+            chunks.append((0, 1, text))
+    return chunks
+
+
+def parse_chunk(chunk, recover=False):
+    '''
+    Analiza un trozo (offset, lineno, texto).  Devuelve el arbol
+    codificado con mcbin y los errores como (mensaje, lineno, index).
+    '''
+    import mcbin
+    from mclex import Lexer
+    from mcparse import Parser
+
+    offset, lineno, text = chunk
+    shift  = offset << SPAN_BITS | offset
+    parser = Parser(recover=recover)
+    try:
+        ast = parser.parse(Lexer().tokenize(text, lineno=lineno))
+    except SyntaxError as e:
+        index = e.index + offset if e.index is not None else None
+        return None, [ (e.msg, e.lineno, index) ]
+
+    errors = [ (e.msg, e.lineno, e.index + offset if e.index is not None else None)
+               for e in parser.errors ]
+    if ast is None:
+        return None, errors
+    for node in walk(ast):
+        if node.span is not None:
+            node.span += shift
+    return mcbin.dumps(ast), errors
+
+
+class ParallelParser:
+    '''
+    Misma interfaz que Parser, pero parse() recibe el texto completo.
+
+        jobs       : procesos (por defecto, uno por CPU)
+        chunks     : trozos por proceso; mas trozos reparten mejor el
+                     trabajo, menos trozos reducen el costo por trozo
+        recover    : como en Parser; sin recover se lanza el primer error
+    '''
+    def __init__(self, jobs=None, chunks=4, recover=False, executor=None):
+        self.jobs     = jobs or os.cpu_count() or 1
+        self.chunks   = chunks
+        self.recover  = recover
+        self.executor = executor
+        self.errors   = []
+
+    def parse(self, text):
+        from functools import partial
+
+        self.errors = []
+        if self.executor is None and self.jobs == 1:
+            # Sin paralelismo no hay nada que ganar cortando el texto
+            from mclex import Lexer
+            from mcparse import Parser
+            parser = Parser(recover=self.recover)
+            ast = parser.parse(Lexer().tokenize(text))
+            self.errors = parser.errors
+            return ast
+
+        chunks = split(text, self.jobs * self.chunks)
+        work   = partial(parse_chunk, recover=self.recover)
+        if self.executor is not None:
+            return self.stitch(self.executor.map(work, chunks))
+        if len(chunks) <= 1:
+            return self.stitch(map(work, chunks))
+
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(self.jobs, len(chunks))) as executor:
+            return self.stitch(executor.map(work, chunks))
+
+    def stitch(self, results):
+        import mcbin
+
+        decls = []
+        for data, errors in results:
+            for msg, lineno, index in errors:
+                err = SyntaxError(msg)
+                err.lineno = lineno
+                err.index  = index
+                if not self.recover:
+                    raise err
+                self.errors.append(err)
+            if data is not None:
+                decls.extend(mcbin.loads(data).decl)
+
+        ast = TranslationUnit(decls)
+        if decls and decls[0].span is not None and decls[-1].span is not None:
+            ast.span = pack_span(node_span(decls[0])[0], node_span(decls[-1])[1])
+        return ast
+
+
+# ----------------------------------------------------------------------
+# Verificacion
+# ----------------------------------------------------------------------
+CHECKS = {
+'comentarios': '''
+/* uno */ int a;
+int b; /* dos; con { y } */
+int f(int x) { /* tres */ return x; }
+/* cuatro
+   en varias lineas */ int c;
+''',
+'cadenas': '''
+char *s;
+int g() { s = "}; /* no es comentario */"; return 0; }
+int d; // int e; }
+float h(float y) { return y * 2.0; }
+''',
+}
+
+
+def check(programs=CHECKS):
+    '''
+    Corta cada programa en un trozo por declaracion, une los arboles y
+    los compara (con sus span) con el de Parser sobre el texto completo.
+    Devuelve el numero de diferencias.
+    '''
+    from mclex import Lexer
+    from mcparse import Parser
+
+    failures = 0
+    for name, src in programs.items():
+        chunks = split(src, len(src))
+        try:
+            serial = Parser().parse(Lexer().tokenize(src))
+            ast    = ParallelParser().stitch(map(parse_chunk, chunks))
+            same   = ast == serial and all(a.span == b.span for a, b in zip(walk(ast), walk(serial)))
+        except SyntaxError as e:
+            print(f'  {name:20s} ERROR {e.lineno}: {e.msg}')
+            failures += 1
+            continue
+        if same:
+            print(f'  {name:20s} ok ({len(chunks)} trozos)')
+        else:
+            failures += 1
+            print(f'  {name:20s} DIFERENTE ({len(chunks)} trozos)')
+    return failures
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+def bench(nlines=40000, max_jobs=8):
+    '''
+    Mide ParallelParser con 1, 2, 4... procesos hasta el numero de CPUs.
+    Para mas procesos que CPUs da una estimacion: el trabajo de los
+    trozos medido en un solo proceso, dividido entre los procesos, mas
+    la decodificacion en el proceso principal, que no se reparte.
+    '''
+    import time
+    import mcbin
+    from concurrent.futures import ProcessPoolExecutor
+    from mclex import Lexer
+    from mcparse import Parser
+    from mccheck import generate
+
+    txt  = generate(nlines)
+    ncpu = os.cpu_count() or 1
+
+    t0 = time.perf_counter()
+    chunks = split(txt, 4 * max_jobs)
+    t1 = time.perf_counter()
+    print(f'{nlines} lineas ({len(txt)/2**20:.1f} MiB, {ncpu} CPUs)')
+    print(f'  pre-scan              {1e3*(t1-t0):7.1f} ms ({len(txt)/(t1-t0)/2**20:.0f} MiB/s, '
+          f'{len(chunks)} trozos)')
+
+    t0 = time.perf_counter()
+    serial = Parser().parse(Lexer().tokenize(txt))
+    t1 = time.perf_counter()
+    base = t1 - t0
+    print(f'  Parser                {base:7.3f} s')
+
+    t0 = time.perf_counter()
+    results = [ parse_chunk(c) for c in chunks ]
+    t1 = time.perf_counter()
+    for data, errors in results:
+        mcbin.loads(data)
+    t2 = time.perf_counter()
+    work, decode = t1 - t0, t2 - t1
+    print(f'  trozos en serie       {work:7.3f} s  + decodificar {decode:.3f} s')
+
+    jobs = 1
+    while jobs <= max(max_jobs, ncpu):
+        if jobs <= ncpu:
+            # El grupo se crea antes de medir: el costo de arrancar
+            # procesos se paga una vez por sesion, no por archivo
+            with ProcessPoolExecutor(jobs) as executor:
+                list(executor.map(parse_chunk, split('int x;', 1) * jobs))
+                parser = ParallelParser(jobs, executor=executor)
+                t0 = time.perf_counter()
+                ast = parser.parse(txt)
+                t1 = time.perf_counter()
+            same = ast == serial and all(a.span == b.span for a, b in zip(walk(ast), walk(serial)))
+            print(f'  ParallelParser({jobs:2d})    {t1-t0:7.3f} s  x{base/(t1-t0):.2f}  (igual: {same})')
+        else:
+            est = work / jobs + decode
+            print(f'  ParallelParser({jobs:2d})    {est:7.3f} s  x{base/est:.2f}  (estimado)')
+        jobs *= 2
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    if sys.argv[1:] == ['--check']:
+        exit(1 if check() else 0)
+
+    if len(sys.argv) in (2, 3) and sys.argv[1] == '--bench':
+        bench(*map(int, sys.argv[2:]))
+        exit(0)
+
+    if len(sys.argv) not in (2, 3):
+        print(f"usage: python {sys.argv[0]} fname [jobs] | --check | --bench [N]")
+        exit(1)
+
+    txt = open(sys.argv[1], encoding='utf-8').read()
+    parser = ParallelParser(*map(int, sys.argv[2:]), recover=True)
+    t0 = time.perf_counter()
+    ast = parser.parse(txt)
+    t1 = time.perf_counter()
+    for e in parser.errors:
+        print(f'{e.lineno}: {e.msg}')
+    print(f'{len(ast.decl)} declaraciones en {t1-t0:.3f} s ({parser.jobs} procesos)')
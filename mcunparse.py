@@ -0,0 +1,301 @@
+# mcunparse.py
+'''
+Unparser: escribe el texto MiniC canonico de cualquier arbol de mcast.
+
+    unparse(ast)            -> str
+    unparse(ast, file)      escribe en un objeto tipo archivo
+
+La salida no se construye como una sola cadena: el Unparser acumula
+fragmentos y los escribe en el archivo cada vez que superan chunk_size
+caracteres, asi que la memoria usada no depende del tamano del programa.
+
+Las expresiones llevan solo los parentesis necesarios segun la
+precedencia y asociatividad de la gramatica de mcparse:
+
+    nivel  1  =  +=  -=          (derecha)
+    nivel  2  ==  !=             (izquierda)
+    nivel  3  <  <=  >  >=       (izquierda)
+    nivel  4  +  -               (izquierda)
+    nivel  5  *  /  %            (izquierda)
+    nivel  6  - + ! * &          (unarios)
+    nivel  7  llamadas e indexacion
+    nivel  8  identificadores, literales
+
+Para todo arbol producido por el parser se cumple
+
+    parse(unparse(ast)) == ast
+'''
+from decimal import Decimal
+
+from mcast import *
+
+
+PRECEDENCE = {
+    '=' : 1, '+=': 1, '-=': 1,
+    '==': 2, '!=': 2,
+    '<' : 3, '<=': 3, '>' : 3, '>=': 3,
+    '+' : 4, '-' : 4,
+    '*' : 5, '/' : 5, '%' : 5,
+}
+
+UNARY   = 6
+POSTFIX = 7
+PRIMARY = 8
+
+
+def precedence(e):
+    if isinstance(e, Binary):
+        return PRECEDENCE[e.op]
+    if isinstance(e, Unary):
+        return UNARY
+    if isinstance(e, (Call, Index)):
+        return POSTFIX
+    return PRIMARY
+
+
+class Unparser(Visitor):
+
+    chunk_size = 1 << 16
+    indent_str = '    '
+
+    def __init__(self, file):
+        self.file   = file
+        self.buf    = []
+        self.size   = 0
+        self.indent = 0
+
+    @classmethod
+    def unparse(cls, n:Node, file):
+        u = cls(file)
+        n.accept(u)
+        u.flush()
+
+    # ------------------------------------------------------------------
+    # Salida
+    # ------------------------------------------------------------------
+    def write(self, text):
+        self.buf.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def line(self, text):
+        self.write(f'{self.indent_str * self.indent}{text}\n')
+
+    def flush(self):
+        if self.buf:
+            self.file.write(''.join(self.buf))
+            self.buf.clear()
+            self.size = 0
+
+    # ------------------------------------------------------------------
+    # Declaradores y bloques
+    # ------------------------------------------------------------------
+    def declarator(self, decl):
+        if isinstance(decl, Variable):
+            return decl.name
+        if decl[0] == '*':
+            return '*' + self.declarator(decl[1])
+        return f'{self.declarator(decl[0])}({self.params(decl[1])})'
+
+    def params(self, params):
+        params, variadic = param_list(params)
+        text = ', '.join(f'{type} {self.declarator(decl)}' for type, decl in params)
+        return text + ', ...' if variadic else text
+
+    def compound(self, stmt):
+        '''
+        Bloque compuesto como lo entrega el parser: None, lista de
+        declaraciones o (declaraciones, sentencias).
+        '''
+        self.write('{\n')
+        self.indent += 1
+        for item in block_items(stmt):
+            self.stmt(item)
+        self.indent -= 1
+        self.write(f'{self.indent_str * self.indent}}}')
+
+    def stmt(self, stmt):
+        if stmt is None or isinstance(stmt, (tuple, list)):
+            self.write(self.indent_str * self.indent)
+            self.compound(stmt)
+            self.write('\n')
+        else:
+            stmt.accept(self)
+
+    def body(self, stmt):
+        '''
+        Cuerpo de while/for: en la misma linea si es un bloque, en la
+        siguiente linea con sangria si es una sentencia simple.
+        '''
+        if stmt is None or isinstance(stmt, (tuple, list)):
+            self.write(' ')
+            self.compound(stmt)
+            self.write('\n')
+        else:
+            self.write('\n')
+            self.indent += 1
+            stmt.accept(self)
+            self.indent -= 1
+
+    # ------------------------------------------------------------------
+    # Declaraciones
+    # ------------------------------------------------------------------
+    def visit(self, node:TranslationUnit):
+        for i, decl in enumerate(node.decl):
+            if i and (isinstance(decl, FuncDefinition) or isinstance(node.decl[i-1], FuncDefinition)):
+                self.write('\n')
+            decl.accept(self)
+
+    def visit(self, node:VarDefinition):
+        extern = 'extern ' if node.extern else ''
+        self.line(f'{extern}{node.type} {self.declarator(node.expr)};')
+
+    def visit(self, node:FuncDefinition):
+        static = 'static ' if node.static else ''
+        type   = node.type.rstrip('*')
+        stars  = node.type[len(type):]
+        self.write(f'{static}{type} {stars}{node.name.name}({self.params(node.params)}) ')
+        self.compound(node.stmts)
+        self.write('\n')
+
+    # ------------------------------------------------------------------
+    # Sentencias
+    # ------------------------------------------------------------------
+    def visit(self, node:ExprStmt):
+        self.line(f'{self.expr(node.expr)};')
+
+    def visit(self, node:Return):
+        if node.expr is None:
+            self.line('return;')
+        else:
+            self.line(f'return {self.expr(node.expr)};')
+
+    def visit(self, node:Break):
+        self.line('break;')
+
+    def visit(self, node:Continue):
+        self.line('continue;')
+
+    def visit(self, node:WhileLoop):
+        self.write(f'{self.indent_str * self.indent}while ({self.expr(node.expr)})')
+        self.body(node.stmt)
+
+    def visit(self, node:ForLoop):
+        self.write(f'{self.indent_str * self.indent}for ({self.expr(node.begin.expr)}; '
+                   f'{self.expr(node.expr.expr)}; {self.expr(node.end)})')
+        self.body(node.stmt)
+
+    def visit(self, node:IfStmt):
+        # La gramatica exige llaves con una sola sentencia en cada rama
+        pad = self.indent_str * self.indent
+        self.write(f'{pad}if ({self.expr(node.cond)}) {{\n')
+        self.indent += 1
+        self.stmt(node.cons)
+        self.indent -= 1
+        if node.altr is not None:
+            self.write(f'{pad}}} else {{\n')
+            self.indent += 1
+            self.stmt(node.altr)
+            self.indent -= 1
+        self.write(f'{pad}}}\n')
+
+    # ------------------------------------------------------------------
+    # Expresiones (devuelven texto)
+    # ------------------------------------------------------------------
+    def expr(self, e, level=1):
+        text = e.accept(self)
+        return f'({text})' if precedence(e) < level else text
+
+    def visit(self, node:Binary):
+        prec = PRECEDENCE[node.op]
+        if prec == 1:
+            # Asignacion: asociativa a la derecha y el lado izquierdo es
+            # una equality_expression
+            return f'{self.expr(node.left, 2)} {node.op} {self.expr(node.right, 1)}'
+        return f'{self.expr(node.left, prec)} {node.op} {self.expr(node.right, prec + 1)}'
+
+    def visit(self, node:Unary):
+        text = self.expr(node.expr, UNARY)
+        if node.op in ('-', '+', '&') and text.startswith(node.op):
+            # '--a' se leeria como predecremento y '&&a' como un y logico
+            return node.op + ' ' + text
+        return node.op + text
+
+    def visit(self, node:Call):
+        args = ', '.join(self.expr(arg) for arg in node.args)
+        return f'{self.expr(node.func, POSTFIX)}({args})'
+
+    def visit(self, node:Index):
+        return f'{self.expr(node.expr, POSTFIX)}[{self.expr(node.index)}]'
+
+    def visit(self, node:Variable):
+        return node.name
+
+    def visit(self, node:Literal):
+        value = node.value
+        if isinstance(value, float):
+            # Sin exponente: el lexer solo reconoce 1.5, .5 y 1.
+            text = format(Decimal(repr(value)), 'f')
+            return text if '.' in text else text + '.0'
+        return str(value)
+
+
+def unparse(node:Node, file=None):
+    '''
+    Escribe el texto MiniC de node en file.  Sin file, devuelve una cadena.
+    '''
+    if file is not None:
+        Unparser.unparse(node, file)
+        return None
+    import io
+    out = io.StringIO()
+    Unparser.unparse(node, out)
+    return out.getvalue()
+
+
+# ----------------------------------------------------------------------
+# Benchmark
+# ----------------------------------------------------------------------
+def bench(nlines=20000):
+    import io
+    import os
+    import time
+    from mclex import Lexer
+    from mcparse import Parser
+    from mccheck import generate
+
+    txt = generate(nlines)
+    t0 = time.perf_counter()
+    ast = Parser().parse(Lexer().tokenize(txt))
+    t1 = time.perf_counter()
+    with open(os.devnull, 'w') as f:
+        unparse(ast, f)
+    t2 = time.perf_counter()
+    out = unparse(ast)
+    ok = Parser().parse(Lexer().tokenize(out)) == ast
+
+    nbytes = len(out)
+    print(f'{nlines} lineas ({nbytes/2**20:.1f} MiB de salida)')
+    print(f'  parse   {t1-t0:7.3f} s  {len(txt)/(t1-t0)/2**20:7.2f} MiB/s')
+    print(f'  unparse {t2-t1:7.3f} s  {nbytes/(t2-t1)/2**20:7.2f} MiB/s')
+    print(f'  parse(unparse(ast)) == ast: {ok}')
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) == 2 and sys.argv[1] == '--bench':
+        bench()
+        exit(0)
+
+    if len(sys.argv) != 2:
+        print(f"usage: python {sys.argv[0]} fname | --bench")
+        exit(1)
+
+    from mclex import Lexer
+    from mcparse import Parser
+
+    txt = open(sys.argv[1], encoding='utf-8').read()
+    ast = Parser().parse(Lexer().tokenize(txt))
+    unparse(ast, sys.stdout)
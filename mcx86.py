@@ -0,0 +1,1702 @@
+# mcx86.py
+'''
+Generacion de codigo x86-64 (System V, sintaxis AT&T) para MiniC.
+
+Cada FuncDefinition pasa por tres etapas:
+
+    1. Lowering: el AST ya verificado se traduce a una lista lineal de
+       instrucciones (Ins) sobre registros virtuales.  Las locales y
+       parametros viven en registros virtuales, salvo las que aparecen
+       en '&x', que reciben un lugar en el marco.  Las constantes
+       enteras se quedan como operandos inmediatos (Imm).
+
+    2. Asignacion de registros por barrido lineal (linear scan): con la
+       vivacidad de cada registro virtual se calcula su intervalo
+       [inicio, fin] sobre la lista.  Los intervalos se recorren por
+       inicio; un intervalo que cruza una llamada solo puede ir a un
+       registro que la llamada preserva (rbx, r12-r15); los flotantes
+       que cruzan una llamada van a la pila (System V no preserva
+       ningun xmm).  Si no hay registro libre se derrama el intervalo
+       activo que termina mas tarde.
+
+    3. Emision y peephole: cada Ins se convierte en instrucciones de
+       ensamblador; despues se eliminan movimientos redundantes,
+       saltos a la siguiente instruccion, codigo inalcanzable, y
+       recargas de un valor recien guardado.
+
+Registros reservados como temporales de la emision: rax, rcx, rdx, r11,
+xmm0 y xmm1.  rbp es el apuntador de marco.
+
+Los tipos siguen a mcmem/mcinterp: int de 32 bits, char de 8 bits con
+signo, float como double y apuntadores de 64 bits, asi que un programa
+produce la misma salida compilado e interpretado.
+
+    python mcx86.py fname.c [-o exe] [-S]   compila (o muestra el .s)
+                    [--keep]                deja el .s y el .o junto al ejecutable
+    python mcx86.py --check [fname.c ...]   compara con el interprete
+    python mcx86.py --bench                 tiempos nativo / interprete
+'''
+import os
+import struct
+import subprocess
+import sys
+
+from mcast import *
+from mcmem import sizeof
+
+
+# ----------------------------------------------------------------------
+# Representacion intermedia
+# ----------------------------------------------------------------------
+class Imm:
+    '''
+    Operando inmediato (constante entera).
+    '''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f'${self.value}'
+
+
+class Ins:
+    '''
+    Una instruccion: op, registros virtuales definidos (dst), operandos
+    (src: registros virtuales o Imm) y un argumento propio de cada op.
+
+        const   dst <- Imm                  fconst  dst <- etiqueta .rodata
+        addr    dst <- &etiqueta            slotaddr dst <- &marco[n]
+        loadg   dst <- global (arg=nombre, tipo)
+        storeg  global <- src
+        loads   dst <- marco[n]             stores  marco[n] <- src
+        load    dst <- *src0 (arg=tipo)     store   *src0 <- src1
+        mov     dst <- src0                 cvt     dst <- src0 (arg=de, a)
+        bin     dst <- src0 op src1         cmp     dst <- src0 op src1
+        neg     dst <- -src0                not     dst <- !src0
+        index   dst <- src0 + src1 * escala
+        pdiff   dst <- (src0 - src1) / tamano
+        jmp     etiqueta                    label   etiqueta
+        jz      si src0 == 0 salta          cjump   si no (src0 op src1) salta
+        call    dst <- f(src...)            ret     src0 (opcional)
+        params  dst... <- argumentos de entrada
+    '''
+    __slots__ = ('op', 'dst', 'src', 'arg')
+
+    def __init__(self, op, dst=(), src=(), arg=None):
+        self.op  = op
+        self.dst = list(dst)
+        self.src = list(src)
+        self.arg = arg
+
+    def uses(self):
+        return [ s for s in self.src if not isinstance(s, Imm) ]
+
+    def __repr__(self):
+        return f'{self.op} {self.dst} {self.src} {self.arg!r}'
+
+
+def kind(type):
+    '''
+    Clase de registro de un tipo: 'f' (xmm), 'p' (64 bits) o 'i' (32 bits).
+    '''
+    if type == 'float':
+        return 'f'
+    if type.endswith('*'):
+        return 'p'
+    return 'i'
+
+
+def wrap32(v):
+    return ((v + 0x80000000) & 0xffffffff) - 0x80000000
+
+
+def wrap8(v):
+    return ((v + 0x80) & 0xff) - 0x80
+
+
+class Module:
+    '''
+    Lo que comparten las funciones de un archivo: literales de cadena y
+    flotantes en .rodata, variables globales y funciones definidas.
+    '''
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self.strings = {}           # literal -> etiqueta
+        self.floats  = {}           # bits -> etiqueta
+        self.globals = {}           # nombre -> tamano
+        self.defined = set()        # funciones definidas en el archivo
+
+    def string(self, literal):
+        label = self.strings.get(literal)
+        if label is None:
+            label = self.strings[literal] = f'.LS{len(self.strings)}'
+        return label
+
+    def float(self, value):
+        bits = struct.unpack('<q', struct.pack('<d', value))[0]
+        label = self.floats.get(bits)
+        if label is None:
+            label = self.floats[bits] = f'.LF{len(self.floats)}'
+        return label
+
+
+class Lowering(Visitor):
+    '''
+    Traduce una FuncDefinition a una lista de Ins.
+    '''
+    def __init__(self, module, func:FuncDefinition):
+        self.module  = module
+        self.symbols = module.symbols
+        self.ir      = []
+        self.kinds   = []           # registro virtual -> 'i', 'p' o 'f'
+        self.vars    = {}           # sym -> registro virtual o ('slot', n)
+        self.nslots  = 0
+        self.labels  = 0
+        self.loops   = []           # (continuar, salir)
+        self.rettype = self.symbols[func.name.sym].type
+        self.name    = func.name.name
+
+        # Las variables cuya direccion se toma viven en el marco
+        self.addressed = { n.expr.sym for n in walk(func)
+                           if isinstance(n, Unary) and n.op == '&' and isinstance(n.expr, Variable) }
+
+    @classmethod
+    def lower(cls, module, func):
+        low = cls(module, func)
+        low.function(func)
+        return low
+
+    def vreg(self, k):
+        self.kinds.append(k)
+        return len(self.kinds) - 1
+
+    def label(self):
+        self.labels += 1
+        return f'.L{self.name}_{self.labels}'
+
+    def emit(self, op, dst=(), src=(), arg=None):
+        self.ir.append(Ins(op, dst, src, arg))
+
+    def local(self, sym, type):
+        if sym in self.addressed:
+            self.vars[sym] = ('slot', self.nslots)
+            self.nslots += 1
+        else:
+            self.vars[sym] = self.vreg(kind(type))
+
+    # ------------------------------------------------------------------
+    # Declaraciones y sentencias
+    # ------------------------------------------------------------------
+    def function(self, func):
+        sym = self.symbols[func.name.sym]
+        incoming = []
+        for (type, decl), ptype in zip(param_list(func.params)[0], sym.params):
+            decl = pointer_type(type, decl)[1]
+            v = self.vreg(kind(ptype))
+            incoming.append(v)
+            self.local(decl.sym, ptype)
+        self.emit('params', incoming)
+        for (type, decl), v in zip(param_list(func.params)[0], incoming):
+            self.assign_var(pointer_type(type, decl)[1].sym, v)
+        self.stmt(func.stmts)
+        if not self.ir or self.ir[-1].op != 'ret':
+            self.emit('ret', (), [ Imm(0) ] if self.rettype != 'void' else [])
+
+    def stmt(self, stmt):
+        if stmt is None or isinstance(stmt, (tuple, list)):
+            for s in block_items(stmt):
+                self.stmt(s)
+        else:
+            stmt.accept(self)
+
+    def visit(self, node:VarDefinition):
+        type, decl = pointer_type(node.type, node.expr)
+        if not isinstance(decl, tuple):
+            self.local(decl.sym, type)
+            # Como en el interprete, las locales empiezan en 0
+            self.assign_var(decl.sym, self.convert(Imm(0), 'int', type))
+
+    def visit(self, node:ExprStmt):
+        node.expr.accept(self)
+
+    def visit(self, node:WhileLoop):
+        top, end = self.label(), self.label()
+        self.emit('label', arg=top)
+        self.branch_false(node.expr, end)
+        self.loops.append((top, end))
+        self.stmt(node.stmt)
+        self.loops.pop()
+        self.emit('jmp', arg=top)
+        self.emit('label', arg=end)
+
+    def visit(self, node:ForLoop):
+        top, cont, end = self.label(), self.label(), self.label()
+        node.begin.expr.accept(self)
+        self.emit('label', arg=top)
+        self.branch_false(node.expr.expr, end)
+        self.loops.append((cont, end))
+        self.stmt(node.stmt)
+        self.loops.pop()
+        self.emit('label', arg=cont)
+        node.end.accept(self)
+        self.emit('jmp', arg=top)
+        self.emit('label', arg=end)
+
+    def visit(self, node:IfStmt):
+        altr, end = self.label(), self.label()
+        self.branch_false(node.cond, altr)
+        self.stmt(node.cons)
+        if node.altr is not None:
+            self.emit('jmp', arg=end)
+        self.emit('label', arg=altr)
+        if node.altr is not None:
+            self.stmt(node.altr)
+            self.emit('label', arg=end)
+
+    def visit(self, node:Return):
+        if node.expr is None:
+            self.emit('ret')
+            return
+        type, v = node.expr.accept(self)
+        self.emit('ret', (), [ self.convert(v, type, self.rettype) ])
+
+    def visit(self, node:Break):
+        self.emit('jmp', arg=self.loops[-1][1])
+
+    def visit(self, node:Continue):
+        self.emit('jmp', arg=self.loops[-1][0])
+
+    def branch_false(self, cond, label):
+        if isinstance(cond, Binary) and cond.op in ('<', '<=', '>', '>=', '==', '!='):
+            a, b = self.operands(cond)
+            self.emit('cjump', (), [ a, b ], (cond.op, label))
+            return
+        type, v = cond.accept(self)
+        self.emit('jz', (), [ self.materialize(v, kind(type)) ], label)
+
+    # ------------------------------------------------------------------
+    # Expresiones (devuelven (tipo, registro virtual o Imm))
+    # ------------------------------------------------------------------
+    def materialize(self, v, k='i'):
+        if isinstance(v, Imm):
+            d = self.vreg(k)
+            self.emit('const', [ d ], [ v ])
+            return d
+        return v
+
+    def convert(self, v, src, dst):
+        ks, kd = kind(src), kind(dst)
+        if isinstance(v, Imm):
+            if kd == 'f':
+                return self.float_const(float(v.value))
+            if dst == 'char':
+                return Imm(wrap8(v.value))
+            return v
+        if kd == 'f':
+            if ks == 'f':
+                return v
+            d = self.vreg('f')
+            self.emit('cvt', [ d ], [ v ], ('i', 'f'))
+            return d
+        if ks == 'f':
+            d = self.vreg('i')
+            self.emit('cvt', [ d ], [ v ], ('f', 'i'))
+            v, src = d, 'int'
+        if dst == 'char' and src != 'char':
+            d = self.vreg('i')
+            self.emit('cvt', [ d ], [ v ], ('i', 'c'))
+            return d
+        if kd == 'p' and ks == 'i':
+            d = self.vreg('p')
+            self.emit('cvt', [ d ], [ v ], ('i', 'p'))
+            return d
+        return v
+
+    def float_const(self, value):
+        d = self.vreg('f')
+        self.emit('fconst', [ d ], (), self.module.float(value))
+        return d
+
+    def visit(self, node:Literal):
+        value = node.value
+        if isinstance(value, int):
+            return 'int', Imm(value)
+        if isinstance(value, float):
+            return 'float', self.float_const(value)
+        if value.startswith("'"):
+            return 'char', Imm(ord(value[1]))
+        d = self.vreg('p')
+        self.emit('addr', [ d ], (), self.module.string(value))
+        return 'char*', d
+
+    def visit(self, node:Variable):
+        sym  = self.symbols[node.sym]
+        type = sym.type
+        var  = self.vars.get(node.sym)
+        if isinstance(var, int):
+            return type, var
+        d = self.vreg(kind(type))
+        if var is None:
+            self.emit('loadg', [ d ], (), (sym.name, type))
+        else:
+            self.emit('loads', [ d ], (), (var[1], type))
+        return type, d
+
+    def address(self, node):
+        '''
+        (tipo, direccion) de una ubicacion en memoria.  La direccion es un
+        registro virtual, o (base, indice, escala) para a[i], que se
+        resuelve en el modo de direccionamiento de la instruccion.
+        '''
+        if isinstance(node, Variable):
+            sym = self.symbols[node.sym]
+            var = self.vars.get(node.sym)
+            d = self.vreg('p')
+            if var is None:
+                self.emit('addr', [ d ], (), sym.name)
+            else:
+                self.emit('slotaddr', [ d ], (), var[1])
+            return sym.type, d
+        if isinstance(node, Index):
+            ptype, base = node.expr.accept(self)
+            _, index = node.index.accept(self)
+            return ptype[:-1], (base, index, sizeof(ptype[:-1]))
+        ptype, ptr = node.expr.accept(self)         # Unary '*'
+        return ptype[:-1], ptr
+
+    def load(self, addr, type):
+        d = self.vreg(kind(type))
+        if isinstance(addr, tuple):
+            self.emit('loadx', [ d ], addr[:2], (type, addr[2]))
+        else:
+            self.emit('load', [ d ], [ addr ], type)
+        return d
+
+    def store(self, addr, v, type):
+        if isinstance(addr, tuple):
+            self.emit('storex', (), [ *addr[:2], v ], (type, addr[2]))
+        else:
+            self.emit('store', (), [ addr, v ], type)
+
+    def visit(self, node:Index):
+        type, addr = self.address(node)
+        return type, self.load(addr, type)
+
+    def visit(self, node:Unary):
+        op = node.op
+        if op == '*':
+            type, addr = self.address(node)
+            return type, self.load(addr, type)
+        if op == '&':
+            type, addr = self.address(node.expr)
+            if isinstance(addr, tuple):
+                d = self.vreg('p')
+                self.emit('index', [ d ], addr[:2], addr[2])
+                addr = d
+            return type + '*', addr
+        type, v = node.expr.accept(self)
+        if type == 'char':
+            type = 'int'
+        if op == '+':
+            return type, v
+        if op == '!':
+            if isinstance(v, Imm):
+                return 'int', Imm(0 if v.value else 1)
+            d = self.vreg('i')
+            self.emit('not', [ d ], [ v ])
+            return 'int', d
+        if isinstance(v, Imm):
+            return type, Imm(wrap32(-v.value))
+        d = self.vreg(kind(type))
+        self.emit('neg', [ d ], [ v ])
+        return type, d
+
+    def operands(self, node):
+        '''
+        Operandos de una comparacion, llevados a un tipo comun.
+        '''
+        ltype, a = node.left.accept(self)
+        rtype, b = node.right.accept(self)
+        if 'float' in (ltype, rtype):
+            a = self.convert(a, ltype, 'float')
+            b = self.convert(b, rtype, 'float')
+        elif kind(ltype) == 'p' or kind(rtype) == 'p':
+            a = self.materialize(a, 'p')
+        else:
+            a = self.materialize(a, 'i')
+        return a, b
+
+    def visit(self, node:Binary):
+        op = node.op
+        if op in ('=', '+=', '-='):
+            return self.assign(node)
+        if op in ('<', '<=', '>', '>=', '==', '!='):
+            a, b = self.operands(node)
+            d = self.vreg('i')
+            self.emit('cmp', [ d ], [ a, b ], op)
+            return 'int', d
+
+        ltype, a = node.left.accept(self)
+        rtype, b = node.right.accept(self)
+        return self.arith(op, ltype, a, rtype, b)
+
+    def arith(self, op, ltype, a, rtype, b):
+        lk, rk = kind(ltype), kind(rtype)
+        if lk == 'p' and rk == 'p':
+            d = self.vreg('i')
+            self.emit('pdiff', [ d ], [ a, b ], sizeof(ltype[:-1]))
+            return 'int', d
+        if lk == 'p' or rk == 'p':
+            if rk == 'p':
+                ltype, a, rtype, b = rtype, b, ltype, a
+            size = sizeof(ltype[:-1])
+            d = self.vreg('p')
+            self.emit('index', [ d ], [ a, b ], size if op == '+' else -size)
+            return ltype, d
+        if 'f' in (lk, rk):
+            a = self.convert(a, ltype, 'float')
+            b = self.convert(b, rtype, 'float')
+            d = self.vreg('f')
+            self.emit('bin', [ d ], [ a, b ], op)
+            return 'float', d
+        if isinstance(a, Imm) and isinstance(b, Imm) and op in ('+', '-', '*'):
+            x, y = a.value, b.value
+            return 'int', Imm(wrap32(x + y if op == '+' else x - y if op == '-' else x * y))
+        d = self.vreg('i')
+        self.emit('bin', [ d ], [ self.materialize(a) if op in ('/', '%') else a, b ], op)
+        return 'int', d
+
+    def assign_var(self, sym, v):
+        var = self.vars[sym]
+        if isinstance(var, int):
+            self.emit('mov', [ var ], [ v ])
+        else:
+            self.emit('stores', (), [ v ], (var[1], self.symbols[sym].type))
+
+    def assign(self, node:Binary):
+        target = node.left
+        rtype, v = node.right.accept(self)
+
+        if isinstance(target, Variable):
+            sym  = self.symbols[target.sym]
+            type = sym.type
+            var  = self.vars.get(target.sym)
+            if node.op != '=':
+                _, cur = target.accept(self)
+                rtype, v = self.arith(node.op[0], type, cur, rtype, v)
+            v = self.convert(v, rtype, sym.type)
+            if isinstance(var, int):
+                last = self.ir[-1] if self.ir else None
+                if last is not None and last.dst == [ v ] and last.op != 'params' \
+                   and v not in self.vars.values():
+                    # El temporal recien calculado se escribe directo en la variable
+                    last.dst = [ var ]
+                else:
+                    self.emit('mov', [ var ], [ v ])
+                return sym.type, var
+            if var is None:
+                self.emit('storeg', (), [ v ], (sym.name, sym.type))
+            else:
+                self.emit('stores', (), [ v ], (var[1], sym.type))
+            return sym.type, v
+
+        type, addr = self.address(target)
+        if node.op != '=':
+            cur = self.load(addr, type)
+            rtype, v = self.arith(node.op[0], type, cur, rtype, v)
+        v = self.convert(v, rtype, type)
+        self.store(addr, v, type)
+        return type, v
+
+    def visit(self, node:Call):
+        sym  = self.symbols[node.func.sym]
+        args = []
+        for i, arg in enumerate(node.args):
+            type, v = arg.accept(self)
+            if i < len(sym.params):
+                v = self.convert(v, type, sym.params[i])
+                type = sym.params[i]
+            elif type == 'char':
+                type = 'int'
+            args.append((v, kind(type)))
+        d = self.vreg(kind(sym.type)) if sym.type != 'void' else None
+        self.emit('call', [ d ] if d is not None else [], [ v for v, _ in args ],
+                  (sym.name, [ k for _, k in args ], sym.variadic, sym.name not in self.module.defined))
+        return sym.type, d if d is not None else Imm(0)
+
+
+# ----------------------------------------------------------------------
+# Vivacidad y asignacion de registros
+# ----------------------------------------------------------------------
+CALLER_SAVED = [ 'rsi', 'rdi', 'r8', 'r9', 'r10' ]
+CALLEE_SAVED = [ 'rbx', 'r12', 'r13', 'r14', 'r15' ]
+XMM          = [ f'xmm{i}' for i in range(2, 16) ]
+
+JUMPS = ('jmp', 'jz', 'cjump', 'ret')
+
+
+def blocks(ir):
+    '''
+    Bloques basicos: [(inicio, fin, sucesores)].
+    '''
+    starts = { 0 }
+    for i, ins in enumerate(ir):
+        if ins.op == 'label':
+            starts.add(i)
+        elif ins.op in JUMPS:
+            starts.add(i + 1)
+    starts = sorted(s for s in starts if s < len(ir))
+    where  = { ins.arg: n for n, s in enumerate(starts) for ins in ir[s:s+1] if ins.op == 'label' }
+    result = []
+    for n, start in enumerate(starts):
+        end  = starts[n + 1] if n + 1 < len(starts) else len(ir)
+        last = ir[end - 1]
+        succ = []
+        if last.op == 'jmp':
+            succ.append(where[last.arg])
+        elif last.op in ('jz', 'cjump'):
+            target = last.arg if last.op == 'jz' else last.arg[1]
+            succ.append(where[target])
+            if n + 1 < len(starts):
+                succ.append(n + 1)
+        elif last.op != 'ret' and n + 1 < len(starts):
+            succ.append(n + 1)
+        result.append((start, end, succ))
+    return result
+
+
+def intervals(ir, nregs):
+    '''
+    Intervalo [inicio, fin] de cada registro virtual y el conjunto de
+    los que estan vivos despues de alguna llamada (sin ser su resultado).
+    '''
+    bbs = blocks(ir)
+    gen, kill = [], []
+    for start, end, _ in bbs:
+        g, k = set(), set()
+        for ins in ir[start:end]:
+            g |= set(ins.uses()) - k
+            k |= set(ins.dst)
+        gen.append(g)
+        kill.append(k)
+
+    live_in  = [ set() for _ in bbs ]
+    live_out = [ set() for _ in bbs ]
+    changed = True
+    while changed:
+        changed = False
+        for n in reversed(range(len(bbs))):
+            out = set()
+            for s in bbs[n][2]:
+                out |= live_in[s]
+            inn = gen[n] | (out - kill[n])
+            if out != live_out[n] or inn != live_in[n]:
+                live_out[n], live_in[n] = out, inn
+                changed = True
+
+    start = [ None ] * nregs
+    end   = [ None ] * nregs
+    crosses = set()
+
+    def extend(v, pos):
+        if start[v] is None or pos < start[v]:
+            start[v] = pos
+        if end[v] is None or pos > end[v]:
+            end[v] = pos
+
+    for n, (b0, b1, _) in enumerate(bbs):
+        live = set(live_out[n])
+        for pos in reversed(range(b0, b1)):
+            ins = ir[pos]
+            for v in live:
+                extend(v, pos)
+            if ins.op == 'call':
+                crosses |= live - set(ins.dst)
+            live -= set(ins.dst)
+            live |= set(ins.uses())
+            for v in ins.dst:
+                extend(v, pos)
+            for v in ins.uses():
+                extend(v, pos)
+    return start, end, crosses
+
+
+def linear_scan(ir, kinds, nslots):
+    '''
+    Devuelve (ubicacion de cada registro virtual, numero de lugares en el
+    marco).  La ubicacion es el nombre de un registro o ('slot', n).
+    '''
+    start, end, crosses = intervals(ir, len(kinds))
+    loc    = [ None ] * len(kinds)
+    free   = { 'caller': list(CALLER_SAVED), 'callee': list(CALLEE_SAVED), 'xmm': list(XMM) }
+    pool   = { r: 'caller' for r in CALLER_SAVED }
+    pool.update({ r: 'callee' for r in CALLEE_SAVED })
+    pool.update({ r: 'xmm' for r in XMM })
+    active = []                     # registros virtuales con registro fisico
+
+    def spill(v):
+        nonlocal nslots
+        loc[v] = ('slot', nslots)
+        nslots += 1
+
+    order = sorted((v for v in range(len(kinds)) if start[v] is not None), key=lambda v: start[v])
+    for v in order:
+        for a in [ a for a in active if end[a] < start[v] ]:
+            active.remove(a)
+            free[pool[loc[a]]].append(loc[a])
+
+        cross = v in crosses
+        if kinds[v] == 'f':
+            if cross:
+                spill(v)
+                continue
+            pools = [ 'xmm' ]
+        elif cross:
+            pools = [ 'callee' ]
+        else:
+            pools = [ 'caller', 'callee' ]
+
+        reg = next((free[p].pop(0) for p in pools if free[p]), None)
+        if reg is None:
+            # Sin registro libre: se derrama el que termina mas tarde
+            candidates = [ a for a in active if pool[loc[a]] in pools ]
+            victim = max(candidates, key=lambda a: end[a], default=None)
+            if victim is None or end[victim] <= end[v]:
+                spill(v)
+                continue
+            reg = loc[victim]
+            active.remove(victim)
+            spill(victim)
+        loc[v] = reg
+        active.append(v)
+    return loc, nslots
+
+
+# ----------------------------------------------------------------------
+# Emision
+# ----------------------------------------------------------------------
+R32 = { 'rax': 'eax', 'rbx': 'ebx', 'rcx': 'ecx', 'rdx': 'edx', 'rsi': 'esi', 'rdi': 'edi',
+        **{ f'r{i}': f'r{i}d' for i in range(8, 16) } }
+R8  = { 'rax': 'al', 'rbx': 'bl', 'rcx': 'cl', 'rdx': 'dl', 'rsi': 'sil', 'rdi': 'dil',
+        **{ f'r{i}': f'r{i}b' for i in range(8, 16) } }
+
+ARG_GP  = [ 'rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9' ]
+ARG_XMM = [ f'xmm{i}' for i in range(8) ]
+
+SETCC  = { '<': 'l', '<=': 'le', '>': 'g', '>=': 'ge', '==': 'e', '!=': 'ne' }
+FSETCC = { '<': 'b', '<=': 'be', '>': 'a', '>=': 'ae', '==': 'e', '!=': 'ne' }
+NEGATE = { 'l': 'ge', 'le': 'g', 'g': 'le', 'ge': 'l', 'e': 'ne', 'ne': 'e',
+           'b': 'ae', 'be': 'a', 'a': 'be', 'ae': 'b' }
+BINOP  = { '+': 'add', '-': 'sub', '*': 'imul' }
+FBINOP = { '+': 'addsd', '-': 'subsd', '*': 'mulsd', '/': 'divsd' }
+
+
+class Emitter:
+    '''
+    Convierte la lista de Ins de una funcion, con sus registros ya
+    asignados, en lineas de ensamblador.
+    '''
+    def __init__(self, low:Lowering, loc, nslots):
+        self.low    = low
+        self.kinds  = low.kinds
+        self.loc    = loc
+        self.saved  = [ r for r in CALLEE_SAVED if r in loc ]
+        self.nslots = nslots
+        self.lines  = []
+        self.exit   = f'.L{low.name}_ret'
+
+    def out(self, text):
+        self.lines.append('\t' + text)
+
+    def slot(self, n):
+        return f'{-8 * (len(self.saved) + n + 1)}(%rbp)'
+
+    # Operandos ---------------------------------------------------------
+    def where(self, v):
+        loc = self.loc[v]
+        return self.slot(loc[1]) if isinstance(loc, tuple) else loc
+
+    def reg(self, v):
+        '''
+        Registro fisico de v, o None si esta en la pila.
+        '''
+        if isinstance(v, Imm):
+            return None
+        loc = self.loc[v]
+        return None if isinstance(loc, tuple) else loc
+
+    def op(self, v, size=32):
+        if isinstance(v, Imm):
+            return f'${v.value}'
+        loc = self.loc[v]
+        if isinstance(loc, tuple):
+            return self.slot(loc[1])
+        if loc.startswith('xmm') or size == 64:
+            return '%' + loc
+        if size == 8:
+            return '%' + R8[loc]
+        return '%' + R32[loc]
+
+    def width(self, v):
+        return 64 if not isinstance(v, Imm) and self.kinds[v] == 'p' else 32
+
+    def suffix(self, v):
+        return 'q' if self.width(v) == 64 else 'l'
+
+    def into(self, v, scratch):
+        '''
+        Nombre de 64 bits de un registro que contiene v (lo carga en
+        scratch si v esta en la pila o es inmediato).
+        '''
+        reg = self.reg(v)
+        if reg is not None:
+            return reg
+        if isinstance(v, Imm):
+            self.out(f'movl ${v.value}, %{R32[scratch]}')
+        elif self.kinds[v] == 'f':
+            self.out(f'movsd {self.op(v)}, %{scratch}')
+        elif self.kinds[v] == 'p':
+            self.out(f'movq {self.op(v)}, %{scratch}')
+        else:
+            self.out(f'movl {self.op(v)}, %{R32[scratch]}')
+        return scratch
+
+    def r(self, reg, k):
+        if reg.startswith('xmm') or k == 'p':
+            return '%' + reg
+        return '%' + R32[reg]
+
+    def move(self, dst, src):
+        k = self.kinds[dst]
+        if k == 'f':
+            if self.reg(dst) is None and self.reg(src) is None:
+                self.out(f'movsd {self.op(src)}, %xmm0')
+                self.out(f'movsd %xmm0, {self.op(dst)}')
+            else:
+                self.out(f'movsd {self.op(src)}, {self.op(dst)}')
+            return
+        size = 64 if k == 'p' else 32
+        s = 'q' if k == 'p' else 'l'
+        if self.reg(dst) is None and self.reg(src) is None and not isinstance(src, Imm):
+            self.out(f'mov{s} {self.op(src, size)}, {self.r("r11", k)}')
+            self.out(f'mov{s} {self.r("r11", k)}, {self.op(dst, size)}')
+        else:
+            self.out(f'mov{s} {self.op(src, size)}, {self.op(dst, size)}')
+
+    def result(self, dst, reg):
+        '''
+        Guarda en dst el valor calculado en el registro reg.
+        '''
+        if self.reg(dst) != reg:
+            k = self.kinds[dst]
+            if k == 'f':
+                self.out(f'movsd %{reg}, {self.op(dst)}')
+            else:
+                s = 'q' if k == 'p' else 'l'
+                self.out(f'mov{s} {self.r(reg, k)}, {self.op(dst, 64 if k == "p" else 32)}')
+
+    # Funcion -----------------------------------------------------------
+    def function(self, static):
+        name = self.low.name
+        head = []
+        if not static:
+            head.append(f'\t.globl {name}')
+        head.append(f'\t.type {name}, @function')
+        head.append(f'{name}:')
+        head.append('\tpushq %rbp')
+        head.append('\tmovq %rsp, %rbp')
+        for r in self.saved:
+            head.append(f'\tpushq %{r}')
+        frame = 8 * self.nslots
+        if (frame + 8 * len(self.saved)) % 16:
+            frame += 8
+        if frame:
+            head.append(f'\tsubq ${frame}, %rsp')
+
+        for ins in self.low.ir:
+            getattr(self, 'emit_' + ins.op)(ins)
+
+        self.lines.append(f'{self.exit}:')
+        if self.saved:
+            self.out(f'leaq {-8 * len(self.saved)}(%rbp), %rsp')
+        elif frame:
+            self.out('movq %rbp, %rsp')
+        for r in reversed(self.saved):
+            self.out(f'popq %{r}')
+        self.out('popq %rbp')
+        self.out('ret')
+        self.lines.append(f'\t.size {name}, .-{name}')
+        return head + self.lines
+
+    # Instrucciones -----------------------------------------------------
+    def classify(self, kinds):
+        '''
+        Registro de cada argumento segun System V, o None si va en la pila.
+        '''
+        regs, ngp, nxmm = [], 0, 0
+        for k in kinds:
+            if k == 'f':
+                regs.append(ARG_XMM[nxmm] if nxmm < len(ARG_XMM) else None)
+                nxmm += 1
+            else:
+                regs.append(ARG_GP[ngp] if ngp < len(ARG_GP) else None)
+                ngp += 1
+        return regs, min(nxmm, len(ARG_XMM))
+
+    def emit_params(self, ins):
+        regs, _ = self.classify([ self.kinds[v] for v in ins.dst ])
+        # Todos los argumentos se guardan antes de moverlos a su lugar,
+        # porque el destino de uno puede ser el registro de otro
+        for reg in regs:
+            if reg is not None:
+                self.push(reg)
+        for v, reg in reversed(list(zip(ins.dst, regs))):
+            if reg is not None:
+                self.pop_into(v)
+        # Los que no caben en registros estan arriba de la direccion de retorno
+        stack = [ v for v, reg in zip(ins.dst, regs) if reg is None ]
+        for i, v in enumerate(stack):
+            mem = f'{16 + 8 * i}(%rbp)'
+            k = self.kinds[v]
+            if k == 'f':
+                reg = self.reg(v) or 'xmm0'
+                self.out(f'movsd {mem}, %{reg}')
+            else:
+                reg = self.reg(v) or 'r11'
+                self.out(f'movq {mem}, %{reg}')
+            self.result(v, reg)
+
+    def push(self, reg):
+        if reg.startswith('xmm'):
+            self.out('subq $8, %rsp')
+            self.out(f'movsd %{reg}, (%rsp)')
+        else:
+            self.out(f'pushq %{reg}')
+
+    def pop_into(self, v):
+        reg = self.reg(v)
+        if reg is None:
+            self.out(f'popq {self.op(v)}')
+        elif reg.startswith('xmm'):
+            self.out(f'movsd (%rsp), %{reg}')
+            self.out('addq $8, %rsp')
+        else:
+            self.out(f'popq %{reg}')
+
+    def emit_const(self, ins):
+        self.move(ins.dst[0], ins.src[0])
+
+    def emit_fconst(self, ins):
+        d = ins.dst[0]
+        reg = self.reg(d) or 'xmm0'
+        self.out(f'movsd {ins.arg}(%rip), %{reg}')
+        self.result(d, reg)
+
+    def emit_addr(self, ins):
+        d = ins.dst[0]
+        reg = self.reg(d) or 'r11'
+        self.out(f'leaq {ins.arg}(%rip), %{reg}')
+        self.result(d, reg)
+
+    def emit_slotaddr(self, ins):
+        d = ins.dst[0]
+        reg = self.reg(d) or 'r11'
+        self.out(f'leaq {self.slot(ins.arg)}, %{reg}')
+        self.result(d, reg)
+
+    def load_from(self, mem, d, type):
+        k = self.kinds[d]
+        reg = self.reg(d) or ('xmm0' if k == 'f' else 'r11')
+        if type == 'char':
+            self.out(f'movsbl {mem}, %{R32[reg]}')
+        elif k == 'f':
+            self.out(f'movsd {mem}, %{reg}')
+        elif k == 'p':
+            self.out(f'movq {mem}, %{reg}')
+        else:
+            self.out(f'movl {mem}, %{R32[reg]}')
+        self.result(d, reg)
+
+    def store_to(self, mem, v, type):
+        if type == 'float':
+            self.out(f'movsd %{self.into(v, "xmm0")}, {mem}')
+        elif isinstance(v, Imm):
+            s = { 'char': 'b', 'int': 'l' }.get(type, 'q')
+            self.out(f'mov{s} ${v.value}, {mem}')
+        else:
+            reg = self.into(v, 'rax')
+            if type == 'char':
+                self.out(f'movb %{R8[reg]}, {mem}')
+            elif type.endswith('*'):
+                self.out(f'movq %{reg}, {mem}')
+            else:
+                self.out(f'movl %{R32[reg]}, {mem}')
+
+    def emit_loadg(self, ins):
+        name, type = ins.arg
+        self.load_from(f'{name}(%rip)', ins.dst[0], type)
+
+    def emit_storeg(self, ins):
+        name, type = ins.arg
+        self.store_to(f'{name}(%rip)', ins.src[0], type)
+
+    def emit_loads(self, ins):
+        n, type = ins.arg
+        self.load_from(self.slot(n), ins.dst[0], type)
+
+    def emit_stores(self, ins):
+        n, type = ins.arg
+        self.store_to(self.slot(n), ins.src[0], type)
+
+    def indexed(self, base, index, scale):
+        '''
+        Operando de memoria base[index] (index es int, con signo).
+        '''
+        b = self.into(base, 'r11')
+        if isinstance(index, Imm):
+            return f'{index.value * scale}(%{b})'
+        self.out(f'movslq {self.op(index)}, %rcx')
+        return f'(%{b},%rcx,{scale})'
+
+    def emit_loadx(self, ins):
+        type, scale = ins.arg
+        self.load_from(self.indexed(*ins.src, scale), ins.dst[0], type)
+
+    def emit_storex(self, ins):
+        type, scale = ins.arg
+        base, index, v = ins.src
+        self.store_to(self.indexed(base, index, scale), v, type)
+
+    def emit_load(self, ins):
+        addr = self.into(ins.src[0], 'r11')
+        self.load_from(f'(%{addr})', ins.dst[0], ins.arg)
+
+    def emit_store(self, ins):
+        addr = self.into(ins.src[0], 'r11')
+        self.store_to(f'(%{addr})', ins.src[1], ins.arg)
+
+    def emit_mov(self, ins):
+        if ins.dst[0] != ins.src[0]:
+            self.move(ins.dst[0], ins.src[0])
+
+    def emit_cvt(self, ins):
+        d, a = ins.dst[0], ins.src[0]
+        frm, to = ins.arg
+        if (frm, to) == ('i', 'f'):
+            reg = self.reg(d) or 'xmm0'
+            src = self.op(a) if not isinstance(a, Imm) else '%' + R32[self.into(a, 'r11')]
+            self.out(f'cvtsi2sdl {src}, %{reg}')
+        elif (frm, to) == ('f', 'i'):
+            reg = self.reg(d) or 'r11'
+            self.out(f'cvttsd2si {self.op(a)}, %{R32[reg]}')
+        elif (frm, to) == ('i', 'c'):
+            src = self.into(a, 'r11')
+            reg = self.reg(d) or 'r11'
+            self.out(f'movsbl %{R8[src]}, %{R32[reg]}')
+        else:
+            reg = self.reg(d) or 'r11'
+            if isinstance(a, Imm):
+                self.out(f'movq ${a.value}, %{reg}')
+            else:
+                self.out(f'movslq {self.op(a)}, %{reg}')
+        self.result(d, reg)
+
+    def emit_bin(self, ins):
+        d, (a, b) = ins.dst[0], ins.src
+        op = ins.arg
+        if self.kinds[d] == 'f':
+            reg = self.reg(d) or 'xmm0'
+            if reg == self.reg(b) and reg != self.reg(a):
+                if op in ('+', '*'):
+                    a, b = b, a
+                else:
+                    reg = 'xmm0'
+            if self.reg(a) != reg:
+                self.out(f'movsd {self.op(a)}, %{reg}')
+            self.out(f'{FBINOP[op]} {self.op(b)}, %{reg}')
+            self.result(d, reg)
+            return
+
+        if op in ('/', '%'):
+            self.out(f'movl {self.op(a)}, %eax')
+            self.out('cltd')
+            divisor = self.op(b) if not isinstance(b, Imm) else '%' + R32[self.into(b, 'rcx')]
+            self.out(f'idivl {divisor}')
+            self.result(d, 'rax' if op == '/' else 'rdx')
+            return
+
+        reg = self.reg(d) or 'rax'
+        if reg == self.reg(b) and reg != self.reg(a):
+            if op in ('+', '*'):
+                a, b = b, a
+            else:
+                reg = 'rax'
+        if self.reg(a) != reg:
+            self.out(f'movl {self.op(a)}, %{R32[reg]}')
+        self.out(f'{BINOP[op]}l {self.op(b)}, %{R32[reg]}')
+        self.result(d, reg)
+
+    def emit_index(self, ins):
+        d, (base, index) = ins.dst[0], ins.src
+        scale = ins.arg
+        reg = self.reg(d) or 'r11'
+        b = self.into(base, 'r11')
+        if isinstance(index, Imm):
+            self.out(f'leaq {index.value * scale}(%{b}), %{reg}')
+        else:
+            self.out(f'movslq {self.op(index)}, %rcx')
+            if scale < 0:
+                self.out('negq %rcx')
+                scale = -scale
+            self.out(f'leaq (%{b},%rcx,{scale}), %{reg}')
+        self.result(d, reg)
+
+    def emit_pdiff(self, ins):
+        d, (a, b) = ins.dst[0], ins.src
+        self.out(f'movq {self.op(a, 64)}, %rax')
+        self.out(f'subq {self.op(b, 64)}, %rax')
+        shift = { 1: 0, 4: 2, 8: 3 }[ins.arg]
+        if shift:
+            self.out(f'sarq ${shift}, %rax')
+        self.result(d, 'rax')
+
+    def compare(self, a, b):
+        '''
+        Compara a con b y devuelve el sufijo de la condicion para op.
+        '''
+        if not isinstance(a, Imm) and self.kinds[a] == 'f':
+            ra = self.into(a, 'xmm0')
+            self.out(f'ucomisd {self.op(b)}, %{ra}')
+            return FSETCC
+        ra = self.into(a, 'r11')
+        if self.width(a) == 64:
+            self.out(f'cmpq {self.op(b, 64)}, %{ra}')
+        else:
+            self.out(f'cmpl {self.op(b)}, %{R32[ra]}')
+        return SETCC
+
+    def emit_cmp(self, ins):
+        d, (a, b) = ins.dst[0], ins.src
+        cc = self.compare(a, b)[ins.arg]
+        reg = self.reg(d) or 'rax'
+        self.out(f'set{cc} %al')
+        self.out(f'movzbl %al, %{R32[reg]}')
+        self.result(d, reg)
+
+    def emit_cjump(self, ins):
+        op, label = ins.arg
+        cc = self.compare(*ins.src)[op]
+        self.out(f'j{NEGATE[cc]} {label}')
+
+    def test_zero(self, a):
+        if self.kinds[a] == 'f':
+            ra = self.into(a, 'xmm0')
+            self.out('xorpd %xmm1, %xmm1')
+            self.out(f'ucomisd %xmm1, %{ra}')
+        else:
+            ra = self.into(a, 'r11')
+            self.out(f'test{self.suffix(a)} {self.r(ra, self.kinds[a])}, {self.r(ra, self.kinds[a])}')
+
+    def emit_jz(self, ins):
+        self.test_zero(ins.src[0])
+        self.out(f'je {ins.arg}')
+
+    def emit_not(self, ins):
+        d = ins.dst[0]
+        self.test_zero(ins.src[0])
+        reg = self.reg(d) or 'rax'
+        self.out('sete %al')
+        self.out(f'movzbl %al, %{R32[reg]}')
+        self.result(d, reg)
+
+    def emit_neg(self, ins):
+        d, a = ins.dst[0], ins.src[0]
+        if self.kinds[d] == 'f':
+            reg = self.reg(d) or 'xmm0'
+            if self.reg(a) != reg:
+                self.out(f'movsd {self.op(a)}, %{reg}')
+            self.out(f'xorpd .LNEG(%rip), %{reg}')
+        else:
+            reg = self.reg(d) or 'rax'
+            if self.reg(a) != reg:
+                self.out(f'movl {self.op(a)}, %{R32[reg]}')
+            self.out(f'negl %{R32[reg]}')
+        self.result(d, reg)
+
+    def emit_jmp(self, ins):
+        self.out(f'jmp {ins.arg}')
+
+    def emit_label(self, ins):
+        self.lines.append(f'{ins.arg}:')
+
+    def emit_call(self, ins):
+        name, kinds, variadic, external = ins.arg
+        regs, nxmm = self.classify(kinds)
+
+        # Los argumentos que no caben en registros van en la pila, el
+        # ultimo primero, con rsp alineado a 16 en el call
+        stack = [ v for v, reg in zip(ins.src, regs) if reg is None ]
+        pad = 8 * (len(stack) % 2)
+        if pad:
+            self.out('subq $8, %rsp')
+        for v in reversed(stack):
+            self.push_value(v)
+
+        # Cada argumento va a la pila y de ahi a su registro: asi ningun
+        # registro de argumento se sobreescribe antes de leerse
+        for v, reg in zip(ins.src, regs):
+            if reg is not None:
+                self.push_value(v)
+        for reg in reversed(regs):
+            if reg is None:
+                continue
+            if reg.startswith('xmm'):
+                self.out(f'movsd (%rsp), %{reg}')
+                self.out('addq $8, %rsp')
+            else:
+                self.out(f'popq %{reg}')
+        if variadic:
+            self.out(f'movl ${nxmm}, %eax')
+        self.out(f'call {name}@PLT' if external else f'call {name}')
+        if stack:
+            self.out(f'addq ${8 * len(stack) + pad}, %rsp')
+        if ins.dst:
+            d = ins.dst[0]
+            self.result(d, 'xmm0' if self.kinds[d] == 'f' else 'rax')
+
+    def push_value(self, v):
+        if isinstance(v, Imm):
+            self.out(f'pushq ${v.value}')
+        elif self.reg(v) is None:
+            self.out(f'pushq {self.op(v)}')
+        else:
+            self.push(self.reg(v))
+
+    def emit_ret(self, ins):
+        if ins.src:
+            v = ins.src[0]
+            if not isinstance(v, Imm) and self.kinds[v] == 'f':
+                if self.reg(v) != 'xmm0':
+                    self.out(f'movsd {self.op(v)}, %xmm0')
+            else:
+                s = self.suffix(v)
+                self.out(f'mov{s} {self.op(v, self.width(v))}, {"%rax" if s == "q" else "%eax"}')
+        self.out(f'jmp {self.exit}')
+
+
+# ----------------------------------------------------------------------
+# Peephole
+# ----------------------------------------------------------------------
+def peephole(lines):
+    '''
+    Optimizaciones locales sobre el texto.  Devuelve (lineas, eliminadas).
+    '''
+    removed = 0
+    changed = True
+    while changed:
+        changed = False
+        # Destino final de las etiquetas que solo saltan a otra
+        target = {}
+        for i, line in enumerate(lines[:-1]):
+            if line.endswith(':') and lines[i + 1].startswith('\tjmp '):
+                target[line[:-1]] = lines[i + 1].split()[1]
+
+        result = []
+        dead = False
+        for line in lines:
+            if line.endswith(':') or not line.startswith('\t') or line.startswith('\t.'):
+                dead = False
+                result.append(line)
+                continue
+            if dead:
+                removed += 1
+                changed = True
+                continue
+
+            parts = line.split(None, 1)
+            instr, args = parts[0], (parts[1] if len(parts) > 1 else '')
+            ops = [ a.strip() for a in split_operands(args) ]
+
+            # mov %r, %r
+            if instr in ('movl', 'movq', 'movsd') and len(ops) == 2 and ops[0] == ops[1]:
+                removed += 1
+                changed = True
+                continue
+
+            # Saltos a etiquetas que solo saltan a otra
+            if instr.startswith('j') and ops and ops[0] in target and target[ops[0]] != ops[0]:
+                line = f'\t{instr} {target[ops[0]]}'
+                ops = [ target[ops[0]] ]
+                changed = True
+
+            if result:
+                prev = result[-1].split(None, 1)
+                pinstr, pops = prev[0], [ a.strip() for a in split_operands(prev[1] if len(prev) > 1 else '') ]
+                # mov A, B ; mov B, A  -> el segundo sobra
+                if instr == pinstr and instr in ('movl', 'movq', 'movsd') and len(ops) == 2 \
+                   and len(pops) == 2 and ops == pops[::-1]:
+                    removed += 1
+                    changed = True
+                    continue
+                # pushq X ; popq %r  ->  movq X, %r
+                if pinstr == 'pushq' and instr == 'popq' and not ('(' in pops[0] and '(' in ops[0]):
+                    if pops[0] == ops[0]:
+                        result.pop()
+                        removed += 2
+                    else:
+                        result[-1] = f'\tmovq {pops[0]}, {ops[0]}'
+                        removed += 1
+                    changed = True
+                    continue
+                # mov R, M ; mov M, R2  ->  mov R, M ; mov R, R2
+                if instr == pinstr and instr in ('movl', 'movq', 'movsd') and len(ops) == 2 \
+                   and len(pops) == 2 and ops[0] == pops[1] and '(' in ops[0] and pops[0].startswith('%'):
+                    line = f'\t{instr} {pops[0]}, {ops[1]}'
+                    if pops[0] == ops[1]:
+                        removed += 1
+                        changed = True
+                        continue
+                    changed = True
+
+            result.append(line)
+            if instr == 'jmp':
+                dead = True
+
+        # jmp L ; L:
+        lines = []
+        for i, line in enumerate(result):
+            if line.startswith('\tjmp ') and i + 1 < len(result) and result[i + 1] == line.split()[1] + ':':
+                removed += 1
+                changed = True
+                continue
+            lines.append(line)
+    return lines, removed
+
+
+def split_operands(args):
+    '''
+    Separa operandos por comas que no esten dentro de parentesis.
+    '''
+    ops, depth, cur = [], 0, ''
+    for c in args:
+        if c == ',' and depth == 0:
+            ops.append(cur)
+            cur = ''
+            continue
+        depth += c == '('
+        depth -= c == ')'
+        cur += c
+    if cur:
+        ops.append(cur)
+    return ops
+
+
+# ----------------------------------------------------------------------
+# Modulo completo
+# ----------------------------------------------------------------------
+def compile_ast(ast, checker, optimize=True, stats=None):
+    module = Module(checker.symbols)
+    module.defined = { d.name.name for d in ast.decl if isinstance(d, FuncDefinition) }
+
+    text = []
+    for decl in ast.decl:
+        if isinstance(decl, FuncDefinition):
+            low = Lowering.lower(module, decl)
+            loc, nslots = linear_scan(low.ir, low.kinds, low.nslots)
+            lines = Emitter(low, loc, nslots).function(decl.static)
+            if optimize:
+                lines, removed = peephole(lines)
+                if stats is not None:
+                    stats['peephole'] = stats.get('peephole', 0) + removed
+            if stats is not None:
+                stats['spills'] = stats.get('spills', 0) + sum(isinstance(l, tuple) for l in loc)
+                stats['vregs'] = stats.get('vregs', 0) + len(low.kinds)
+            text += lines
+        else:
+            type, d = pointer_type(decl.type, decl.expr)
+            if not isinstance(d, tuple) and not decl.extern:
+                module.globals[d.name] = sizeof(type)
+
+    asm = [ '\t.text' ] + text
+    if module.globals:
+        asm.append('\t.bss')
+        for name, size in module.globals.items():
+            asm += [ f'\t.globl {name}', '\t.align 8', f'{name}:', f'\t.zero {size}' ]
+    asm += [ '\t.section .rodata', '\t.align 16', '.LNEG:', '\t.quad 0x8000000000000000, 0' ]
+    for bits, label in module.floats.items():
+        asm += [ '\t.align 8', f'{label}:', f'\t.quad {bits}' ]
+    for literal, label in module.strings.items():
+        asm += [ f'{label}:', f'\t.asciz {literal}' ]
+    asm.append('\t.section .note.GNU-stack,"",@progbits')
+    return '\n'.join(asm) + '\n'
+
+
+def compile_source(text, optimize=True, stats=None):
+    from mclex import Lexer
+    from mcparse import Parser
+    from mccheck import Checker
+    from mcinterp import CompileError
+
+    parser = Parser(recover=True)
+    ast = parser.parse(Lexer().tokenize(text))
+    if parser.errors:
+        raise CompileError([ f'{e.lineno or "EOF"}: {e.msg}' for e in parser.errors ])
+    checker = Checker.check(ast)
+    if checker.errors:
+        lines = LineIndex(text)
+        raise CompileError([ f'{lines.location(node)[0]}: {msg}' if lines.location(node) else msg
+                             for msg, node in checker.errors ])
+    return compile_ast(ast, checker, optimize, stats)
+
+
+def build(asm, exe, keep=False):
+    '''
+    Ensambla con as y enlaza con cc (que agrega la libc).  El .s y el .o
+    van a un directorio temporal, o junto a exe si keep.
+    '''
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.splitext(exe)[0] if keep else os.path.join(tmp, 'prog')
+        with open(base + '.s', 'w') as f:
+            f.write(asm)
+        subprocess.run([ 'as', '-o', base + '.o', base + '.s' ], check=True)
+        subprocess.run([ 'cc', '-o', exe, base + '.o' ], check=True)
+    return exe
+
+
+# ----------------------------------------------------------------------
+# Verificacion contra el interprete
+# ----------------------------------------------------------------------
+CHECKS = {
+'fib': '''
+extern int printf(char *fmt, ...);
+int fib(int n) {
+    if (n < 2) { return n; }
+    return fib(n - 1) + fib(n - 2);
+}
+int main() {
+    int i;
+    for (i = 0; i < 20; i += 1) { printf("%d ", fib(i)); }
+    printf("\\n");
+    return fib(10);
+}
+''',
+'enteros': '''
+extern int printf(char *fmt, ...);
+int g;
+int main() {
+    int a;
+    int b;
+    char c;
+    a = 2147483647;
+    a = a + 1;
+    b = -7;
+    printf("%d %d %d %d %d\\n", a, b / 2, b % 2, 7 / -2, 7 % -2);
+    c = 300;
+    g = c * 2;
+    printf("%d %d %d %c\\n", c, g, !g, 'z');
+    a = 5;
+    b = (a = a + 1) * 2;
+    printf("%d %d %d\\n", a, b, -a);
+    a = 0;
+    while (1) { a += 3; if (a > 20) { break; } }
+    for (b = 0; b < 10; b += 1) { if (b % 2 == 0) { continue; } a -= b; }
+    printf("%d %d\\n", a, b);
+    return 0;
+}
+''',
+'flotantes': '''
+extern int printf(char *fmt, ...);
+float area(float r) { return 3.14159 * r * r; }
+float mix(int a, float b, int c, float d) { return a * b - c / d; }
+int main() {
+    float x;
+    int i;
+    x = 0.5;
+    for (i = 0; i < 5; i += 1) { x = x * 1.5 + i; }
+    printf("%f %f %.3f\\n", x, area(2.0), mix(3, 2.5, 7, 2.0));
+    i = x;
+    printf("%d %f %f\\n", i, -x, x / 4);
+    printf("%f %f %f\\n", x / 0.0, -x / 0, (x - x) / (x - x));
+    if (x > 10.0) { printf("grande\\n"); } else { printf("chico\\n"); }
+    return 0;
+}
+''',
+'apuntadores': '''
+extern int printf(char *fmt, ...);
+extern void *malloc(int n);
+extern void free(void *p);
+int total;
+void swap(int *a, int *b) {
+    int t;
+    t = *a;
+    *a = *b;
+    *b = t;
+}
+int sum(int *v, int n) {
+    int s;
+    int *end;
+    s = 0;
+    end = v + n;
+    while (v < end) { s += *v; v = v + 1; }
+    return s;
+}
+int main() {
+    int x;
+    int y;
+    int *p;
+    char *s;
+    int i;
+    x = 1;
+    y = 2;
+    swap(&x, &y);
+    p = malloc(10 * 4);
+    for (i = 0; i < 10; i += 1) { p[i] = i * i; }
+    s = "hola mundo";
+    total = sum(p, 10);
+    printf("%d %d %d %d %s %c\\n", x, y, total, (p + 7) - p, s, s[5]);
+    *(p + 2) = 100;
+    p[3] -= 1;
+    printf("%d %d\\n", p[2], p[3]);
+    free(p);
+    return 0;
+}
+''',
+'presion': '''
+extern int printf(char *fmt, ...);
+int f(int a, int b, int c, int d, int e, int g) {
+    int h;
+    int i;
+    int j;
+    int k;
+    int l;
+    int m;
+    h = a + b;
+    i = b + c;
+    j = c + d;
+    k = d + e;
+    l = e + g;
+    m = g + a;
+    printf("%d %d %d\\n", h, i, j);
+    return h * i + j * k + l * m + a + b + c + d + e + g;
+}
+int main() {
+    printf("%d\\n", f(1, 2, 3, 4, 5, 6));
+    return 0;
+}
+''',
+'direccion': '''
+int main() {
+    int x;
+    int *p;
+    p = &x;
+    *p = 3;
+    return x;
+}
+''',
+'derrames': '''
+extern int printf(char *fmt, ...);
+int main() {
+    float a;
+    float b;
+    float c;
+    float d;
+    float e;
+    float f;
+    float g;
+    float h;
+    float i;
+    float j;
+    float k;
+    float l;
+    float m;
+    float n;
+    float o;
+    float p;
+    float q;
+    a = 1.0; b = 2.0; c = 3.0; d = 4.0; e = 5.0; f = 6.0; g = 7.0; h = 8.0; i = 9.0;
+    j = 10.0; k = 11.0; l = 12.0; m = 13.0; n = 14.0; o = 15.0; p = 16.0; q = 17.0;
+    q = q + a * b - c + d * e - f + g * h - i + j * k - l + m * n - o + p;
+    printf("%f %f %f %f %f %f %f %f %f\\n", a, b, c, d, e, f, g, h, q);
+    printf("%f %f %f %f %f %f %f %f\\n", i, j, k, l, m, n, o, p);
+    return 0;
+}
+''',
+'muchos': '''
+extern int printf(char *fmt, ...);
+float fs;
+char letra;
+char *nombres;
+int ocho(int a, int b, int c, int d, int e, int f, int g, int h) {
+    return a - b + c - d + e - f + g * h;
+}
+float diez(float a, float b, float c, float d, float e, float f, float g, float h, float i, float j) {
+    return a + b * c - d + e * f - g + h * i - j;
+}
+float acumula(int n) {
+    float a;
+    float b;
+    float c;
+    int i;
+    a = 1.0;
+    b = 2.0;
+    c = 0.0;
+    for (i = 0; i < n; i += 1) {
+        c = c + diez(a, b, c, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, i);
+        a = a * 0.5;
+        b = b + a;
+    }
+    return c + a + b;
+}
+int main() {
+    int i;
+    int j;
+    int s;
+    fs = 2.5;
+    letra = 'A';
+    nombres = "abc def\\n";
+    s = 0;
+    for (i = 0; i < 10; i += 1) {
+        for (j = 0; j < 10; j += 1) {
+            if (j > i) { break; }
+            s += ocho(i, j, 1, 2, 3, 4, i + j, i - j);
+        }
+    }
+    printf("%d %.4f %c%c %s", s, acumula(6) * fs, letra, letra + 1, nombres);
+    printf("%d %d %d %d %d %d %d %d %d\\n", 1, 2, 3, 4, 5, 6, 7, 8, ocho(1, 2, 3, 4, 5, 6, 7, 8));
+    return s % 256;
+}
+''',
+'truncados': '''
+extern int printf(char *fmt, ...);
+int main() {
+    int i;
+    int j;
+    int k;
+    char c;
+    float z;
+    z = 0.0;
+    i = 1.0 / z;
+    j = z / z;
+    k = 3000000000.0;
+    c = -1.0 / z;
+    printf("%d %d %d %d ", i, j, k, c);
+    i = -7.9;
+    c = 300.0;
+    printf("%d %d\\n", i, c);
+    return i;
+}
+''',
+}
+
+
+def run_native(src, tmp, optimize=True):
+    exe = build(compile_source(src, optimize), os.path.join(tmp, 'prog'))
+    proc = subprocess.run([ exe ], capture_output=True, text=True)
+    return proc.stdout, proc.returncode
+
+
+def run_interp(src):
+    import io
+    from mcinterp import Interpreter
+    out = io.StringIO()
+    status = Interpreter.compile(src, out=out).run()
+    return out.getvalue(), status & 0xff
+
+
+def check(programs):
+    '''
+    Compila y ejecuta cada programa, con y sin peephole, y compara su
+    salida y codigo de salida con los del interprete.  Devuelve el numero
+    de diferencias.
+    '''
+    import tempfile
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, src in programs.items():
+            try:
+                expected = run_interp(src)
+                got = [ run_native(src, tmp, optimize) for optimize in (True, False) ]
+            except Exception as e:
+                print(f'  {name:12s} ERROR {type(e).__name__}: {e}')
+                failures += 1
+                continue
+            if got[0] == got[1] == expected:
+                print(f'  {name:12s} ok')
+            else:
+                failures += 1
+                print(f'  {name:12s} DIFERENTE')
+                print(f'    interprete: {expected!r}')
+                print(f'    nativo:     {got[0]!r}')
+                print(f'    sin peephole: {got[1]!r}')
+    return failures
+
+
+def bench(n=100000):
+    import tempfile
+    import time
+    from mcmem import KERNELS
+
+    programs = { name: src.replace('N', str(n)) for name, src in KERNELS.items() }
+    programs['fib'] = CHECKS['fib'].replace('i < 20', 'i < 25')
+    print(f'N = {n}')
+    print(f'  {"programa":10s} {"interprete":>11s} {"nativo":>9s} {"sin peephole":>13s}  aceleracion')
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, src in programs.items():
+            t0 = time.perf_counter()
+            run_interp(src)
+            t1 = time.perf_counter()
+            times = []
+            for optimize in (True, False):
+                exe = build(compile_source(src, optimize), os.path.join(tmp, f'{name}{int(optimize)}'))
+                t2 = time.perf_counter()
+                subprocess.run([ exe ], capture_output=True)
+                times.append(time.perf_counter() - t2)
+            print(f'  {name:10s} {t1-t0:9.3f} s {1e3*times[0]:7.1f} ms {1e3*times[1]:10.1f} ms  '
+                  f'x{(t1-t0)/times[0]:.0f}')
+
+        stats = {}
+        for src in programs.values():
+            compile_source(src, True, stats)
+        print(f"  {stats['vregs']} registros virtuales, {stats['spills']} derramados, "
+              f"{stats['peephole']} instrucciones eliminadas por peephole")
+
+
+if __name__ == '__main__':
+    import argparse
+    from mcinterp import CompileError
+
+    ap = argparse.ArgumentParser(description='Compilador MiniC a x86-64')
+    ap.add_argument('fnames', nargs='*')
+    ap.add_argument('-o', dest='output', help='ejecutable de salida')
+    ap.add_argument('-S', action='store_true', help='mostrar el ensamblador')
+    ap.add_argument('--keep', action='store_true', help='conservar el .s y el .o')
+    ap.add_argument('-O0', dest='optimize', action='store_false', help='sin peephole')
+    ap.add_argument('--check', action='store_true', help='comparar con el interprete')
+    ap.add_argument('--bench', action='store_true', help='tiempos nativo / interprete')
+    args = ap.parse_args()
+
+    if args.bench:
+        bench()
+        exit(0)
+    if args.check:
+        from mcmem import KERNELS
+        programs = { os.path.basename(f): open(f, encoding='utf-8').read() for f in args.fnames } \
+                   or { **CHECKS, **{ k: src.replace('N', '1000') for k, src in KERNELS.items() } }
+        exit(1 if check(programs) else 0)
+    if len(args.fnames) != 1:
+        ap.error('se requiere un archivo')
+
+    try:
+        asm = compile_source(open(args.fnames[0], encoding='utf-8').read(), args.optimize)
+    except CompileError as e:
+        for msg in e.errors:
+            print(f'{args.fnames[0]}:{msg}', file=sys.stderr)
+        exit(1)
+    if args.S:
+        sys.stdout.write(asm)
+    else:
+        build(asm, args.output or os.path.splitext(args.fnames[0])[0], args.keep)
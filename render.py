@@ -1,10 +1,43 @@
 from mcast import *
 import graphviz as gpv
+from graphviz import quoting
 
 from mclex import *
 from mcparse import *
+from mccons import ExprFactory
+from mcunparse import Unparser
 from rich import print
 
+
+class DotWriter:
+    '''
+    Escribe el grafo DOT linea por linea en un archivo en lugar de
+    acumularlo en memoria.  Tiene la misma interfaz (attr/node/edge)
+    que graphviz.Digraph, asi que RenderAST funciona con cualquiera de
+    los dos.
+    '''
+    def __init__(self, file, name='AST', comment=None):
+        self.file = file
+        if comment:
+            file.write(f'// {comment}\n')
+        file.write(f'digraph {quoting.quote(name)} {{\n')
+
+    def attr(self, kw, **attrs):
+        self.file.write(f'\t{kw}{quoting.attr_list(None, attrs)}\n')
+
+    def node(self, name, label=None, **attrs):
+        self.file.write(f'\t{quoting.quote(name)}{quoting.attr_list(label, attrs)}\n')
+
+    def edge(self, tail, head, **attrs):
+        self.file.write(f'\t{quoting.quote(tail)} -> {quoting.quote(head)}{quoting.attr_list(None, attrs)}\n')
+
+    def close(self):
+        self.file.write('}\n')
+
+    def __repr__(self):
+        return f'DotWriter({getattr(self.file, "name", self.file)!r})'
+
+
 class RenderAST(Visitor):
     node_default = {
         'shape' : 'box',
@@ -14,129 +47,313 @@ class RenderAST(Visitor):
     edge_default = {
         'arrowhead' : 'none'
     }
+    elided_color = 'lightgrey'
 
-    def __init__(self):
-        self.dot = gpv.Digraph('AST', comment='AST')
+    def __init__(self, dot=None, max_depth=None, max_children=None, collapse=False):
+        '''
+        dot          : graphviz.Digraph (por defecto) o DotWriter
+        max_depth    : profundidad maxima; lo que este debajo se muestra como '...'
+        max_children : hijos mostrados por nodo; el resto se resume en un nodo
+        collapse     : las subexpresiones repetidas se dibujan una sola vez
+        '''
+        if dot is None:
+            dot = gpv.Digraph('AST', comment='AST')
+        self.dot = dot
         self.dot.attr('node', **self.node_default)
         self.dot.attr('edge', **self.edge_default)
         self.seq = 0
-    
+        self.depth = 0
+        self.max_depth = max_depth
+        self.max_children = max_children
+        self.shared = ExprFactory() if collapse else None
+        self.names  = {}            # expresion compartida -> nombre del nodo
+        self.text   = Unparser(None)
+
     def __repr__(self):
+        if isinstance(self.dot, DotWriter):
+            # En modo stream el DOT ya esta en el archivo, no en memoria
+            return f'RenderAST({self.dot!r}, {self.seq} nodos)'
         return self.dot.source
 
     def __str__(self):
-        return self.dot.source
-    
+        return repr(self)
+
     def name(self):
         self.seq += 1
         return f'n{self.seq:02d}'
 
     @classmethod
-    def render(cls, n:Node):
-        dot = cls()
+    def render(cls, n:Node, **options):
+        dot = cls(**options)
         n.accept(dot)
         return dot.dot
-    
- 
+
+    @classmethod
+    def stream(cls, n:Node, file, **options):
+        '''
+        Escribe el DOT de n directamente en file.
+        '''
+        dot = DotWriter(file, 'AST', comment='AST')
+        n.accept(cls(dot, **options))
+        dot.close()
+
+    # ------------------------------------------------------------------
+    # Hijos, limites y subarboles repetidos
+    # ------------------------------------------------------------------
+    def child(self, n):
+        if self.max_depth is not None and self.depth >= self.max_depth:
+            return self.elided('...')
+
+        shared = self.shared is not None and isinstance(n, Expression)
+        if shared:
+            n = self.shared.intern(n)
+            name = self.names.get(n)
+            if name is not None:
+                return name
+
+        self.depth += 1
+        if n is None or isinstance(n, (tuple, list)):
+            name = self.block(n)
+        else:
+            name = n.accept(self)
+        self.depth -= 1
+        if shared:
+            self.names[n] = name
+        return name
+
+    def children(self, name, nodes, **attrs):
+        nodes = list(nodes)
+        hidden = 0
+        if self.max_children is not None and len(nodes) > self.max_children:
+            hidden = len(nodes) - self.max_children
+            nodes = nodes[:self.max_children]
+        for n in nodes:
+            self.dot.edge(name, self.child(n), **attrs)
+        if hidden:
+            self.dot.edge(name, self.elided(f'... {hidden} mas'), **attrs)
+
+    def block(self, stmt):
+        # Bloque compuesto anidado
+        name = self.name()
+        self.dot.node(name, label='Block')
+        self.children(name, block_items(stmt))
+        return name
+
+    def elided(self, label):
+        name = self.name()
+        self.dot.node(name, label=label, color=self.elided_color)
+        return name
+
+    # ------------------------------------------------------------------
+    # Declaraciones
+    # ------------------------------------------------------------------
     def visit(self, node : TranslationUnit):
         name = self.name()
         self.dot.node(name,
             label="TranslationUnit\\n"
             )
-        for n in node.decl:
-            self.dot.edge(name, self.visit(n))
+        self.children(name, node.decl)
         return name
-    
+
     def visit(self, node : FuncDefinition):
         name = self.name()
         self.dot.node(name,
-            label=fr"FuncDefinition\nname:'{node.name}'\ntype: {node.type}\nstatic: {node.static}\n params : {node.params}",
+            label=fr"FuncDefinition\nname:'{node.name.name}'\ntype: {node.type}\nstatic: {node.static}\n params : {self.text.params(node.params)}",
             )
-        for n in node.stmts:
-            print(n)
-            self.dot.edge(name, self.visit(n))
-            
+        self.children(name, block_items(node.stmts))
         return name
-    
+
     def visit(self, node : VarDefinition):
         name = self.name()
         self.dot.node(name,
-            label=fr"VarDefinition\ntype:'{node.type}'\nextern: '{node.extern}'"
+            label=fr"VarDefinition\ntype:'{node.type}'\nextern: '{node.extern}'\ndecl: {self.text.declarator(node.expr)}"
             )
-        
-        self.dot.edge(name, self.visit(node.expr))
         return name
 
-    def visit(self, node:Variable):
+    # ------------------------------------------------------------------
+    # Sentencias
+    # ------------------------------------------------------------------
+    def visit(self, node:ExprStmt):
         name = self.name()
-        self.dot.node(name, label=f"Variable\\nname='{node.name}'")
+        self.dot.node(name, label='ExprStmt')
+        self.children(name, [ node.expr ])
         return name
 
-    def visit(self, node:ExprStmt):
+    def visit(self, node:Return):
         name = self.name()
-        self.dot.node(name,
-            label='ExprStmt',
-            color=self.color)
-        print(node.expr)
-        for n in node.expr:
-            self.dot.edge(name, self.visit(n))
+        self.dot.node(name, label='Return')
+        if node.expr is not None:
+            self.children(name, [ node.expr ])
         return name
 
-    def visit(self, node:Literal):
+    def visit(self, node:Break):
         name = self.name()
-        self.dot.node(name, label=f"Literal\\nname='{node.value}")
+        self.dot.node(name, label='Break')
         return name
 
-    def visit(self, n:Binary):
+    def visit(self, node:Continue):
+        name = self.name()
+        self.dot.node(name, label='Continue')
+        return name
+
+    def visit(self, node:WhileLoop):
+        name = self.name()
+        self.dot.node(name, label='WhileLoop')
+        self.children(name, [ node.expr ], label='cond')
+        self.children(name, block_items(node.stmt))
+        return name
+
+    def visit(self, node:ForLoop):
+        name = self.name()
+        self.dot.node(name, label='ForLoop')
+        self.children(name, [ node.begin ], label='begin')
+        self.children(name, [ node.expr ], label='cond')
+        self.children(name, [ node.end ], label='end')
+        self.children(name, block_items(node.stmt))
+        return name
+
+    def visit(self, node:IfStmt):
         name = self.name()
-        self.dot.node(name, label="Binary\\nAssignment")
-        #self.dot.edge(name, n.left.accept(self))
-        #self.dot.edge(name, n.right.accept(self))
+        self.dot.node(name, label='IfStmt')
+        self.children(name, [ node.cond ], label='cond')
+        self.children(name, block_items(node.cons), label='cons')
+        self.children(name, block_items(node.altr), label='altr')
         return name
-    
-        
-'''   def visit(self, n:Binary):
+
+    # ------------------------------------------------------------------
+    # Expresiones
+    # ------------------------------------------------------------------
+    def visit(self, n:Binary):
         name = self.name()
-        self.dot.node(name, label="Binary\\nAssignment")
-        self.dot.edge(name, n.left.accept(self))
-        self.dot.edge(name, n.right.accept(self))
+        self.dot.node(name, label=f"Binary\\nop='{n.op}'")
+        self.children(name, [ n.left, n.right ])
         return name
 
     def visit(self, n:Unary):
         name = self.name()
-        self.dot.node(name, label=f"Unary\\nop='{n.op}")
-        self.dot.edge(name, n.expr.accept(self))
+        self.dot.node(name, label=f"Unary\\nop='{n.op}'")
+        self.children(name, [ n.expr ])
+        return name
+
+    def visit(self, n:Call):
+        name = self.name()
+        self.dot.node(name, label='Call')
+        self.children(name, [ n.func ], label='func')
+        self.children(name, n.args)
+        return name
+
+    def visit(self, n:Index):
+        name = self.name()
+        self.dot.node(name, label='Index')
+        self.children(name, [ n.expr, n.index ])
         return name
 
+    def visit(self, node:Variable):
+        name = self.name()
+        self.dot.node(name, label=f"Variable\\nname='{node.name}'")
+        return name
 
-    
-    def visit(self, n:Literal):
+    def visit(self, node:Literal):
         name = self.name()
-        self.dot.node(name, label=f"Literal\\nname='{n.value}")
+        self.dot.node(name, label=f"Literal\\nvalue={node.value}")
         return name
-    
-    # DECLARACIONES
+
+
+def render_files(fnames, outdir, jobs=None, queue_size=None, **options):
+    '''
+    Genera outdir/<archivo>.dot y outdir/<archivo>.svg para cada archivo.
+
+    El hilo principal analiza cada archivo y escribe su DOT en disco
+    (RenderAST.stream); un grupo de `jobs` hilos ejecuta `dot -Tsvg` sobre
+    esos archivos.  La cola entre ambos es acotada: si los procesos dot
+    van atrasados, el analisis espera en lugar de acumular trabajo.
+
+    Devuelve la lista de errores (uno por archivo que fallo).
     '''
+    import os
+    import queue
+    import subprocess
+    import threading
+
+    jobs   = jobs or os.cpu_count() or 1
+    work   = queue.Queue(maxsize=queue_size or 2 * jobs)
+    errors = []
+
+    def worker():
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            dotfile, svgfile = item
+            try:
+                proc = subprocess.run(['dot', '-Tsvg', dotfile, '-o', svgfile],
+                                      capture_output=True, text=True)
+            except OSError as e:
+                errors.append(f'{dotfile}: {e}')
+                continue
+            if proc.returncode:
+                errors.append(f'{dotfile}: {proc.stderr.strip()}')
 
+    os.makedirs(outdir, exist_ok=True)
+    threads = [ threading.Thread(target=worker, daemon=True) for _ in range(jobs) ]
+    for t in threads:
+        t.start()
+    try:
+        for fname in fnames:
+            try:
+                ast = Parser().parse(Lexer().tokenize(open(fname, encoding='utf-8').read()))
+            except SyntaxError:
+                errors.append(f'{fname}: error de sintaxis')
+                continue
+            base = os.path.join(outdir, os.path.splitext(os.path.basename(fname))[0])
+            with open(base + '.dot', 'w', encoding='utf-8') as f:
+                RenderAST.stream(ast, f, **options)
+            work.put((base + '.dot', base + '.svg'))
+    finally:
+        for _ in threads:
+            work.put(None)
+        for t in threads:
+            t.join()
+    return errors
 
 
 if __name__ == '__main__':
+    import argparse
     import sys
-    
-    if len(sys.argv) != 2:
-        print(f"usage: python {sys.argv[0]} [ fname1 [ fname2 ... ] ]   --ast")
-        exit(1)
-    
+
+    ap = argparse.ArgumentParser(description='Dibuja el AST de programas MiniC con Graphviz')
+    ap.add_argument('fnames', nargs='+')
+    ap.add_argument('--stream', metavar='OUT', help='escribir el DOT en OUT (- para stdout) sin construirlo en memoria')
+    ap.add_argument('--svg', metavar='DIR', help='generar DIR/<archivo>.svg para cada archivo en paralelo')
+    ap.add_argument('--jobs', type=int, help='procesos dot simultaneos (por defecto, uno por CPU)')
+    ap.add_argument('--depth', type=int, help='profundidad maxima')
+    ap.add_argument('--children', type=int, help='hijos maximos por nodo')
+    ap.add_argument('--collapse', action='store_true', help='dibujar una sola vez las subexpresiones repetidas')
+    args = ap.parse_args()
+
+    options = dict(max_depth=args.depth, max_children=args.children, collapse=args.collapse)
+
+    if args.svg:
+        errors = render_files(args.fnames, args.svg, jobs=args.jobs, **options)
+        for msg in errors:
+            print(f'[red]{msg}[/red]', file=sys.stderr)
+        exit(1 if errors else 0)
+
+    if len(args.fnames) != 1:
+        ap.error('se requiere un solo archivo sin --svg')
 
     l = Lexer()
     p = Parser()
-    
-    data = open(sys.argv[1], encoding='utf-8').read()
 
-    ast = p.parse(l.tokenize(data))
-    dot = RenderAST.render(ast)
-    #dot = RenderAST()
-    #ast.accept(dot)
+    data = open(args.fnames[0], encoding='utf-8').read()
 
-    print(dot)
-    
\ No newline at end of file
+    ast = p.parse(l.tokenize(data))
+    if args.stream:
+        if args.stream == '-':
+            RenderAST.stream(ast, sys.stdout, **options)
+        else:
+            with open(args.stream, 'w', encoding='utf-8') as f:
+                RenderAST.stream(ast, f, **options)
+    else:
+        dot = RenderAST.render(ast, **options)
+        print(dot)